@@ -2,7 +2,7 @@
 #Standard Python
 import os, sys, time, datetime, Queue, threading
 from warnings import warn
-from Queue import Queue
+from Queue import Queue, Full
 #3rd party
 import numpy as np
 try:
@@ -15,7 +15,11 @@ from automat.core.hwcontrol.config.configuration import Configuration
 #yes_o2ab framework provided
 import yes_o2ab.pkg_info
 from yes_o2ab.core.data_processing.spectrum_dataset   import SpectrumDataSet
-from yes_o2ab.core.data_processing.conditions_dataset import ConditionsDataSet
+from yes_o2ab.core.data_processing.conditions_dataset import ConditionsDataSet, CONDITIONS_CHANNEL_NAMES
+from yes_o2ab.core.data_processing.frame_stacking     import FrameCoAdder
+from yes_o2ab.core.data_processing.spectrum_extraction import SpectrumExtractor, frame_geometry
+from yes_o2ab.core.buffers.time_series_buffer         import TieredTimeSeries
+from yes_o2ab.core.storage.csv_backup                 import AppendingCSVWriter
 #application local
 from   errors import ConfigurationError, DeviceError
 ###############################################################################
@@ -30,7 +34,8 @@ YES O2AB Control %(version)s
 #Common Definitions
 from ..common_defs import FRAMETYPE_DEFAULT, EXPOSURE_TIME_DEFAULT,\
     RBI_NUM_FLUSHES_DEFAULT, RBI_EXPOSURE_TIME_DEFAULT, REPEAT_DELAY_DEFAULT,\
-    CCD_TEMP_SETPOINT_DEFAULT
+    CCD_TEMP_SETPOINT_DEFAULT, COADD_CLIP_SIGMA_DEFAULT, COADD_QUEUE_SIZE,\
+    CONDITIONS_HISTORY_CAPACITY, CONDITIONS_HISTORY_TIERS, CONDITIONS_BACKUP_MAX_ROWS
     
 FOCUSER_CENTER_POS = 3500
 ###############################################################################
@@ -94,9 +99,10 @@ class Application:
         self.devices     = OrderedDict()
         self.controllers = OrderedDict()
         self.metadata = OrderedDict()
-        #structures for holding conditions data
-        self.conditions_Ydata = OrderedDict()
-        self.conditions_sample_times = []
+        #bounded history of the conditions data, downsampled for long runs
+        self.conditions_history = TieredTimeSeries(CONDITIONS_HISTORY_CAPACITY,
+                                                   tiers = CONDITIONS_HISTORY_TIERS)
+        self.conditions_backup  = None
         #create thread initeraction objects
         self.event_queue = Queue()
         self.abort_event = threading.Event()
@@ -104,6 +110,18 @@ class Application:
         #spectral attributes
         self.last_raw_spectrum           = None
         self.background_spectrum_dataset = None
+        #the extraction weights are set up once and reused for every frame
+        self.spectrum_extractor = SpectrumExtractor.from_config(self.config.get('spectrum_extraction', None))
+        #running stack of captured frames, only if enabled in the config
+        coadd_settings = self.config.get('coadding', {})
+        self.coadding_enabled = bool(int(coadd_settings.get('enabled', 0)))
+        self.coadd_clip_sigma = float(coadd_settings.get('clip_sigma', COADD_CLIP_SIGMA_DEFAULT))
+        self.frame_coadder = None
+        self.coadd_geometry = None #readout geometry of the stacked frames
+        self.coadd_frames_dropped = 0
+        self._coadd_queue  = None
+        self._coadd_thread = None
+        self._coadd_lock   = threading.Lock()
         
     def initialize(self):
         for handle in self.USED_CONTROLLERS:
@@ -218,6 +236,8 @@ class Application:
         self.metadata['exposure_time']     = int(image_capture.configuration['exposure_time'])
         self.metadata['rbi_num_flushes']   = int(image_capture.configuration['rbi_num_flushes'])
         self.metadata['rbi_exposure_time'] = int(image_capture.configuration['rbi_exposure_time'])
+        self.metadata['hbin']              = int(image_capture.configuration['hbin'])
+        self.metadata['vbin']              = int(image_capture.configuration['vbin'])
         self.metadata['flatfield_state']   = flatfield_state
         self.metadata['band']              = band
         self.metadata['filt_pos']          = filt_pos
@@ -271,13 +291,17 @@ class Application:
             image_capture.start() #this should not block
             
             
-    def compute_raw_spectrum(self, I = None):
+    def compute_raw_spectrum(self, I = None, geometry = None):
+        """extract the spectrum of the image 'I' read out with 'geometry', by
+           default the last image captured
+        """
         image_capture = self.load_controller('image_capture')
         if I is None:
             I = image_capture.last_image
+            geometry = frame_geometry(image_capture.last_image_info)
         S = None
         if not I is None:
-            S = I.sum(axis=0)
+            S = self.spectrum_extractor.extract(I, geometry = geometry)
         #cache the last spectrum and image
         self.last_image    = I
         self.last_raw_spectrum = S
@@ -285,6 +309,116 @@ class Application:
     
     def get_last_image(self):
         return self.last_image
+        
+    def start_coadding(self):
+        """start a new co-added stack filled by a background thread, returns
+           False if co-adding is not enabled in the config
+        """
+        if not self.coadding_enabled:
+            return False
+        self.stop_coadding()
+        with self._coadd_lock:
+            if self.frame_coadder is None:
+                self.frame_coadder = FrameCoAdder(clip_sigma = self.coadd_clip_sigma)
+            else:
+                self.frame_coadder.reset() #the buffers are reused
+        self.coadd_frames_dropped = 0
+        self._coadd_queue  = Queue(maxsize = COADD_QUEUE_SIZE)
+        self._coadd_thread = threading.Thread(target = self._coadd_loop,
+                                              args   = (self._coadd_queue,),
+                                              name   = "FrameCoAdder",
+                                             )
+        self._coadd_thread.daemon = True
+        self._coadd_thread.start()
+        return True
+
+    def stop_coadding(self):
+        "fold in the images still queued and stop the co-adding thread"
+        if self._coadd_thread is None:
+            return
+        self._coadd_queue.put(None)
+        self._coadd_thread.join()
+        self._coadd_queue  = None
+        self._coadd_thread = None
+
+    def coadd_image(self, I, geometry = None):
+        """queue the image, read out with 'geometry', to be folded into the
+           co-added stack, 'I' must not be changed afterwards; returns False if
+           co-adding is not running or the image was dropped because the stack
+           has fallen behind
+        """
+        if self._coadd_queue is None:
+            return False
+        try:
+            self._coadd_queue.put_nowait((I, geometry))
+        except Full:
+            self.coadd_frames_dropped += 1
+            return False
+        return True
+
+    def _coadd_loop(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            I, geometry = item
+            try:
+                with self._coadd_lock:
+                    if not self.frame_coadder.shape in (None, I.shape) or \
+                       (self.frame_coadder.count > 0 and geometry != self.coadd_geometry):
+                        #the readout geometry changed, so start over
+                        self.frame_coadder = FrameCoAdder(clip_sigma = self.coadd_clip_sigma)
+                    self.coadd_geometry = geometry
+                    self.frame_coadder.add(I)
+            except Exception, exc:
+                self.print_comment("co-adding an image failed: %s" % exc)
+
+    def get_coadded_count(self):
+        if self.frame_coadder is None:
+            return 0
+        return self.frame_coadder.count
+
+    def get_coadded_image(self):
+        if self.frame_coadder is None:
+            return None
+        with self._coadd_lock:
+            return self.frame_coadder.get_coadded_image()
+        
+    def get_coadded_variance(self):
+        if self.frame_coadder is None:
+            return None
+        with self._coadd_lock:
+            return self.frame_coadder.get_variance()
+        
+    def get_coadded_spectrum(self):
+        I = self.get_coadded_image()
+        if I is None:
+            return None
+        return self.spectrum_extractor.extract(I, geometry = self.coadd_geometry)
+
+    def export_coadded_image(self, filename):
+        """save the co-added image, its per-pixel variance and counts, and
+           the spectrum extracted from it to the numpy archive 'filename'
+        """
+        with self._coadd_lock:
+            coadder = self.frame_coadder
+            if coadder is None or coadder.count == 0:
+                raise ValueError("there is no co-added image to export")
+            I = coadder.get_coadded_image()
+            V = coadder.get_variance()
+            counts = coadder.get_counts().copy()
+            num_frames   = coadder.count
+            num_rejected = coadder.num_rejected
+            geometry     = self.coadd_geometry
+        np.savez(filename,
+                 image        = I,
+                 variance     = V,
+                 counts       = counts,
+                 spectrum     = self.spectrum_extractor.extract(I, geometry = geometry),
+                 num_frames   = num_frames,
+                 num_rejected = num_rejected,
+                 clip_sigma   = self.coadd_clip_sigma,
+                )
             
     def get_raw_spectrum(self):
         return self.last_raw_spectrum
@@ -363,8 +497,9 @@ class Application:
         """export the conditions in a data format matching the file extension
            valid extensions: .csv 
         """
-        Ys = [Y for key, Y in self.conditions_Ydata.items()]
-        t  = np.array(self.conditions_sample_times)
+        history = self.conditions_history.select() #finest tier covering the run
+        Ys = history.get_columns().values()
+        t  = history.get_times()
         
         dataset = ConditionsDataSet(t,Ys)
         
@@ -377,13 +512,45 @@ class Application:
         else:
             raise ValueError("the filename extension was not recognized, it must end with: .csv, .db, or .hd5")
         
+    def backup_conditions(self, filename):
+        """append the latest conditions sample to the backup CSV 'filename',
+           a new or rotated backup file starts with the raw samples held so far
+        """
+        writer = self.conditions_backup
+        if writer is None or writer.filename != filename:
+            if not writer is None:
+                writer.close()
+            writer = AppendingCSVWriter(filename, max_rows = CONDITIONS_BACKUP_MAX_ROWS)
+            self.conditions_backup = writer
+        if len(self.conditions_history) == 0:
+            return
+        #only raw samples are written, never the downsampled tiers
+        raw = self.conditions_history.get_tier(0)
+        if not writer.is_started():
+            columns = raw.get_columns()
+            writer.start(self._get_conditions_names(columns.keys()), raw.get_times(), columns.values())
+        elif writer.needs_rotation():
+            writer.rotate(raw.get_times(), raw.get_columns().values())
+        else:
+            t   = raw.get_times()[-1]
+            row = [Y[-1] for Y in raw.get_columns().values()]
+            writer.append(t, row)
+
+    def _get_conditions_names(self, keys):
+        "the export labels when the channels match the control app fields"
+        if len(keys) == len(CONDITIONS_CHANNEL_NAMES):
+            return CONDITIONS_CHANNEL_NAMES
+        return keys
+
     def clear_conditions_data(self):
         """export the conditions in a data format matching the file extension
            valid extensions: .csv 
         """
-        #structures for holding conditions data
-        self.conditions_Ydata = OrderedDict()
-        self.conditions_sample_times = []
+        self.conditions_history.clear()
+        if not self.conditions_backup is None:
+            #the backup file is started anew at the next sample
+            self.conditions_backup.close()
+            self.conditions_backup = None
 
     def select_band(self, band, blocking = True):
         "run the band switcher "
@@ -5,6 +5,15 @@ RBI_NUM_FLUSHES_DEFAULT   = 0
 RBI_EXPOSURE_TIME_DEFAULT = 500
 REPEAT_DELAY_DEFAULT      = 10
 CCD_TEMP_SETPOINT_DEFAULT = 25
+COADD_CLIP_SIGMA_DEFAULT  = 5.0
+COADD_QUEUE_SIZE          = 4    #images waiting on the co-adding thread before new ones are dropped
+
+#Conditions history: raw samples kept, then (bin interval seconds, bins kept)
+CONDITIONS_HISTORY_CAPACITY = 21600
+CONDITIONS_HISTORY_TIERS    = [(60.0, 10080), (3600.0, 8760)]
+#the backup file is rotated at this many rows, so it is rewritten only once
+#per CONDITIONS_HISTORY_CAPACITY samples appended
+CONDITIONS_BACKUP_MAX_ROWS  = 2*CONDITIONS_HISTORY_CAPACITY
 
 #Font Styles
 FIELD_LABEL_FONT      = "Courier 10 normal"
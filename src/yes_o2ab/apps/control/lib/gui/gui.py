@@ -1,6 +1,6 @@
 ###############################################################################
 #Standard Python provided
-import os, time, datetime, signal, socket, shelve, re
+import os, time, datetime, signal, socket, shelve, re, Queue
 import Tkinter as tk
 import ttk
 #Standard or substitute
@@ -15,7 +15,6 @@ import Pmw
 from numpy import array, arange, savetxt
 import numpy as np
 from FileDialog import SaveFileDialog, LoadFileDialog
-import scipy.misc
 #Automat framework provided
 from automat.core.gui.text_widgets           import TextDisplayBox
 from automat.core.gui.pmw_custom.entry_form  import EntryForm
@@ -24,6 +23,9 @@ from automat.core.plotting.tk_embedded_plots import EmbeddedFigure
 #yes_o2ab framework provided
 from yes_o2ab.core.plotting.spectra          import RawSpectrumPlot, ProcessedSpectrumPlot
 from yes_o2ab.core.plotting.temperature      import TemperaturePlot
+from yes_o2ab.core.buffers.frame_ring_buffer import resolve_image
+from yes_o2ab.core.data_processing.spectrum_extraction import frame_geometry
+from yes_o2ab.apps.lib.event_sink            import EventSink, render_event_brief
 #application local
 from condition_fields        import ConditionFields
 from capture_settings_dialog import CaptureSettingsDialog
@@ -37,7 +39,7 @@ from ..common_defs import FRAMETYPE_DEFAULT, EXPOSURE_TIME_DEFAULT,\
 
 WINDOW_TITLE      = "YES O2AB Control"
 WAIT_DELAY        = 100 #milliseconds
-TEXT_BUFFER_SIZE  = 10*2**20 #ten megabytes
+TEXT_BUFFER_SIZE  = 2**20 #one megabyte of scrollback
 SPECTRAL_FIGSIZE  = (6,5) #inches
 SPECTRUM_PLOT_STYLE = 'r-'
 SPECTRUM_BACKGROUND_PLOT_STYLE = 'b-'
@@ -340,6 +342,7 @@ class GUI:
         self.import_background_spectrum_button.pack(side='left',anchor="sw")
         #create an tk embedded figure for spectral display
         self.processed_spectrum_plot_template = ProcessedSpectrumPlot()
+        self._processed_spectrum_buffer = None
         self.processed_spectrum_figure_widget = EmbeddedFigure(tab2, figsize=SPECTRAL_FIGSIZE)
         self.processed_spectrum_figure_widget.pack(side='top',fill='both', expand='yes')
         self.replot_processed_spectrum_button = tk.Button(tab2,text='Replot Spectrum',command = self.replot_processed_spectrum, state='disabled', width = BUTTON_WIDTH)
@@ -351,6 +354,9 @@ class GUI:
         self.photo_label_widget.pack(side='top',fill='both', expand='yes')
         self.save_image_button = tk.Button(tab3,text='Save Image',command = self.save_image, state='disabled', width = BUTTON_WIDTH)
         self.save_image_button.pack(side='bottom',anchor="sw")
+        self.export_coadded_button = tk.Button(tab3,text='Export Co-added',command = self.export_coadded_image, state='disabled', width = BUTTON_WIDTH)
+        if self.app.coadding_enabled:
+            self.export_coadded_button.pack(side='bottom',anchor="sw")
         #create an tk embedded figure for temperature display
         self.temperature_plot_template = TemperaturePlot()
         self.temperature_figure_widget = EmbeddedFigure(tab4, figsize=TEMPERATURE_FIGSIZE)
@@ -403,6 +409,11 @@ class GUI:
         tk.Label(right_panel, text="Events Monitoring:", font = HEADING_LABEL_FONT).pack(side='top',anchor="w")
         self.text_display  = TextDisplayBox(right_panel,text_height=15, buffer_size = TEXT_BUFFER_SIZE)
         self.text_display.pack(side='left',fill='both',expand='yes')
+        #events are formatted by the sink thread and inserted by the GUI loop
+        self._event_text_queue = Queue.Queue()
+        self.event_sink = EventSink(writers = [self._event_text_queue.put],
+                                    render  = render_event_brief,
+                                   )
         #finish building the right panel
         right_panel.pack(fill='both', expand='yes',side='right', padx = 10)
         #-----------------------------------------------------------------------
@@ -420,7 +431,9 @@ class GUI:
         self.flush_event_queues()
         #reveal the main window
         self.win.deiconify()
+        self._display_event_text_loop()
         self.win.mainloop()
+        self.event_sink.close()
         NoticeKeyboardInterrupt()
         
     def flush_event_queues(self):
@@ -628,6 +641,9 @@ class GUI:
         #refresh the metdata
         self.app.query_metadata()
         self.app.print_comment("Starting image capture loop with repeat delay %d seconds." % (delay,))
+        #co-add the frames of this loop in the background, if enabled
+        if self.app.start_coadding():
+            self.export_coadded_button.config(state='disabled')
         image_capture.start() #should not block
         #schedule loop
         self._capture_continually_loop()
@@ -650,8 +666,14 @@ class GUI:
                 self.capture_time_left_field.setvalue("%d" % round(time_left))
             elif event == "IMAGE_CAPTURE_EXPOSURE_COMPLETED":
                 #grab the image, comput the spectrum, then update them
-                I = info['image_array']
-                S = self.app.compute_raw_spectrum(I)
+                #a copy, the image is kept as the last image and co-added
+                I = resolve_image(info, copy = True)
+                if I is None:
+                    #the frame buffer has already been reused, a newer frame follows
+                    continue
+                geometry = frame_geometry(info)
+                S = self.app.compute_raw_spectrum(I, geometry = geometry)
+                self.app.coadd_image(I, geometry = geometry) #queued, does nothing if not co-adding
                 B = self.app.get_background_spectrum()
                 self._update_raw_spectrum_plot(S=S,B=B)
                 self._update_processed_spectrum_plot(S=S,B=B)
@@ -678,6 +700,13 @@ class GUI:
             self.tracking_goto_coords_button.config(state='normal')
             #data can now be exported
             self.export_raw_spectrum_button.config(state='normal')
+            if self.app.coadding_enabled:
+                self.app.stop_coadding()
+                count = self.app.get_coadded_count()
+                self.app.print_comment("co-added %d frames (%d dropped while the stack was behind)" % 
+                                       (count, self.app.coadd_frames_dropped))
+                if count > 0:
+                    self.export_coadded_button.config(state='normal')
             #do not reschedule loop
 
     def capture_stop(self):
@@ -1068,7 +1097,7 @@ class GUI:
             self.tracking_fields['elevation'].setvalue(elevation)
                 
     def replot_raw_spectrum(self):
-        self.raw_spectrum_plot_template._has_been_plotted = False
+        self.raw_spectrum_plot_template.reset_incremental()
         S = self.app.get_raw_spectrum()
         B = self.app.get_background_spectrum()
         self._update_raw_spectrum_plot(S=S,B=B)
@@ -1116,7 +1145,7 @@ class GUI:
             self.app.print_comment("cancelled")
             
     def replot_processed_spectrum(self):
-        self.processed_spectrum_plot_template._has_been_plotted = False
+        self.processed_spectrum_plot_template.reset_incremental()
         S = self.app.get_raw_spectrum()
         B = self.app.get_background_spectrum()
         self._update_processed_spectrum_plot(S=S,B=B)
@@ -1165,10 +1194,31 @@ class GUI:
                            key = None
                           )
         if filename:
+            import scipy.misc #only needed here, slow to import
             I = self.app.last_image
             img = scipy.misc.toimage(I,mode='I') #convert  to 16-bit greyscale
             img.save(filename)
             
+    def export_coadded_image(self):
+        self.app.print_comment("Exporting co-added image...")
+        dt_now = datetime.datetime.utcnow()
+        dt_now_str = dt_now.strftime("%Y-%m-%d-%H_%M_%S")
+        #get some metadata for title
+        frametype = self.app.last_capture_metadata['frametype']
+        exptime   = int(self.app.last_capture_metadata['exposure_time'])
+        default_filename = "%s_coadded-%s_exptime=%dms_n=%d.npz" % (dt_now_str,frametype,exptime,self.app.get_coadded_count()) 
+        fdlg = SaveFileDialog(self.win,title="Save Co-added Image Data")
+        userdata_path = self.app.config['paths']['data_dir']    
+
+        filename = fdlg.go(dir_or_file = userdata_path, 
+                           pattern="*.npz", 
+                           default=default_filename, 
+                           key = None
+                          )
+        if filename:
+            self.app.export_coadded_image(filename)
+        self.app.print_comment("finished")
+            
     def export_conditions(self):
         self.app.print_comment("Exporting conditions data...")
         dt_now = datetime.datetime.utcnow()
@@ -1213,73 +1263,42 @@ class GUI:
         figure        = self.raw_spectrum_figure_widget.get_figure()
         plot_template = self.raw_spectrum_plot_template
         title = "Raw Spectrum"
-        self.raw_spectrum_plot_template.configure(title=title)
-        if (not plot_template.has_been_plotted()): 
-            self.app.print_comment("Replotting the Raw Spectrum.")
-            figure.clear()
-            Xs = []
-            Ys = []
-            styles = []
-            labels = []
-            #raw spectrum
-            if S is None:
-                S = np.zeros_like(B)
-                Xs.append(np.arange(len(S)))
-                Ys.append(S)
-                styles.append(SPECTRUM_PLOT_STYLE)
-                labels.append("None")
-            else:
-                #get some metadata for label formatting
-                frametype = self.app.metadata['frametype']
-                exptime   = int(self.app.metadata['exposure_time'])
-                label     = "raw-%s, exptime = %d ms" % (frametype, exptime)
-                Xs.append(np.arange(len(S)))
-                Ys.append(S)
-                styles.append(SPECTRUM_PLOT_STYLE)
-                labels.append(label)
-            #background
-            if not B is None:
-                Xs.append(np.arange(len(B)))
-                Ys.append(B)
-                styles.append(SPECTRUM_BACKGROUND_PLOT_STYLE)
-                label = "background"
-                labels.append(label)
-            plot_template.plot(Xs, Ys, styles = styles, labels = labels, figure = figure)
-            self.raw_spectrum_figure_widget.update()
+        Ys = []
+        styles = []
+        labels = []
+        #raw spectrum
+        if S is None:
+            S = np.zeros_like(B)
+            label = "None"
         else:
-            #get the plot line from the figure FIXME is there an easier way?
-            axis = figure.axes[0]
-            line0 = axis.lines[0]
-            line0.set_ydata(S)
             #get some metadata for label formatting
             frametype = self.app.metadata['frametype']
             exptime   = int(self.app.metadata['exposure_time'])
             label     = "raw-%s, exptime = %d ms" % (frametype, exptime)
-            line0.set_label(label)
-            try:
-                line1 = axis.lines[1]
-                line1.set_label("background")
-            except IndexError:
-                pass
-            axis.legend()
-            self.app.print_comment("Updating Raw Spectrum data: %s" % label)
-            #figure.axes[0].set_title(title)
-            self.raw_spectrum_figure_widget.update()
+        Ys.append(S)
+        styles.append(SPECTRUM_PLOT_STYLE)
+        labels.append(label)
+        #background
+        if not B is None:
+            Ys.append(B)
+            styles.append(SPECTRUM_BACKGROUND_PLOT_STYLE)
+            labels.append("background")
+        self.app.print_comment("Updating Raw Spectrum data: %s" % label)
+        #the lines persist between frames, the legend and title are only
+        #redrawn when they change
+        plot_template.update_spectra(Ys, labels = labels, styles = styles, title = title, figure = figure)
             
     def _update_processed_spectrum_plot(self, S, B):
         if not (S is None or B is None):
             figure        = self.processed_spectrum_figure_widget.get_figure()        
             plot_template = self.processed_spectrum_plot_template
             title = "Processed Spectrum"
-            self.raw_spectrum_plot_template.configure(title=title)
-            self.app.print_comment("Replotting the Processed Spectrum.")
-            figure.clear()
-            C = S - B
-            X = np.arange(len(C))
-            Xs = [X]
-            Ys = [C]
-            plot_template.plot(Xs, Ys, figure = figure)
-            self.processed_spectrum_figure_widget.update()
+            #subtract into a buffer kept between frames
+            C = self._processed_spectrum_buffer
+            if C is None or C.shape != S.shape:
+                C = self._processed_spectrum_buffer = np.empty(S.shape, dtype = np.result_type(S, B))
+            np.subtract(S, B, out = C)
+            plot_template.update_spectra([C], title = title, figure = figure)
 #            else:
 #                self.app.print_comment("Updating processed Spectrum data.")
 #                #get the plot line from the figure FIXME is there an easier way?
@@ -1370,7 +1389,7 @@ class GUI:
             condition_monitor = self.app.load_controller('condition_monitor')
             interval = int(self.monitor_interval_field.getvalue())
             sample = condition_monitor.acquire_sample()
-            self.app.conditions_sample_times.append(time.time())
+            sample_time = time.time()
             dt_now = datetime.datetime.utcnow()
             dt_now_str = dt_now.strftime("%Y-%m-%d-%H:%M:%S")
             #read out all pending events
@@ -1380,16 +1399,17 @@ class GUI:
             #update all the widgets
             self.condition_fields.sample_datetime_field.setvalue(dt_now_str)
             if not sample is None: #could fail on mutex lockout
+                #the history columns follow the order of the fields
+                values = OrderedDict()
                 for key, widget in self.condition_fields.fields.items():
                     val = sample[key]
-                    data_list = self.app.conditions_Ydata.get(key,[])
-                    data_list.append(val)
-                    self.app.conditions_Ydata[key] = data_list
+                    values[key] = val
                     val_str = "%0.2f" % val
                     widget.setvalue(val_str)
+                self.app.conditions_history.append(sample_time, values)
+                self.app.backup_conditions(CONDITIONS_BACKUP_FILENAME) #append to the backup
             #now update the plot
             self._update_conditions_plot()
-            self.app.export_conditions(CONDITIONS_BACKUP_FILENAME) #write a backup
             self.export_conditions_button.config(state='normal') #data can now be exported
             #reschedule loop
             interval_ms = interval*1000  #milliseconds
@@ -1403,34 +1423,46 @@ class GUI:
         #get some metadata for plot formatting
         #title     = "Raw Spectrum (%s, %d ms)"
         #self.raw_spectrum_plot_template.configure(title=title)
-        self.app.print_comment("Replotting the temperature graph.")
-        figure.clear()
         labels = []
         Xs = []
         Ys = []
         X = []
-        if self.app.conditions_sample_times:
-            X = array(self.app.conditions_sample_times)
-            X -= X[0] #make relative to start
-            X /= 60.0 #convert to minutes
+        #views of the finest history tier that covers the whole run
+        history = self.app.conditions_history.select()
+        if len(history) > 0:
+            X = history.get_times()
+            X = (X - X[0])/60.0 #make relative to start in minutes, a new array
         for key, widget in self.condition_fields.fields.items():
             if key.endswith('_temp'):
                 labels.append(key[:-len('_temp')]) #peel off the '_temp'
-                Y = self.app.conditions_Ydata.get(key,[])
+                Y = []
+                if len(history) > 0:
+                    Y = history.get_column(key)
                 Xs.append(X)
                 Ys.append(Y)
-        plot_template.plot(Xs, Ys, labels=labels, figure=figure)
-        self.temperature_figure_widget.update()
+        #only the line data changes, the figure is built once
+        plot_template.update_incremental(Xs, Ys, labels=labels, figure=figure)
 
     def print_to_text_display(self, text, eol='\n'):
         self.text_display.print_text(text, eol=eol) 
         
+    def print_comment_text(self, text):
+        #comments take the same path as events to keep them in order
+        self.event_sink.submit_text(text)
+
     def print_event(self, event, info = {}):
-        buff = ["%s:" % event]
-        for key,val in info.items():
-            buff.append("%s: %s" % (key,val))
-        buff = "\n".join(buff)
-        self.print_to_text_display(buff)
+        #rate limited and formatted off the GUI thread
+        self.event_sink.submit(event, info)
+
+    def _display_event_text_loop(self):
+        #the text widget must only be touched from the GUI thread
+        while True:
+            try:
+                text = self._event_text_queue.get_nowait()
+            except Queue.Empty:
+                break
+            self.print_to_text_display(text)
+        self.win.after(WAIT_DELAY, self._display_event_text_loop)
 
     def _load_settings(self):
         if os.path.exists(SETTINGS_FILEPATH):
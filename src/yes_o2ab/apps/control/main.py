@@ -7,6 +7,10 @@ from yes_o2ab.apps.lib.errors import handleCrash
 def main():
     ###########################################################################
     import sys
+    #start timing the imports before the application modules are loaded
+    from yes_o2ab.apps.lib.startup_profiler import StartupProfiler
+    profiler = StartupProfiler(enabled = '--profile-startup' in sys.argv)
+    profiler.install()
     #application local
     from lib.gui.gui                 import GUI
     from lib.application.application import Application
@@ -21,13 +25,17 @@ def main():
                     help="remain bound to terminal session")
     OP.add_option("--ignore-device-errors", dest="ignore_device_errors", default=False, action = 'store_true', 
                     help="ignore initial device errors")             
+    OP.add_option("--profile-startup", dest="profile_startup", default=False, action = 'store_true', 
+                    help="report the import and loading times")
     opts, args = OP.parse_args()
       
     #initialize the control application
-    app = Application(skip_test = opts.skip_test,
-                      ignore_device_errors = opts.ignore_device_errors,
-                     )
-    app.initialize()
+    with profiler.timed("application"):
+        app = Application(skip_test = opts.skip_test,
+                          ignore_device_errors = opts.ignore_device_errors,
+                         )
+    with profiler.timed("initialize controllers"):
+        app.initialize()
     if opts.detach:
         #detach the process from its controlling terminal
         from automat.system_tools.daemonize import detach 
@@ -35,9 +43,13 @@ def main():
         app.print_comment("You may now close the terminal window...")   
         detach()
     #start the graphical interface
-    gui = GUI(app)
+    with profiler.timed("GUI"):
+        gui = GUI(app)
+    if profiler.enabled:
+        profiler.uninstall()
+        app.print_comment(profiler.report())
     #give the app the ability to print to the GUI's textbox
-    app.setup_textbox_printer(gui.print_to_text_display)
+    app.setup_textbox_printer(gui.print_comment_text)
     #launch the app
     
     gui.launch()
@@ -7,6 +7,10 @@ from yes_o2ab.apps.lib.errors import handleCrash
 def main():
     ###########################################################################
     import sys
+    #start timing the imports before the application modules are loaded
+    from yes_o2ab.apps.lib.startup_profiler import StartupProfiler
+    profiler = StartupProfiler(enabled = '--profile-startup' in sys.argv)
+    profiler.install()
     #application local
     #from lib.gui.gui                 import GUI
     from lib.application.application import Application
@@ -21,18 +25,31 @@ def main():
                     help="skip over device tests")
     OP.add_option("--ignore-device-errors", dest="ignore_device_errors", default=False, action = 'store_true', 
                     help="ignore initial device errors")             
+    OP.add_option("--event-log-durability", dest="event_log_durability", default=None,
+                    type='choice', choices=['none','interval','batch','event'],
+                    help="when the events file is synced to disk: none, interval, batch or event (default from config, else interval)")
+    OP.add_option("--concurrent-startup", dest="concurrent_startup", default=None, action = 'store_true', 
+                    help="load and test independent devices in parallel (default from config, else sequential)")
+    OP.add_option("--profile-startup", dest="profile_startup", default=False, action = 'store_true', 
+                    help="report the import and loading times")
     opts, args = OP.parse_args()
       
     #initialize the control application
-    app = Application(skip_test = opts.skip_test,
-                      ignore_device_errors = opts.ignore_device_errors,
-                     )
+    with profiler.timed("application"):
+        app = Application(skip_test = opts.skip_test,
+                          ignore_device_errors = opts.ignore_device_errors,
+                          event_log_durability = opts.event_log_durability,
+                          concurrent_startup   = opts.concurrent_startup,
+                          startup_profiler     = profiler,
+                         )
     if opts.detach:
         #detach the process from its controlling terminal
         from automat.system_tools.daemonize import detach 
         app.print_comment("Process Detached.")
         app.print_comment("You may now close the terminal window...")   
         detach()
+        #threads do not survive the fork
+        app.event_sink.start()
 #    #start the graphical interface
 #    gui = GUI(app)
 #    #give the app the ability to print to the GUI's textbox
@@ -2,6 +2,7 @@
 #Standard Python
 import os, sys, time, datetime, Queue, threading
 from warnings import warn
+from multiprocessing.pool import ThreadPool
 try:
     from collections import OrderedDict
 except ImportError:
@@ -12,6 +13,9 @@ from automat.core.hwcontrol.config.configuration import Configuration
 #from automat.services.configurator import ConfiguratorService
 #yes_o2ab framework provided
 from yes_o2ab.core.events.event_parser import EventParser
+from yes_o2ab.core.storage.event_log   import COMPRESSION_LEVEL, CHUNK_SIZE
+from yes_o2ab.apps.lib.event_sink      import EventSink, render_event_yaml
+from yes_o2ab.apps.lib.startup_profiler import StartupProfiler
 import yes_o2ab.pkg_info
 #application local
 from   event_caching_process      import EventCachingProcess
@@ -27,6 +31,7 @@ YES O2AB Launcher %(version)s
 
 DEFAULT_SEARCHPATHS = ['.', yes_o2ab.pkg_info.platform['config_filedir']]
 MAIN_LOOP_DELAY = 0.100
+STARTUP_MAX_WORKERS = 8
 ###############################################################################
 #Helper Functions
 def stream_print(text, 
@@ -40,6 +45,42 @@ def stream_print(text,
         if eol:
             stream.write(eol)
         stream.flush()
+
+def get_device_dependencies(devices_config):
+    """ returns an OrderedDict of each device handle to the handles of the
+        devices it names in its '[[[ devices ]]]' subsection
+    """
+    dependencies = OrderedDict()
+    for handle, settings in devices_config.items():
+        deps = []
+        for dep in settings.get('devices', {}).values():
+            if not dep in deps:
+                deps.append(dep)
+        dependencies[handle] = deps
+    return dependencies
+
+def plan_device_waves(dependencies):
+    """ returns a list of waves, lists of device handles whose dependencies
+        are all in earlier waves; the devices of a wave can be started together
+    """
+    remaining = OrderedDict()
+    for handle, deps in dependencies.items():
+        #a dependency that is not a configured device is left to fail at load
+        remaining[handle] = set([dep for dep in deps if dep in dependencies and dep != handle])
+    waves = []
+    done  = set()
+    while remaining:
+        wave = [handle for handle, deps in remaining.items() if deps <= done]
+        if not wave:
+            raise ConfigurationError(error_msg = "circular device dependencies",
+                                     key   = 'devices',
+                                     value = remaining.keys(),
+                                    )
+        for handle in wave:
+            del remaining[handle]
+        done.update(wave)
+        waves.append(wave)
+    return waves
         
  ###############################################################################       
 class Application:
@@ -52,8 +93,17 @@ class Application:
                  textbox_printer = lambda text: None,
                  event_queue     = None,
                  searchpaths     = DEFAULT_SEARCHPATHS[:],
+                 event_log_durability = None,
+                 concurrent_startup   = None,
+                 startup_profiler     = None,
                 ):
         self.skip_test = skip_test
+        self.event_log_durability = event_log_durability
+        self.concurrent_startup   = concurrent_startup
+        self.device_timings = OrderedDict()
+        if startup_profiler is None:
+            startup_profiler = StartupProfiler(enabled = False)
+        self.startup_profiler = startup_profiler
         self.ignore_device_errors = ignore_device_errors
         self.output_stream   = output_stream
         self.error_stream    = error_stream
@@ -69,6 +119,17 @@ class Application:
         #self.config = cfg_service.request_config_dialog()
         config_filepath = yes_o2ab.pkg_info.platform['config_filepath'] 
         self.config  = Configuration(config_filepath)
+        #events and comments are rendered and printed by a background thread,
+        #the event log still gets every event
+        console_settings = self.config.get('event_console', {})
+        rate_limits = {}
+        for event_type, interval in console_settings.get('rate_limits', {}).items():
+            rate_limits[event_type] = float(interval)
+        self.event_sink = EventSink(writers = [self._write_output, self._write_textbox],
+                                    render  = render_event_yaml,
+                                    rate_limits      = rate_limits,
+                                    default_interval = float(console_settings.get('default_interval', 0.0)),
+                                   )
         #print the introductory message
         if intro_msg is None:
             intro_msg = INTRO_MSG_TEMPLATE % {'version' : yes_o2ab.pkg_info.metadata['version']}
@@ -94,37 +155,95 @@ class Application:
     def print_comment(self, text, eol = '\n', comment_prefix = '#'):
         lines = text.split(eol)
         buff = eol.join([ comment_prefix + line for line in lines])
-        stream_print(buff, stream = self.output_stream, eol = eol)
-        #also print to the textbox if available
-        self.textbox_printer(buff)
+        #goes through the event sink to stay in order with the events
+        self.event_sink.submit_text(buff)
 
     def print_event(self, event):
         event_type, info = event
-        buff = []
-        buff.append("---")
-        buff.append("Event:")
-        buff.append("  type: %s" % event_type)
-        buff.append("  info:")
-        for key in info.keys():
-            buff.append("    %s: %s" % (key,info[key]))
-        buff.append("...")
-        buff = "\n".join(buff)
-        stream_print(buff, stream = self.output_stream)
+        #formatted and printed later by the event sink thread
+        self.event_sink.submit(event_type, info)
+
+    def _write_output(self, text):
+        stream_print(text, stream = self.output_stream)
+
+    def _write_textbox(self, text):
         #also print to the textbox if available
-        self.textbox_printer(buff)
+        self.textbox_printer(text)
     
     def print_log_msg(self,msg):
         stream_print(msg, stream = self.log_stream)
         self.print_comment("Logged: " + msg)        
           
     def load_and_test_devices(self):
+        #startup settings, the command line option takes precedence
+        startup_settings = self.config.get('device_startup', {})
+        concurrent = self.concurrent_startup
+        if concurrent is None:
+            concurrent = startup_settings.as_bool('concurrent') if 'concurrent' in startup_settings else False
+        if concurrent:
+            max_workers = int(startup_settings.get('max_workers', STARTUP_MAX_WORKERS))
+            self.load_and_test_devices_concurrently(max_workers = max_workers)
+            return
         device_handles = self.config['devices'].keys()
         self.print_comment('Running diagnostics on devices: %s' % device_handles)
         for handle in device_handles:
-            self.load_device(handle)
-            if not self.skip_test:
-                self.test_device(handle)
+            self._startup_device(handle)
+        self.print_device_timings()
+
+    def load_and_test_devices_concurrently(self, max_workers = STARTUP_MAX_WORKERS):
+        """ loads and tests the devices in waves ordered by the dependencies
+            in the config, the devices of a wave are started in a thread pool
+        """
+        waves = plan_device_waves(get_device_dependencies(self.config['devices']))
+        self.print_comment('Running diagnostics on devices in %d waves: %s' % (len(waves), waves))
+        pool = ThreadPool(processes = max(1, min(max_workers, max(map(len, waves)))))
+        try:
+            for wave in waves:
+                results = pool.map(self._startup_device_catching, wave)
+                #let the whole wave finish before raising the first error
+                for exc_info in results:
+                    if not exc_info is None:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            pool.close()
+            pool.join()
+        self.print_device_timings()
+
+    def print_device_timings(self):
+        lines = ["Device startup times (seconds):",
+                 "    %-32s %8s %8s" % ('device','load','test'),
+                ]
+        for handle in self.config['devices'].keys(): #config order, not completion order
+            if not handle in self.device_timings:
+                continue
+            t_load, t_test = self.device_timings[handle]
+            if t_test is None:
+                t_test = '-'
+            else:
+                t_test = "%0.3f" % t_test
+            lines.append("    %-32s %8.3f %8s" % (handle, t_load, t_test))
+        self.print_comment("\n".join(lines))
     
+    def _startup_device(self, handle):
+        t0 = time.time()
+        with self.startup_profiler.timed("device '%s'" % handle):
+            self.load_device(handle)
+        t_load = time.time() - t0
+        t_test = None
+        if not self.skip_test and handle in self.devices: #failed loads were already reported
+            t0 = time.time()
+            self.test_device(handle)
+            t_test = time.time() - t0
+        self.device_timings[handle] = (t_load, t_test)
+
+    def _startup_device_catching(self, handle):
+        "for the pool threads, returns the exception info instead of raising"
+        try:
+            self._startup_device(handle)
+        except Exception:
+            return sys.exc_info()
+        return None
+
     def load_device(self,handle):
         self.print_comment("Loading device '%s'" % handle) 
         try:
@@ -216,10 +335,16 @@ class Application:
         
     #---MAIN ------------------------------------------------------------------    
     def main(self):
+        profiler = self.startup_profiler
         #load and test the devices
-        self.load_and_test_devices()
+        with profiler.timed("load and test devices"):
+            self.load_and_test_devices()
         #load the controllers
-        self.load_all_controllers()
+        with profiler.timed("load controllers"):
+            self.load_all_controllers()
+        if profiler.enabled:
+            profiler.uninstall()
+            self.print_comment(profiler.report())
         #setup the event_parser -----------------------------------------------
         self.event_parser = EventParser()
         # start up all sub process threads ------------------------------------           
@@ -260,6 +385,8 @@ class Application:
                 controller.shutdown()
         #self.shutdown_event_server()
         self.shutdown_event_caching_process()
+        #write out the last of the console output
+        self.event_sink.close()
     
     #---EVENT CACHING PROCESS -----------------------------------
     def start_event_caching_process(self):
@@ -279,12 +406,21 @@ class Application:
         #repo_path = self.config['paths']['repo_dir'] #FIXME - this should point to the repo location 
         repo_path = None
 
+        #event log settings, the command line durability takes precedence
+        cache_settings = self.config.get('event_cache', {})
+        durability = self.event_log_durability
+        if durability is None:
+            durability = cache_settings.get('durability', 'interval')
         #configure the event caching process   
         self.event_caching_process = EventCachingProcess( application   = self,
                                                           event_parser  = self.event_parser,
                                                           event_queue   = self.event_queue, 
                                                           bundle_path   = bundle_path,
                                                           repo_path     = repo_path,  
+                                                          durability    = durability,
+                                                          codec         = cache_settings.get('codec', 'zlib'),
+                                                          compression_level = int(cache_settings.get('compression_level', COMPRESSION_LEVEL)),
+                                                          chunk_size    = int(cache_settings.get('chunk_size', CHUNK_SIZE)),
                                                          )
         #start up the event handling threads
         self.event_caching_process.start()
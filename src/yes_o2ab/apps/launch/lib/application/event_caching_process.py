@@ -1,6 +1,6 @@
 ###############################################################################
 #Standard Python
-import socket, sys, os, time, datetime, Queue, thread, threading, bz2, numpy,\
+import socket, sys, os, time, datetime, Queue, thread, threading, numpy,\
        copy, warnings
 
 #use the faster library if available
@@ -24,10 +24,16 @@ except ImportError:
 from automat.core.events.event_caching  import EventCachingProcess as BaseEventCachingProcess
 #yes_o2ab framework provided
 from yes_o2ab.core.events.event_parser import EventParser 
+from yes_o2ab.core.storage.frame_store import FrameStoreWriter
+from yes_o2ab.core.storage.event_log   import CompressedEventLogWriter, COMPRESSION_LEVEL, CHUNK_SIZE
+from yes_o2ab.core.storage.event_archive import EventArchive, INDEX_SUFFIX
 
 ###############################################################################
-BUNDLE_EVENTS_FILENAME            = "events.pkl"
+BUNDLE_EVENTS_FILENAME            = "events.pklz"
+BUNDLE_FRAMES_FILENAME            = "frames.raw"
 BUNDLE_SPECTRA_SUBDIR_NAME        = "spectra"
+BUNDLE_TEMPERATURE_FILENAME_TEMPLATE = "temperature_%03d.csv"
+BUNDLE_CONDITIONS_FILENAME_TEMPLATE  = "conditions_%03d.csv"
 
 def gen_unique_index():
     index = 0
@@ -38,7 +44,8 @@ def gen_unique_index():
 
 ###############################################################################
 class EventCachingProcess(BaseEventCachingProcess):
-    def __init__(self, application, event_queue, bundle_path, repo_path = None, event_parser = None):        
+    def __init__(self, application, event_queue, bundle_path, repo_path = None, event_parser = None,
+                 durability = 'interval', codec = 'zlib', compression_level = COMPRESSION_LEVEL, chunk_size = CHUNK_SIZE):        
         self.app            = application
         self.bundle_path    = bundle_path
         self.repo_path      = repo_path
@@ -46,8 +53,30 @@ class EventCachingProcess(BaseEventCachingProcess):
             event_parser = EventParser()
         self.event_parser   = event_parser
         self.event_filename = os.path.sep.join( (self.bundle_path, BUNDLE_EVENTS_FILENAME) )
-        self.event_file     = open(self.event_filename,'w')
+        self.event_file     = open(self.event_filename,'wb')
+        #the index lets readers seek to events by type and time
+        self.event_index_file = open(self.event_filename + INDEX_SUFFIX,'wb')
+        #image payloads go to the frame store, the events keep a reference
+        self.frames_filename = os.path.sep.join( (self.bundle_path, BUNDLE_FRAMES_FILENAME) )
+        self.frame_store     = FrameStoreWriter(self.frames_filename)
+        #events are pickled, compressed in chunks and written by a background thread,
+        #the frame store is synced first so synced events never refer to lost frames
+        self.event_log      = CompressedEventLogWriter(self.event_file, 
+                                                       durability        = durability,
+                                                       codec             = codec,
+                                                       compression_level = compression_level,
+                                                       chunk_size        = chunk_size,
+                                                       index_stream      = self.event_index_file,
+                                                       before_sync       = self.frame_store.sync,
+                                                      )
+        self.event_log.start()
         self.unique_index   = gen_unique_index()
+        #look up the parsed object handlers once, rather than per object
+        self._object_handlers = {}
+        for attr_name in dir(self):
+            if attr_name.startswith("handle_"):
+                self._object_handlers[attr_name[len("handle_"):]] = getattr(self, attr_name)
+        self._unhandled_types = set()
         BaseEventCachingProcess.__init__(self, event_queue, event_file = self.event_file)
    
     def __del__(self):
@@ -60,16 +89,23 @@ class EventCachingProcess(BaseEventCachingProcess):
         self.app.print_comment(text)
 
     def shutdown(self):
-        "compress the events file and remove the uncompressed"
+        "write out the last events and close the files"
+        if self.event_file.closed:
+            return #already shut down
         #shutdown the thread
         BaseEventCachingProcess.shutdown(self)
-        self.print_comment("please wait while the events file is compressed...")
-        self.event_file.close() 
-        event_file     = open(self.event_filename,'r')
-        bz2_event_file = bz2.BZ2File(self.event_filename + '.bz2','w')
-        bz2_event_file.writelines(event_file)
-        bz2_event_file.close()
-        os.remove(self.event_filename)
+        #write out the events still queued, the files are closed even if the writer failed
+        try:
+            self.event_log.close()
+            stats = self.event_log.get_stats()
+            self.print_comment("wrote %d events in %d chunks (%d bytes compressed to %d), max queue depth %d, max write latency %0.3f s" % 
+                               (stats['events_written'], stats['chunks_written'], 
+                                stats['raw_bytes'], stats['bytes_written'],
+                                stats['max_queue_depth'], stats['max_latency']))
+        finally:
+            self.event_file.close() 
+            self.event_index_file.close()
+            self.frame_store.close()
         #cleanup        
         self.clear() #clear the events cache
 
@@ -77,30 +113,44 @@ class EventCachingProcess(BaseEventCachingProcess):
         "overload this function to process events as they come in"      
         #print out the event
         self.app.print_event(event)
-        #cache events in events file
-        pickled_data = pickle.dumps(event)
-        #compressed_data = self.bz2_compressor.compress(pickled_data) 
-        self.event_file.write(pickled_data)
-        self.event_file.flush()
+        #cache events in events file, written by the event log thread
+        self.event_log.write(self._store_frame(event))
         #parse the event stream one at a time
         parsend = self.event_parser.feed(event)
         if not parsend is None: #something has been parsed from the stream, so handle it
             obj_type, obj = parsend
-            #construct the obj handler name
-            handler_name = "handle_%s" % obj_type  
-            #retrieve and call the handler 
-            handler = None    
-            try:               
-                handler = self.__getattribute__(handler_name)
-            except AttributeError:    #handler not found for the object type
-                warnings.warn("handler not found for Event Parsing object '%s'" % obj_type)
-                handler = lambda o: o #do nothing handler
-            obj = handler(obj)
+            handler = self._object_handlers.get(obj_type)
+            if handler is None:   #handler not found for the object type
+                if not obj_type in self._unhandled_types: #warn only once per type
+                    self._unhandled_types.add(obj_type)
+                    warnings.warn("handler not found for Event Parsing object '%s'" % obj_type)
+            else:
+                obj = handler(obj)
         #send back the event
         return event
 
     #--------------------------------------------------------------------------
     # Helper Methods
+    def _store_frame(self, event):
+        """writes the image of the event to the frame store and returns a 
+           copy of the event with a 'frame_ref' in place of the image
+        """
+        name, info = event
+        if not ('image_array' in info or 'frame_handle' in info):
+            return event
+        info = info.copy() #shallow, the frame is not copied
+        I = info.pop('image_array', None)
+        handle = info.pop('frame_handle', None)
+        if I is None and not handle is None:
+            I = handle.resolve(copy = True) #a view could be overwritten while writing
+            if I is None:
+                warnings.warn("frame %r was overwritten before it could be cached" % handle)
+        ref = None
+        if not I is None:
+            ref = self.frame_store.write(I, timestamp = info.get('timestamp'))
+        info['frame_ref'] = ref
+        return (name, info)
+        
     def _construct_bundle_paths(self):
         #build all the bundle paths
         paths = {}
@@ -109,26 +159,37 @@ class EventCachingProcess(BaseEventCachingProcess):
             os.mkdir(spectra_subdir_path)
             self.print_comment("created subdirectory for spectra: '%s'" % spectra_subdir_path) 
         return paths
+
+    def _save_dataset(self, dataset, filename_template):
+        filename = filename_template % self.unique_index.next()
+        filename = os.path.sep.join( (self.bundle_path, filename) )
+        dataset.to_csv_file(filename)
+        self.print_comment("saved dataset to '%s'" % filename)
     #--------------------------------------------------------------------------
     # Parsed Object Handlers    
     def handle_TEMPERATURE_DATASET(self, obj):
         self.print_comment("parsed temperature history data from event stream")
         TDS = obj
+        self._save_dataset(TDS, BUNDLE_TEMPERATURE_FILENAME_TEMPLATE)
+
+    def handle_CONDITIONS_DATASET(self, obj):
+        self.print_comment("parsed conditions history data from event stream")
+        CDS = obj
+        self._save_dataset(CDS, BUNDLE_CONDITIONS_FILENAME_TEMPLATE)
  
 
 ###############################################################################
 # TEST CODE - FIXME
 ###############################################################################
 if __name__ == "__main__":
-    from automat.filetools.pickle_file import PickleFile
     import sys
-    PF = PickleFile(sys.argv[1])
+    EA = EventArchive(sys.argv[1])
     
     DATA_DIR = "data"
     EQ = Queue.Queue() 
     ECP = EventCachingProcess(EQ,DATA_DIR)
     
-    for event in PF:
+    for event in EA:
         name, content = event
         content['timestamp'] = content.get('time') 
         ECP.event_callback(event) 
@@ -0,0 +1,250 @@
+"""
+event_sink.py
+
+Rate limited console/text display output of events.  Callers hand events to
+an EventSink, which only does a dictionary lookup and a queue put on the
+caller's thread; a background thread formats the events and writes them out
+in batches.  Events of a type can be limited to one per 'interval' seconds,
+and repeated progress events (e.g. '*_SLEEPING') are coalesced into the
+latest one with a repeat count, in the place of the first of the run.  What
+is left out here is only left out of the display, the event log still gets
+every event.  A failing render or writer is reported to stderr and the
+output thread keeps going, each kind of failure is reported once.
+"""
+###############################################################################
+#Standard Python
+import os, sys, time, threading, traceback, Queue
+###############################################################################
+# Module Constants
+MAX_QUEUE_SIZE     = 1024
+FLUSH_INTERVAL     = 0.1     #seconds between output batches
+COALESCE_SUFFIXES  = ('_SLEEPING',)
+TEXT_PUT_TIMEOUT   = 0.5     #seconds a comment waits on a full queue
+
+def render_event_yaml(event_type, info):
+    "the launch app format, a YAML-like document per event"
+    buff = []
+    buff.append("---")
+    buff.append("Event:")
+    buff.append("  type: %s" % event_type)
+    buff.append("  info:")
+    for key in info.keys():
+        buff.append("    %s: %s" % (key,info[key]))
+    buff.append("...")
+    return "\n".join(buff)
+
+def render_event_brief(event_type, info):
+    "the GUI text display format"
+    buff = ["%s:" % event_type]
+    for key,val in info.items():
+        buff.append("%s: %s" % (key,val))
+    return "\n".join(buff)
+
+###############################################################################
+class _CoalescedRun(object):
+    "the latest event of a run of repeated events and the run length"
+    __slots__ = ('info','count')
+    def __init__(self, info):
+        self.info  = info
+        self.count = 1
+
+###############################################################################
+class EventSink(object):
+    """ Renders events with 'render(event_type, info)' and passes the text to
+        each of the 'writers' callables.
+            rate_limits       - dict of event type to the minimum interval in
+                                seconds between displayed events of that type
+            default_interval  - the interval for the other types, 0 for none
+            coalesce_suffixes - event types ending in one of these only show
+                                the latest event of each run with a repeat
+                                count, a run ends at any other event
+        The number of events of a type left out is noted with the next one
+        shown.  With 'threaded' False no thread is started and the owner must
+        call 'flush' periodically from its own loop.
+    """
+    def __init__(self,
+                 writers,
+                 render            = render_event_yaml,
+                 rate_limits       = None,
+                 default_interval  = 0.0,
+                 coalesce_suffixes = COALESCE_SUFFIXES,
+                 max_queue         = MAX_QUEUE_SIZE,
+                 flush_interval    = FLUSH_INTERVAL,
+                 threaded          = True,
+                ):
+        self.writers           = list(writers)
+        self.render            = render
+        self.rate_limits       = dict(rate_limits or {})
+        self.default_interval  = float(default_interval)
+        self.coalesce_suffixes = tuple(coalesce_suffixes)
+        self.flush_interval    = float(flush_interval)
+        self._queue         = Queue.Queue(maxsize = int(max_queue))
+        self._last_shown    = {}  #event type -> time last let through
+        self._coalesce_type = {}  #event type -> bool, cached suffix check
+        self._coalesced     = {}  #event type -> _CoalescedRun still queued
+        self._suppressed    = {}  #event type -> count dropped by the limits
+        self._dropped_text  = 0   #comments dropped on a full queue
+        self._reported      = set() #error messages already sent to stderr
+        self._lock          = threading.Lock()
+        self._stop_event    = threading.Event()
+        self._thread        = None
+        self._pid           = os.getpid()
+        if threaded:
+            self.start()
+
+    def start(self):
+        "start the output thread, also restarts it in a forked child process"
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target = self._run, name = "EventSink")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def submit(self, event_type, info):
+        "queue an event for display, returns False if it was left out"
+        coalesce = self._coalesce_type.get(event_type)
+        if coalesce is None:
+            coalesce = event_type.endswith(self.coalesce_suffixes)
+            self._coalesce_type[event_type] = coalesce
+        if coalesce:
+            with self._lock:
+                run = self._coalesced.get(event_type)
+                if not run is None:
+                    run.info   = info
+                    run.count += 1
+                    return True
+                #a new run keeps its place in the queue
+                run = _CoalescedRun(info)
+                try:
+                    self._queue.put_nowait((event_type, run))
+                except Queue.Full:
+                    self._suppressed[event_type] = self._suppressed.get(event_type, 0) + 1
+                    return False
+                self._coalesced[event_type] = run
+            return True
+        interval = self.rate_limits.get(event_type, self.default_interval)
+        if interval > 0:
+            now = time.time()
+            if now - self._last_shown.get(event_type, 0.0) < interval:
+                self._count_suppressed(event_type)
+                return False
+            self._last_shown[event_type] = now
+        with self._lock:
+            try:
+                self._queue.put_nowait((event_type, info))
+            except Queue.Full: #the display is falling behind, drop rather than block
+                self._suppressed[event_type] = self._suppressed.get(event_type, 0) + 1
+                return False
+            #later repeated events start new runs after this one
+            self._coalesced.clear()
+        return True
+
+    def submit_text(self, text):
+        """ queue preformatted text, e.g. comments, to keep the output in
+            order; waits briefly on a full queue, returns False if dropped
+        """
+        try:
+            self._queue.put((None, text), timeout = TEXT_PUT_TIMEOUT)
+        except Queue.Full:
+            with self._lock:
+                self._dropped_text += 1 #noted in the next output
+            return False
+        with self._lock:
+            self._coalesced.clear()
+        return True
+
+    def flush(self):
+        "render everything pending and write it out, returns the text written"
+        chunks = []
+        while True:
+            try:
+                event_type, info = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if event_type is None:
+                chunks.append(info)
+                continue
+            if isinstance(info, _CoalescedRun):
+                with self._lock:
+                    #the run is closed, repeats from now on start a new one
+                    if self._coalesced.get(event_type) is info:
+                        del self._coalesced[event_type]
+                    run_info, count = info.info, info.count
+                text = self._render(event_type, run_info)
+                if count > 1:
+                    text = "%s\n# (%d x %s)" % (text, count, event_type)
+                chunks.append(text)
+                continue
+            text = self._render(event_type, info)
+            with self._lock:
+                skipped = self._suppressed.pop(event_type, 0)
+            if skipped:
+                text = "%s\n# (%d earlier %s events not shown)" % (text, skipped, event_type)
+            chunks.append(text)
+        with self._lock:
+            dropped, self._dropped_text = self._dropped_text, 0
+        if dropped:
+            chunks.append("# (%d comments not shown, the display fell behind)" % dropped)
+        if not chunks:
+            return ""
+        text = "\n".join(chunks)
+        for writer in self.writers:
+            try:
+                writer(text)
+            except Exception:
+                self._report_error("writer %r failed" % (writer,))
+        return text
+
+    def close(self):
+        "stop the thread and write out what is pending"
+        if not self._thread is None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _count_suppressed(self, event_type):
+        with self._lock:
+            self._suppressed[event_type] = self._suppressed.get(event_type, 0) + 1
+
+    def _render(self, event_type, info):
+        try:
+            return self.render(event_type, info)
+        except Exception:
+            self._report_error("rendering a %s event failed" % event_type)
+            return "# (a %s event could not be shown)" % event_type
+
+    def _report_error(self, msg):
+        "report to stderr, only the first time for each 'msg' to not flood it"
+        if msg in self._reported:
+            return
+        self._reported.add(msg)
+        try:
+            sys.stderr.write("EventSink: %s\n%s" % (msg, traceback.format_exc()))
+        except Exception:
+            pass #nowhere left to report to
+
+    def _reset_after_fork(self):
+        """ the threads did not survive the fork and may have held the locks,
+            so they are replaced and the pending output moved to a new queue
+        """
+        self._pid        = os.getpid()
+        self._lock       = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread     = None
+        pending = list(self._queue.queue) #not locked, its mutex may be held
+        self._queue = Queue.Queue(maxsize = self._queue.maxsize)
+        for item in pending:
+            self._queue.put_nowait(item)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._stop_event.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception: #the display must keep going
+                self._report_error("flushing the output failed")
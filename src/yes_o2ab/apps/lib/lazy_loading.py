@@ -0,0 +1,103 @@
+"""
+lazy_loading.py
+
+Proxies for devices and controllers that are only loaded from the
+configuration on first use.  'Configuration.load_device' imports the driver
+module and opens the hardware, so an app that hands out proxies starts
+without either and only pays for the objects that are actually used.
+"""
+###############################################################################
+#Standard Python
+import threading
+###############################################################################
+# Module Constants
+#IPython probes objects for these when displaying them, that should not load
+DISPLAY_PROBE_PREFIXES = ('_repr_', '_ipython_')
+
+###############################################################################
+class LazyProxy(object):
+    """ Stands in for the object returned by 'loader()', which is called on
+        the first attribute access (or 'materialize') from any thread; the
+        result is kept and every later access goes straight to it.
+    """
+    def __init__(self, loader, name = None, kind = 'object'):
+        object.__setattr__(self, '_lazy_loader', loader)
+        object.__setattr__(self, '_lazy_name',   name)
+        object.__setattr__(self, '_lazy_kind',   kind)
+        object.__setattr__(self, '_lazy_target', None)
+        object.__setattr__(self, '_lazy_loaded', False)
+        object.__setattr__(self, '_lazy_lock',   threading.Lock())
+
+    def materialize(self):
+        "load the object if not done yet and return it"
+        if not self._lazy_loaded:
+            with self._lazy_lock:
+                if not self._lazy_loaded:
+                    target = self._lazy_loader()
+                    object.__setattr__(self, '_lazy_target', target)
+                    object.__setattr__(self, '_lazy_loaded', True)
+        return self._lazy_target
+
+    def is_loaded(self):
+        return self._lazy_loaded
+
+    def __getattr__(self, attr):
+        if attr.startswith(DISPLAY_PROBE_PREFIXES) and not self._lazy_loaded:
+            raise AttributeError(attr)
+        return getattr(self.materialize(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.materialize(), attr, value)
+
+    def __call__(self, *args, **kwargs):
+        return self.materialize()(*args, **kwargs)
+
+    def __dir__(self):
+        return dir(self.materialize())
+
+    def __repr__(self):
+        if self._lazy_loaded:
+            return repr(self._lazy_target)
+        return "<lazy %s '%s', not loaded yet>" % (self._lazy_kind, self._lazy_name)
+
+###############################################################################
+def lazy_device(config, handle, profiler = None):
+    "proxy for 'config.load_device(handle)', timed by 'profiler' if given"
+    def loader():
+        if profiler is None:
+            return config.load_device(handle)
+        with profiler.timed("device '%s'" % handle):
+            return config.load_device(handle)
+    return LazyProxy(loader, name = handle, kind = 'device')
+
+def lazy_controller(config, name, profiler = None):
+    "proxy for 'config.load_controller(name)', timed by 'profiler' if given"
+    def loader():
+        if profiler is None:
+            return config.load_controller(name)
+        with profiler.timed("controller '%s'" % name):
+            return config.load_controller(name)
+    return LazyProxy(loader, name = name, kind = 'controller')
+
+def materialize(obj):
+    "returns the real object behind a proxy, other objects are returned as is"
+    if isinstance(obj, LazyProxy):
+        return obj.materialize()
+    return obj
+
+def is_loaded(obj):
+    if isinstance(obj, LazyProxy):
+        return obj.is_loaded()
+    return True
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    def load():
+        print "loading..."
+        return [1, 2, 3]
+    L = LazyProxy(load, name = 'numbers')
+    print L
+    print L.count(2)
+    print L, is_loaded(L)
@@ -0,0 +1,114 @@
+"""
+startup_profiler.py
+
+Measures where an app spends its startup time.  While installed, every
+module imported for the first time is timed, both including and excluding
+the modules it imports in turn, and named steps such as loading a device can
+be timed with 'timed'.  'report' lists the slowest of each.
+"""
+###############################################################################
+#Standard Python
+import sys, time, threading, __builtin__
+from contextlib import contextmanager
+try:
+    from collections import OrderedDict
+except ImportError:
+    from yes_o2ab.support.odict import OrderedDict
+###############################################################################
+# Module Constants
+REPORT_LIMIT    = 20     #entries listed per section
+REPORT_MIN_TIME = 0.005  #seconds, faster entries are left out
+
+###############################################################################
+class StartupProfiler(object):
+    """ A disabled profiler does not hook the imports and its 'timed' blocks
+        are not recorded, so apps can call it unconditionally.
+    """
+    def __init__(self, enabled = True):
+        self.enabled  = enabled
+        self.imports  = OrderedDict() #module name -> [total, self] seconds
+        self.steps    = OrderedDict() #label -> seconds
+        self.t_start  = time.time()
+        self._orig_import = None
+        self._local   = threading.local()
+        self._lock    = threading.Lock()
+
+    def install(self):
+        "start timing imports"
+        if not self.enabled or not self._orig_import is None:
+            return
+        self._orig_import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def uninstall(self):
+        if not self._orig_import is None:
+            __builtin__.__import__ = self._orig_import
+            self._orig_import = None
+
+    @contextmanager
+    def timed(self, label):
+        "time the enclosed block as the step 'label'"
+        if not self.enabled:
+            yield
+            return
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.steps[label] = self.steps.get(label, 0.0) + (time.time() - t0)
+
+    def report(self, limit = REPORT_LIMIT, min_time = REPORT_MIN_TIME):
+        "returns the slowest imports and steps as text"
+        lines = ["Startup profile, %0.3f seconds since start:" % (time.time() - self.t_start)]
+        with self._lock:
+            imports = sorted(self.imports.items(), key = lambda item: item[1][1], reverse = True)
+            steps   = sorted(self.steps.items(), key = lambda item: item[1], reverse = True)
+        lines.append("    %-40s %8s %8s" % ('import', 'total', 'self'))
+        for name, (t_total, t_self) in imports[:limit]:
+            if t_self < min_time:
+                break
+            lines.append("    %-40s %8.3f %8.3f" % (name, t_total, t_self))
+        lines.append("    %-40s %8s" % ('step', 'time'))
+        for label, t in steps[:limit]:
+            if t < min_time:
+                break
+            lines.append("    %-40s %8.3f" % (label, t))
+        return "\n".join(lines)
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _timed_import(self, name, *args, **kwargs):
+        if name in sys.modules: #already loaded, nothing to time
+            return self._orig_import(name, *args, **kwargs)
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0) #time spent in nested imports
+        module = None
+        t0 = time.time()
+        try:
+            module = self._orig_import(name, *args, **kwargs)
+            return module
+        finally:
+            t_total = time.time() - t0
+            t_nested = stack.pop()
+            if stack:
+                stack[-1] += t_total
+            if not module is None: #failed imports are not recorded
+                if not '.' in name: #use the full name of implicit relative imports
+                    name = getattr(module, '__name__', name)
+                with self._lock:
+                    if not name in self.imports:
+                        self.imports[name] = [t_total, t_total - t_nested]
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    P = StartupProfiler()
+    P.install()
+    with P.timed("import xml"):
+        import xml.dom.minidom
+    P.uninstall()
+    print P.report(min_time = 0.0)
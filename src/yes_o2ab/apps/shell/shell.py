@@ -11,6 +11,8 @@ from automat.core.hwcontrol.config.configuration import Configuration
 import yes_o2ab.pkg_info
 
 from yes_o2ab.apps.lib.errors import ErrorLogger
+from yes_o2ab.apps.lib.lazy_loading import lazy_device, lazy_controller
+from yes_o2ab.apps.lib.startup_profiler import StartupProfiler
 
 __BANNER  = ['*'*80,
              '* YES O2AB Shell',
@@ -23,30 +25,48 @@ DEFAULT_INTERFACE_MODE = 'interactive'
 ERRORLOGGER = ErrorLogger()
 
 class Application:
-    def __init__(self, commands = None):
+    def __init__(self, commands = None, lazy = True, profiler = None):
         #self.searchpaths = searchpaths
         self.config = None
         self.user_ns  = {}
         if commands is None:
             commands = {}
         self.commands = commands
+        self.lazy     = lazy
+        if profiler is None:
+            profiler = StartupProfiler(enabled = False)
+        self.profiler = profiler
         
     def load(self):
-        self._load_config()
-        self._load_all_devices()
-        self._load_all_controllers()
+        with self.profiler.timed("configuration"):
+            self._load_config()
+        if self.lazy:
+            #devices and controllers are imported and opened on first use
+            self._create_lazy_objects()
+        else:
+            self._load_all_devices()
+            self._load_all_controllers()
         
     def _load_config(self):
         #cfg_service = ConfiguratorService(searchpaths=self.searchpaths)
         #self.config = cfg_service.request_config_dialog()
         config_filepath = yes_o2ab.pkg_info.platform['config_filepath'] 
         self.config  = Configuration(config_filepath)
+
+    def _create_lazy_objects(self):
+        self.lazy_devices = {}
+        for name in self.config['devices'].keys():
+            self.lazy_devices[name] = lazy_device(self.config, name, profiler = self.profiler)
+        self.lazy_controllers = {}
+        for name in self.config.get('controllers', {}).keys():
+            self.lazy_controllers[name] = lazy_controller(self.config, name, profiler = self.profiler)
         
     def _load_all_devices(self):
         for name in self.config['devices'].keys():
             print "Loading device '%s'..." % name,
             try:
-                device = self.config.load_device(name)
+                with self.profiler.timed("device '%s'" % name):
+                    device = self.config.load_device(name)
                 print "success."
             except Exception, exc:
                 msg = "failed loading device '%s' with exception: %s" % (name, exc)
@@ -64,7 +84,8 @@ class Application:
             for name in controllers_dict.keys():
                 print "Loading controller '%s'..." % name,
                 try:
-                    controller = self.config.load_controller(name)
+                    with self.profiler.timed("controller '%s'" % name):
+                        controller = self.config.load_controller(name)
                     print "success."
                 except Exception, exc:
                     msg = "failed loading controller '%s' with exception: %s" % (name, exc)
@@ -99,7 +120,10 @@ class Application:
         self.user_ns['time'] = time
         
         #find the available devices
-        items = self.config._device_cache.items()
+        if self.lazy:
+            items = self.lazy_devices.items()
+        else:
+            items = self.config._device_cache.items()
         items.sort()
         status_msg.append("Available devices:")
         for name, device in items:
@@ -108,7 +132,10 @@ class Application:
             self.user_ns[name] = device
         
         #find the available controllers
-        items = self.config._controller_cache.items()
+        if self.lazy:
+            items = self.lazy_controllers.items()
+        else:
+            items = self.config._controller_cache.items()
         items.sort()
         status_msg.append("Available controllers:")
         for name, controller in items:
@@ -219,7 +246,20 @@ __commands['app_launch']      = app_launch
 ###############################################################################
 # Main
 def main():
-    app = Application(commands=__commands)
+    from optparse import OptionParser
+    OP = OptionParser()
+    OP.add_option("--eager", dest="lazy", default=True, action = 'store_false', 
+                    help="load all devices and controllers at startup instead of on first use")
+    OP.add_option("--profile-startup", dest="profile_startup", default=False, action = 'store_true', 
+                    help="report the import and loading times")
+    opts, args = OP.parse_args()
+    profiler = StartupProfiler(enabled = opts.profile_startup)
+    profiler.install()
+    app = Application(commands=__commands, lazy = opts.lazy, profiler = profiler)
     app.load()
+    if opts.profile_startup:
+        print profiler.report()
+        #devices loaded on first use are still profiled, print 'startup_profiler.report()'
+        app.user_ns['startup_profiler'] = profiler
     app.start_shell(msg = __BANNER)
 
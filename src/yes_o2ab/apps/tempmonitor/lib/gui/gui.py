@@ -183,7 +183,6 @@ class GUI:
             
     def _update_temperature_plot(self):
         figure = self.temperature_figure_widget.get_figure()        
-        figure.clear()
         t = np.array(self.app.timestamps)
         t -= t[0]
         t /= 3600.0
@@ -192,10 +191,9 @@ class GUI:
         for key,temp_list in self.app.temperature_samples.items():
             Xs.append(t)
             Ys.append(temp_list)
-        self.temperature_plot_template.plot(Xs, Ys,
-                                         figure = figure
-                                        )
-        self.temperature_figure_widget.update()
+        self.temperature_plot_template.update_incremental(Xs, Ys,
+                                                          figure = figure
+                                                         )
  
 #    def wait_on_experiment(self):
 #        if self.app.check_experiment_completed():
@@ -0,0 +1,144 @@
+"""
+frame_ring_buffer.py
+
+A fixed number of preallocated image slots that the capture thread writes
+frames into; events carry a small FrameHandle instead of the image array, so
+consumers share one copy of each frame and memory use is bounded.  A slot is
+reused after 'num_slots' further frames, at which point the old handles to it
+stop resolving.  The buffer lives in the memory of the capturing process,
+so handles only resolve within that process.
+"""
+###############################################################################
+#Standard Python
+import threading
+#3rd party
+import numpy as np
+###############################################################################
+# Module Constants
+EMPTY_SEQ = -1
+
+###############################################################################
+class FrameHandle(object):
+    """ Refers to the frame with sequence number 'seq' stored in 'slot' of a
+        FrameRingBuffer; pickling drops the reference to the buffer, so an
+        unpickled handle never resolves.
+    """
+    __slots__ = ('slot','seq','shape','dtype','timestamp','buffer')
+    def __init__(self, slot, seq, shape, dtype, timestamp = None, buffer = None):
+        self.slot      = slot
+        self.seq       = seq
+        self.shape     = tuple(shape)
+        self.dtype     = dtype
+        self.timestamp = timestamp
+        self.buffer    = buffer
+
+    def __getstate__(self):
+        return (self.slot, self.seq, self.shape, self.dtype, self.timestamp)
+
+    def __setstate__(self, state):
+        self.slot, self.seq, self.shape, self.dtype, self.timestamp = state
+        self.buffer = None
+
+    def __repr__(self):
+        return "FrameHandle(slot=%d, seq=%d, shape=%r)" % (self.slot, self.seq, self.shape)
+
+    def is_valid(self):
+        "True while the frame has not been overwritten"
+        return not self.buffer is None and self.buffer.is_valid(self)
+
+    def resolve(self, copy = False):
+        """ returns the frame array, a view into the buffer unless 'copy' is
+            True; None if the frame has been overwritten.  A view is only good
+            until the slot is reused, anything kept must be a copy.
+        """
+        if self.buffer is None:
+            return None
+        return self.buffer.get(self, copy = copy)
+
+###############################################################################
+class FrameRingBuffer(object):
+    """ 'num_slots' preallocated frames of up to 'max_shape' pixels of 'dtype'.
+        A single writer is assumed.
+    """
+    def __init__(self, num_slots, max_shape, dtype = 'uint16'):
+        self.num_slots = int(num_slots)
+        if self.num_slots < 1:
+            raise ValueError("'num_slots' must be at least 1")
+        self.max_shape = tuple(int(n) for n in max_shape)
+        self.dtype     = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.max_shape))
+        self._data = np.empty((self.num_slots, self.slot_size), dtype = self.dtype)
+        self._seqs = np.empty(self.num_slots, dtype = 'int64')
+        self._seqs.fill(EMPTY_SEQ)
+        self._shapes = [None]*self.num_slots
+        self._next_seq = 0
+        self._lock = threading.Lock()
+
+    def fits(self, I):
+        "True if the frame 'I' can be stored in a slot"
+        return I.size <= self.slot_size and np.can_cast(I.dtype, self.dtype)
+
+    def write(self, I, timestamp = None):
+        "copy the frame 'I' into the next slot, returns its FrameHandle"
+        if not self.fits(I):
+            raise ValueError("frame of shape %r and dtype %s does not fit the buffer slots" % (I.shape, I.dtype))
+        with self._lock:
+            seq  = self._next_seq
+            slot = seq % self.num_slots
+            self._next_seq += 1
+            #invalidate the old frame while the slot is being written
+            self._seqs[slot] = EMPTY_SEQ
+            self._data[slot,:I.size].reshape(I.shape)[...] = I
+            self._shapes[slot] = I.shape
+            self._seqs[slot] = seq
+        return FrameHandle(slot, seq, I.shape, self.dtype.str, timestamp = timestamp, buffer = self)
+
+    def is_valid(self, handle):
+        return self._seqs[handle.slot] == handle.seq
+
+    def get(self, handle, copy = False):
+        """ returns the frame for 'handle' or None if it was overwritten; a
+            view is only good until the slot is reused, so use 'copy' to keep it
+        """
+        if not self.is_valid(handle):
+            return None
+        n = int(np.prod(handle.shape))
+        I = self._data[handle.slot,:n].reshape(handle.shape)
+        if copy:
+            I = I.copy()
+            #the slot may have been reused while copying
+            if not self.is_valid(handle):
+                return None
+        return I
+
+    def get_latest(self, copy = False):
+        "returns the most recent frame or None"
+        with self._lock:
+            seq = self._next_seq - 1
+        if seq < 0:
+            return None
+        slot = seq % self.num_slots
+        handle = FrameHandle(slot, seq, self._shapes[slot], self.dtype.str, buffer = self)
+        return self.get(handle, copy = copy)
+
+###############################################################################
+def resolve_image(info, copy = False):
+    """ returns the image of an IMAGE_CAPTURE event 'info', from either its
+        'image_array' or its 'frame_handle'; None if the frame was overwritten
+    """
+    I = info.get('image_array', None)
+    if not I is None:
+        return I
+    handle = info.get('frame_handle', None)
+    if handle is None:
+        return None
+    return handle.resolve(copy = copy)
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    RB = FrameRingBuffer(3, (4,5))
+    handles = [RB.write(np.ones((4,5), dtype='uint16')*i) for i in range(5)]
+    print [h.resolve() is None for h in handles]
+    print handles[-1].resolve()
@@ -0,0 +1,267 @@
+"""
+time_series_buffer.py
+
+Fixed capacity history of named channels for long monitoring runs.  Each
+sample is written twice into storage of twice the capacity, so the latest
+'capacity' samples are always one contiguous slice and are handed out as
+views without copying.  A TieredTimeSeries feeds the raw samples into
+downsampled tiers (e.g. 1 min and 1 h bin averages) so that a long run
+keeps a bounded coarse history after the fine one has been overwritten.
+The bin still being filled is shown as the last sample of its tier, so a
+downsampled view reaches up to the latest raw sample.
+"""
+###############################################################################
+#Standard Python
+try:
+    from collections import OrderedDict
+except ImportError:
+    from yes_o2ab.support.odict import OrderedDict
+#3rd party
+import numpy as np
+###############################################################################
+# Module Constants
+#the raw samples are the finest tier
+DEFAULT_TIERS = [(60.0,   10080), #bin interval (seconds), capacity: one week
+                 (3600.0,  8760), #one year
+                ]
+
+###############################################################################
+class TimeSeriesRingBuffer(object):
+    """ The latest 'capacity' samples of the channels 'names'; the names are
+        taken from the first sample if not given, afterwards missing channels
+        are stored as NaN and unknown ones are ignored.  A 'pending' sample,
+        set with 'set_pending', follows the samples in the views until the
+        next append; it is kept in the spare slot just past the window.
+    """
+    def __init__(self, capacity, names = None, dtype = 'float64'):
+        self.capacity = int(capacity)
+        if self.capacity < 1:
+            raise ValueError("'capacity' must be at least 1")
+        self.dtype = np.dtype(dtype)
+        self.names = None
+        self._times = np.zeros(2*self.capacity, dtype = 'float64')
+        self._data  = None
+        self.clear()
+        if not names is None:
+            self._allocate(names)
+
+    def clear(self):
+        "drop all samples, the channel names are kept"
+        self._head  = 0
+        self.count  = 0
+        self.total  = 0 #samples ever appended, including overwritten ones
+        self._pending = False
+
+    def __len__(self):
+        "the number of samples in the views, including a pending one"
+        return self.count + self._pending
+
+    def append(self, t, values):
+        "append a sample at time 't' from the mapping 'values' of channel name to value"
+        self.append_row(t, self.make_row(values))
+
+    def make_row(self, values):
+        "returns the mapping 'values' as an array ordered as 'names'"
+        if self.names is None:
+            self._allocate(values.keys())
+        row = np.empty(len(self.names), dtype = self.dtype)
+        for i, name in enumerate(self.names):
+            val = values.get(name)
+            row[i] = np.nan if val is None else val
+        return row
+
+    def append_row(self, t, row):
+        "append a sample at time 't' from the sequence 'row' ordered as 'names'"
+        head = self._head
+        cap  = self.capacity
+        self._times[head] = self._times[head + cap] = t
+        self._data[:,head] = row
+        self._data[:,head + cap] = row
+        self._head = (head + 1) % cap
+        if self.count < cap:
+            self.count += 1
+        self.total += 1
+        self._pending = False #the spare slot now mirrors a sample
+
+    def set_pending(self, t, row):
+        """ show the sample at time 't' with the sequence 'row' after the 
+            others until the next append, e.g. an incomplete average
+        """
+        if self.names is None:
+            raise RuntimeError("the channel names must be set first")
+        spare = self._head + self.capacity #not in the window, rewritten by the next append
+        self._times[spare] = t
+        self._data[:,spare] = row
+        self._pending = True
+
+    def _window(self):
+        stop = self._head + self.capacity
+        return (stop - self.count, stop + self._pending)
+
+    def get_times(self):
+        """ returns a view of the sample times, oldest first; it stays valid
+            until 'capacity' more samples have been appended
+        """
+        start, stop = self._window()
+        return self._times[start:stop]
+
+    def get_column(self, name):
+        "returns a view of the channel 'name', valid like 'get_times'"
+        if self.names is None or not name in self.names:
+            raise KeyError(name)
+        start, stop = self._window()
+        return self._data[self.names.index(name), start:stop]
+
+    def get_columns(self):
+        "returns an OrderedDict of views of all the channels"
+        columns = OrderedDict()
+        if self.names is None:
+            return columns
+        start, stop = self._window()
+        for i, name in enumerate(self.names):
+            columns[name] = self._data[i, start:stop]
+        return columns
+
+    def get_first_time(self):
+        "time of the oldest sample held, or None"
+        if self.count == 0:
+            return None
+        start, stop = self._window()
+        return self._times[start]
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _allocate(self, names):
+        self.names = list(names)
+        self._data = np.zeros((len(self.names), 2*self.capacity), dtype = self.dtype)
+
+###############################################################################
+class _DownsampledTier(object):
+    "averages the samples falling in each 'interval' second bin into a ring buffer"
+    def __init__(self, interval, capacity, names, dtype):
+        self.interval = float(interval)
+        self.buffer   = TimeSeriesRingBuffer(capacity, names = names, dtype = dtype)
+        self._bin     = None
+        n = len(names)
+        self._t_sum   = 0.0
+        self._sums    = np.zeros(n, dtype = 'float64')
+        self._counts  = np.zeros(n, dtype = 'int64')
+        self._num     = 0
+
+    def add(self, t, row):
+        b = int(t//self.interval)
+        if b != self._bin:
+            self.flush()
+            self._bin = b
+        valid = ~np.isnan(row)
+        self._sums[valid]   += row[valid]
+        self._counts[valid] += 1
+        self._t_sum += t
+        self._num   += 1
+        #show the bin so far, so the tier is not missing the latest samples
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            means = self._sums/self._counts
+        self.buffer.set_pending(self._t_sum/self._num, means)
+
+    def flush(self):
+        "write out the average of the current bin"
+        if self._num == 0:
+            return
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            means = self._sums/self._counts
+        self.buffer.append_row(self._t_sum/self._num, means)
+        self._sums.fill(0.0)
+        self._counts.fill(0)
+        self._t_sum = 0.0
+        self._num   = 0
+
+    def clear(self):
+        self.buffer.clear()
+        self._bin = None
+        self._sums.fill(0.0)
+        self._counts.fill(0)
+        self._t_sum = 0.0
+        self._num   = 0
+
+###############################################################################
+class TieredTimeSeries(object):
+    """ Raw samples in a ring buffer of 'capacity' plus one downsampled ring
+        buffer per (interval, capacity) pair of 'tiers'.  A bin is written to
+        its tier once a sample past the end of the bin arrives, until then its
+        average so far is the tier's pending last sample.
+    """
+    def __init__(self, capacity, tiers = DEFAULT_TIERS, names = None, dtype = 'float64'):
+        self.raw = TimeSeriesRingBuffer(capacity, names = names, dtype = dtype)
+        self.tier_specs = [(float(interval), int(cap)) for interval, cap in tiers]
+        self.tiers = None
+        if not names is None:
+            self._create_tiers()
+
+    def clear(self):
+        self.raw.clear()
+        if not self.tiers is None:
+            for tier in self.tiers:
+                tier.clear()
+
+    def __len__(self):
+        return len(self.raw)
+
+    @property
+    def names(self):
+        return self.raw.names
+
+    def append(self, t, values):
+        row = self.raw.make_row(values)
+        self.raw.append_row(t, row)
+        if self.tiers is None:
+            self._create_tiers()
+        for tier in self.tiers:
+            tier.add(t, row)
+
+    def get_tier(self, level):
+        """ returns the ring buffer of tier 'level', 0 is the raw samples and
+            1 onward are the downsampled tiers in the order given
+        """
+        if level == 0 or self.tiers is None: #nothing appended yet
+            return self.raw
+        return self.tiers[level - 1].buffer
+
+    def select(self, t_start = None):
+        """ returns the finest buffer still holding samples back to 't_start',
+            by default the earliest sample ever appended; if none reaches that
+            far back the one with the oldest samples is returned
+        """
+        buffers = [self.raw]
+        if not self.tiers is None:
+            buffers += [tier.buffer for tier in self.tiers]
+        best = self.raw
+        best_first = self.raw.get_first_time()
+        for buff in buffers:
+            if buff.total == 0:
+                continue
+            first = buff.get_first_time()
+            if buff.total == buff.count and t_start is None: #nothing overwritten yet
+                return buff
+            if not t_start is None and first <= t_start:
+                return buff
+            if best_first is None or first < best_first:
+                best, best_first = buff, first
+        return best
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _create_tiers(self):
+        self.tiers = [_DownsampledTier(interval, cap, self.raw.names, self.raw.dtype)
+                      for interval, cap in self.tier_specs]
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    TS = TieredTimeSeries(5, tiers = [(2.0, 4), (10.0, 4)])
+    for i in range(20):
+        TS.append(float(i), {'a': i, 'b': -i})
+    for level in range(3):
+        buff = TS.get_tier(level)
+        print level, buff.get_times(), buff.get_column('a')
+    print TS.select() is TS.get_tier(2)
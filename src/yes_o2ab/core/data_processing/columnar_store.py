@@ -0,0 +1,130 @@
+"""
+columnar_store.py
+
+Growable column-oriented storage for time series of named channels: each
+channel is a preallocated numpy array and the capacity doubles when full, so
+appending a record is amortized O(1) and no per-record dicts are kept.
+Channels first seen part way through are backfilled with NaN.
+"""
+###############################################################################
+#Standard Python
+try:
+    from collections import OrderedDict
+except ImportError:
+    from yes_o2ab.support.odict import OrderedDict
+#3rd party
+import numpy as np
+###############################################################################
+# Module Constants
+INITIAL_CAPACITY = 256
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+###############################################################################
+class ColumnarStore(object):
+    def __init__(self, names = None, initial_capacity = INITIAL_CAPACITY, dtype = 'float64'):
+        self.initial_capacity = max(int(initial_capacity), 1)
+        self.dtype = np.dtype(dtype)
+        self._names = [] if names is None else list(names)
+        self.reset()
+
+    def reset(self):
+        "drop all records, the arrays are reallocated so old views stay valid"
+        self.length   = 0
+        self.capacity = self.initial_capacity
+        self._times   = np.empty(self.capacity, dtype = 'float64')
+        self._columns = OrderedDict()
+        for name in self._names:
+            self._add_column(name)
+
+    def __len__(self):
+        return self.length
+
+    def get_names(self):
+        return self._columns.keys()
+
+    def append(self, timestamp, values, skip = ()):
+        """ append a record at 'timestamp' from the mapping 'values' of
+            channel name to value, ignoring the names in 'skip'; channels
+            missing from it get NaN
+        """
+        n = self.length
+        if n == self.capacity:
+            self._grow()
+        self._times[n] = _as_float(timestamp)
+        columns = self._columns
+        num_set = 0
+        for name, value in values.iteritems():
+            if name in skip:
+                continue
+            column = columns.get(name)
+            if column is None:
+                column = self._add_column(name)
+            column[n] = _as_float(value)
+            num_set += 1
+        if num_set < len(columns):
+            for name, column in columns.iteritems():
+                if not name in values:
+                    column[n] = np.nan
+        self.length = n + 1
+
+    def get_times(self):
+        "returns a view of the timestamps, valid until the next append grows the store"
+        return self._times[:self.length]
+
+    def get_column(self, name):
+        "returns a view of the channel 'name', valid until the next append grows the store"
+        return self._columns[name][:self.length]
+
+    def snapshot(self, start = 0, copy = True):
+        """ returns (t, columns) for the records from index 'start' on, where
+            'columns' is an OrderedDict of channel arrays; pass the previous
+            length as 'start' to get only the new records
+        """
+        stop = self.length
+        t = self._times[start:stop]
+        columns = OrderedDict()
+        for name, column in self._columns.iteritems():
+            columns[name] = column[start:stop]
+        if copy:
+            t = t.copy()
+            for name in columns.keys():
+                columns[name] = columns[name].copy()
+        return (t, columns)
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _add_column(self, name):
+        column = np.empty(self.capacity, dtype = self.dtype)
+        column[:self.length] = np.nan
+        self._columns[name] = column
+        return column
+
+    def _grow(self):
+        capacity = 2*self.capacity
+        n = self.length
+        times = np.empty(capacity, dtype = 'float64')
+        times[:n] = self._times[:n]
+        self._times = times
+        for name, column in self._columns.items():
+            new_column = np.empty(capacity, dtype = self.dtype)
+            new_column[:n] = column[:n]
+            self._columns[name] = new_column
+        self.capacity = capacity
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    CS = ColumnarStore(initial_capacity = 2)
+    for i in range(5):
+        values = {'a': i}
+        if i > 2:
+            values['b'] = 10*i
+        CS.append(float(i), values)
+    print CS.capacity, CS.snapshot()
+    print CS.snapshot(start = 3)
@@ -14,6 +14,8 @@ SPECTRUM_METADATA_CONVERTERS = OrderedDict([
     ('exposure_time'         , safe_int_conv  ),
     ('rbi_num_flushes'       , safe_int_conv  ),
     ('rbi_exposure_time'     , safe_int_conv  ),
+    ('hbin'                  , safe_int_conv  ),
+    ('vbin'                  , safe_int_conv  ),
     ('flatfield_state'       , str            ),
     ('band'                  , str            ),
     ('filt_pos'              , safe_int_conv  ),
@@ -9,28 +9,42 @@ import numpy as np
 #Automat framework provided
 from automat.core.data_processing.datasets import DataSet
 #yes_o2ab framework provided
+###############################################################################
+# Module Constants
+#labels of the control app conditions channels, in the order of its fields
+CONDITIONS_CHANNEL_NAMES = ['CC_temp',
+                            'CH_temp',
+                            'CC_power',
+                            'FI_temp',
+                            'SA_press_raw_voltage',
+                            'SA_temp_raw_voltage',
+                            'SA_humid_raw_voltage',
+                            'TT_temp',
+                            'OT_temp',
+                            'FB_temp',
+                            'GR_temp',
+                            'MB_temp',
+                            'EB_temp',
+                            'RA_temp',
+                            'OA_temp',
+                            'windspeed',
+                           ]
+
 ###############################################################################
 class ConditionsDataSet(DataSet):
-    def __init__(self, t, Ys, metadata = None):
-        fields  = [t] + Ys
-        names   = ['timestamp',
-                   'CC_temp',
-                   'CH_temp',
-                   'CC_power',
-                   'FI_temp',
-                   'SA_press_raw_voltage',
-                   'SA_temp_raw_voltage',
-                   'SA_humid_raw_voltage',
-                   'TT_temp',
-                   'OT_temp',
-                   'FB_temp',
-                   'GR_temp',
-                   'MB_temp',
-                   'EB_temp',
-                   'RA_temp',
-                   'OA_temp',
-                   'windspeed',
-                  ]
+    def __init__(self, t, Ys, metadata = None, names = None):
+        "'names' labels the channels 'Ys', default the control app conditions"
+        fields  = [t] + list(Ys)
+        if not names is None:
+            names = ['timestamp'] + list(names)
+        else:
+            names = ['timestamp'] + CONDITIONS_CHANNEL_NAMES
         if metadata is None:
             metadata = OrderedDict()
         DataSet.__init__(self, fields, names=names, metadata=metadata)
+
+    @classmethod
+    def from_columnar_store(cls, store, metadata = None):
+        "build a dataset from a copy of the records in a ColumnarStore"
+        t, columns = store.snapshot(copy = True)
+        return cls(t, columns.values(), metadata = metadata, names = columns.keys())
@@ -0,0 +1,295 @@
+"""
+frame_stacking.py
+
+Streaming combination of image frames, the frames are folded into
+preallocated buffers as they arrive so that a stack of any depth never has
+to be held in memory.
+"""
+###############################################################################
+#3rd party
+import numpy as np
+###############################################################################
+# Module Constants
+STACK_DTYPE       = 'float64'
+MEDIAN_BLOCK_SIZE = 5
+CLIP_MIN_FRAMES   = 5
+COMBINE_METHODS   = ['mean','median']
+
+###############################################################################
+class RunningStack(object):
+    """ Accumulates frames into a running mean and per-pixel variance using
+        Welford's algorithm; all buffers are allocated on the first frame.
+    """
+    def __init__(self, shape = None, dtype = STACK_DTYPE):
+        self.dtype = dtype
+        self.count = 0
+        self._mean  = None
+        self._M2    = None
+        self._delta = None
+        self._tmp   = None
+        if not shape is None:
+            self._allocate(shape)
+
+    def _allocate(self, shape):
+        self._mean  = np.zeros(shape, dtype = self.dtype)
+        self._M2    = np.zeros(shape, dtype = self.dtype)
+        self._delta = np.empty(shape, dtype = self.dtype)
+        self._tmp   = np.empty(shape, dtype = self.dtype)
+
+    @property
+    def shape(self):
+        if self._mean is None:
+            return None
+        return self._mean.shape
+
+    def add(self, I):
+        "fold the frame 'I' into the running statistics"
+        if self._mean is None:
+            self._allocate(I.shape)
+        elif I.shape != self._mean.shape:
+            raise ValueError("frame shape %r does not match stack shape %r" % (I.shape, self._mean.shape))
+        self.count += 1
+        delta = self._delta
+        tmp   = self._tmp
+        np.subtract(I, self._mean, out = delta)
+        np.multiply(delta, 1.0/self.count, out = tmp)
+        self._mean += tmp
+        np.subtract(I, self._mean, out = tmp)
+        tmp *= delta
+        self._M2 += tmp
+
+    def get_mean(self):
+        "returns the running mean buffer (not a copy)"
+        return self._mean
+
+    def get_master(self):
+        return self.get_mean()
+
+    def get_variance(self, ddof = 1):
+        "returns a new array of the per-pixel variance"
+        if self._M2 is None:
+            return None
+        n = self.count - ddof
+        if n <= 0:
+            return np.zeros_like(self._M2)
+        return self._M2/n
+
+    def reset(self):
+        "clear the statistics, keeping the buffers"
+        self.count = 0
+        if not self._mean is None:
+            self._mean.fill(0)
+            self._M2.fill(0)
+
+###############################################################################
+class BlockMedianStack(object):
+    """ Approximates the median of a stack by taking the median of successive
+        blocks of 'block_size' frames and averaging the block medians; only
+        one block of frames is ever buffered.  The per-pixel variance is that
+        of the individual frames.
+    """
+    def __init__(self, block_size = MEDIAN_BLOCK_SIZE, dtype = STACK_DTYPE):
+        self.block_size = int(block_size)
+        self.dtype = dtype
+        self.count = 0
+        self._block = None
+        self._block_count = 0
+        self._medians = RunningStack(dtype = dtype)
+        self._frames  = RunningStack(dtype = dtype)
+        self._master  = None
+
+    @property
+    def shape(self):
+        return self._frames.shape
+
+    def add(self, I):
+        "buffer the frame 'I', reducing the block when it fills"
+        if self._block is None:
+            self._block = np.empty((self.block_size,) + I.shape, dtype = I.dtype)
+        self._frames.add(I)
+        self._block[self._block_count] = I
+        self._block_count += 1
+        self.count += 1
+        self._master = None
+        if self._block_count == self.block_size:
+            self._reduce_block()
+
+    def _reduce_block(self):
+        if self._block_count > 0:
+            block = self._block[:self._block_count]
+            self._medians.add(np.median(block, axis = 0))
+            self._block_count = 0
+
+    def get_master(self):
+        "returns the combined frame, a partially filled block is included"
+        if self._master is None:
+            if self._block_count == 0:
+                self._master = self._medians.get_mean()
+            else:
+                #fold in the partial block without disturbing the running sums
+                partial = np.median(self._block[:self._block_count], axis = 0)
+                n = self._medians.count
+                if n == 0:
+                    self._master = partial.astype(self.dtype)
+                else:
+                    self._master = (n*self._medians.get_mean() + partial)/(n + 1)
+        return self._master
+
+    def get_mean(self):
+        return self._frames.get_mean()
+
+    def get_variance(self, ddof = 1):
+        return self._frames.get_variance(ddof = ddof)
+
+    def reset(self):
+        self.count = 0
+        self._block_count = 0
+        self._master = None
+        self._medians.reset()
+        self._frames.reset()
+
+###############################################################################
+class FrameCoAdder(object):
+    """ Co-adds frames as they arrive, keeping float64 sums and a Welford 
+        running mean and variance for each pixel in preallocated buffers.  If
+        'clip_sigma' is set, once 'clip_min_frames' frames are stacked a pixel
+        deviating from its running mean by more than 'clip_sigma' standard 
+        deviations (e.g. a cosmic ray hit) is left out of the stack, so each 
+        pixel keeps its own count of accepted frames.
+    """
+    def __init__(self, clip_sigma = None, clip_min_frames = CLIP_MIN_FRAMES, dtype = STACK_DTYPE):
+        if not clip_sigma is None:
+            clip_sigma = float(clip_sigma)
+        self.clip_sigma      = clip_sigma
+        self.clip_min_frames = int(clip_min_frames)
+        self.dtype = dtype
+        self.count = 0          #number of frames added
+        self.num_rejected = 0   #number of pixels left out by clipping
+        self._sum    = None
+        self._mean   = None
+        self._M2     = None
+        self._counts = None
+        self._delta  = None
+        self._tmp    = None
+        self._sq     = None
+        self._accept = None
+
+    def _allocate(self, shape):
+        self._sum    = np.zeros(shape, dtype = self.dtype)
+        self._mean   = np.zeros(shape, dtype = self.dtype)
+        self._M2     = np.zeros(shape, dtype = self.dtype)
+        self._counts = np.zeros(shape, dtype = 'int64')
+        self._delta  = np.empty(shape, dtype = self.dtype)
+        self._tmp    = np.empty(shape, dtype = self.dtype)
+        self._sq     = np.empty(shape, dtype = self.dtype)
+        self._accept = np.empty(shape, dtype = 'bool')
+
+    @property
+    def shape(self):
+        if self._mean is None:
+            return None
+        return self._mean.shape
+
+    def add(self, I):
+        """ fold the frame 'I' into the stack, returns the number of pixels
+            rejected by clipping
+        """
+        if self._mean is None:
+            self._allocate(I.shape)
+        elif I.shape != self._mean.shape:
+            raise ValueError("frame shape %r does not match stack shape %r" % (I.shape, self._mean.shape))
+        self.count += 1
+        delta  = self._delta
+        tmp    = self._tmp
+        accept = self._accept
+        np.subtract(I, self._mean, out = delta)
+        rejected = 0
+        if not self.clip_sigma is None and self.count > self.clip_min_frames:
+            #threshold on the variance of the frames accepted so far
+            np.subtract(self._counts, 1, out = tmp)
+            np.maximum(tmp, 1, out = tmp)
+            np.divide(self._M2, tmp, out = tmp)
+            tmp *= self.clip_sigma**2
+            np.multiply(delta, delta, out = self._sq)
+            np.less_equal(self._sq, tmp, out = accept)
+            rejected = accept.size - np.count_nonzero(accept)
+            if rejected:
+                np.multiply(delta, accept, out = delta)
+        else:
+            accept.fill(True)
+        self.num_rejected += rejected
+        np.add(self._counts, accept, out = self._counts)
+        np.multiply(I, accept, out = tmp)
+        self._sum += tmp
+        #Welford update, rejected pixels have zero delta
+        np.maximum(self._counts, 1, out = tmp)
+        np.divide(delta, tmp, out = tmp)
+        self._mean += tmp
+        np.subtract(I, self._mean, out = tmp)
+        tmp *= delta
+        self._M2 += tmp
+        return rejected
+
+    def get_sum(self):
+        "returns the buffer of summed accepted pixel values (not a copy)"
+        return self._sum
+
+    def get_counts(self):
+        "returns the buffer of accepted frame counts per pixel (not a copy)"
+        return self._counts
+
+    def get_mean(self):
+        "returns the running mean buffer (not a copy)"
+        return self._mean
+
+    def get_master(self):
+        return self.get_mean()
+
+    def get_variance(self, ddof = 1):
+        "returns a new array of the per-pixel variance of the accepted frames"
+        if self._M2 is None:
+            return None
+        n = self._counts - ddof
+        np.maximum(n, 1, out = n)
+        V = self._M2/n
+        V[self._counts <= ddof] = 0.0
+        return V
+
+    def get_coadded_image(self):
+        """ returns a new array of the co-added frames, clipped pixels are
+            filled in with their mean so that every pixel is on the scale of
+            'count' frames
+        """
+        if self._mean is None:
+            return None
+        return self._mean*self.count
+
+    def reset(self):
+        "clear the stack, keeping the buffers"
+        self.count = 0
+        self.num_rejected = 0
+        if not self._mean is None:
+            self._sum.fill(0)
+            self._mean.fill(0)
+            self._M2.fill(0)
+            self._counts.fill(0)
+
+###############################################################################
+def make_stack(method = 'mean', **kwargs):
+    "factory for the frame stack objects, 'method' is 'mean' or 'median'"
+    if method == 'mean':
+        return RunningStack(**kwargs)
+    elif method == 'median':
+        return BlockMedianStack(**kwargs)
+    else:
+        raise ValueError("combine method '%s' is not valid, must be one of %r" % (method, COMBINE_METHODS))
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    frames = np.random.normal(100.0, 5.0, size = (23,4,6))
+    S = RunningStack()
+    for I in frames:
+        S.add(I)
+    print np.allclose(S.get_mean(), frames.mean(axis=0)), np.allclose(S.get_variance(), frames.var(axis=0, ddof=1))
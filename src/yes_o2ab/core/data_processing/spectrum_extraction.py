@@ -0,0 +1,230 @@
+"""
+spectrum_extraction.py
+
+Extraction of a spectrum from a CCD image by summing over the illuminated
+rows; the row window, masks and weights are set up once for a given image
+shape and readout geometry and reused for every frame.
+
+The row window, masks and profile are given for the full unbinned frame.
+Frames read out from a subframe 'image_area' or with binning are extracted
+by cropping and binning them to match when the frame geometry (see
+'frame_geometry') is passed to 'extract'.  Without it the frame must have the
+shape of the arrays, anything else raises a ValueError instead of applying
+the wrong rows.
+
+--------------------------------------------------------------------------------
+Configuration (the optional '[ spectrum_extraction ]' section of the config file):
+
+row_window      - first and last (exclusive) rows to extract, e.g. "200, 300"
+                  (default None, all rows)
+trace_mask      - path to a .npy boolean array of the full frame shape, True
+                  for the pixels on the spectral trace (default None)
+profile         - path to a .npy array of the spatial profile, either of the
+                  full frame shape or a single column over the row window;
+                  enables optimal extraction weights (default None)
+bad_pixel_mask  - path to a .npy boolean array of the full frame shape, True
+                  for pixels to be ignored (default None)
+dtype           - accumulator dtype (default 'float64')
+"""
+###############################################################################
+#Standard Python
+import os
+#3rd party
+import numpy as np
+###############################################################################
+# Module Constants
+EXTRACTION_DTYPE = 'float64'
+
+def frame_geometry(info):
+    """ returns the readout geometry (image_area, hbin, vbin) recorded in the
+        image capture event 'info', None if it is not recorded
+    """
+    if info is None or not 'hbin' in info:
+        return None
+    image_area = info.get('image_area')
+    if not image_area is None:
+        image_area = tuple(int(v) for v in image_area)
+    return (image_area, int(info['hbin']), int(info.get('vbin', 1)))
+
+def _bin_array(A, hbin, vbin, reduce):
+    "combine hbin x vbin blocks of 'A' with 'reduce', dropping partial blocks like the camera"
+    rows = A.shape[0]//vbin
+    cols = A.shape[1]//hbin
+    A = A[:rows*vbin,:cols*hbin].reshape((rows,vbin,cols,hbin))
+    return reduce(reduce(A, axis = 3), axis = 1)
+
+###############################################################################
+class SpectrumExtractor(object):
+    """ Sums the rows in 'row_window' of each image into a spectrum.
+
+        Pixels outside the 'trace_mask' or inside the 'bad_pixel_mask' are
+        left out and each column is rescaled for the pixels it lost.  If a
+        spatial 'profile' is given the columns are combined with the optimal
+        extraction weights M*P/sum(M*P**2) (uniform variance), so the result
+        stays on the scale of the plain row sum.
+    """
+    def __init__(self,
+                 row_window     = None,
+                 trace_mask     = None,
+                 profile        = None,
+                 bad_pixel_mask = None,
+                 dtype          = EXTRACTION_DTYPE,
+                ):
+        self.configure(row_window     = row_window,
+                       trace_mask     = trace_mask,
+                       profile        = profile,
+                       bad_pixel_mask = bad_pixel_mask,
+                       dtype          = dtype,
+                      )
+    #--------------------------------------------------------------------------
+    # CLASS METHODS
+    @classmethod
+    def from_config(cls, settings):
+        "build from a config section, arrays are loaded from .npy file paths"
+        if settings is None:
+            settings = {}
+        row_window = settings.get('row_window', None)
+        if isinstance(row_window, basestring):
+            row_window = [r for r in row_window.split(',')]
+        if row_window:
+            row_window = tuple(int(r) for r in row_window)
+        else:
+            row_window = None
+        arrays = {}
+        for key in ('trace_mask', 'profile', 'bad_pixel_mask'):
+            path = settings.get(key, None)
+            if path:
+                arrays[key] = np.load(os.path.expanduser(path))
+        return cls(row_window = row_window,
+                   dtype      = settings.get('dtype', EXTRACTION_DTYPE),
+                   **arrays)
+    #--------------------------------------------------------------------------
+    def configure(self, **kwargs):
+        "change any of the constructor settings, the weights are recomputed on the next frame"
+        for key, val in kwargs.items():
+            if not key in ('row_window', 'trace_mask', 'profile', 'bad_pixel_mask', 'dtype'):
+                raise TypeError("invalid setting '%s'" % key)
+            setattr(self, key, val)
+        self._key     = None
+        self._rows    = None
+        self._weights = None
+        self._buffer  = None
+
+    def _map_to_frame(self, shape, geometry):
+        """ returns the (row_window, trace_mask, bad_pixel_mask, profile) of
+            the full frame settings cropped and binned for a frame of 'shape'
+            read out with 'geometry'
+        """
+        row_window     = self.row_window
+        trace_mask     = self.trace_mask
+        bad_pixel_mask = self.bad_pixel_mask
+        profile        = self.profile
+        if not profile is None:
+            profile = np.asarray(profile, dtype = self.dtype)
+        image_area, hbin, vbin = (None, 1, 1) if geometry is None else geometry
+        if not (image_area is None and hbin == 1 and vbin == 1):
+            full_shape = None
+            for A in (trace_mask, bad_pixel_mask, profile):
+                if not A is None and np.ndim(A) == 2:
+                    full_shape = np.shape(A)
+            if image_area is None:
+                if full_shape is None:
+                    full_shape = (shape[0]*vbin, shape[1]*hbin) #nothing else to go on
+                ul_x, ul_y, lr_x, lr_y = 0, 0, full_shape[1], full_shape[0]
+            else:
+                ul_x, ul_y, lr_x, lr_y = image_area
+            def crop_and_bin(A, reduce):
+                return _bin_array(np.asarray(A)[ul_y:lr_y,ul_x:lr_x], hbin, vbin, reduce)
+            if not trace_mask is None:
+                #a binned pixel is on the trace if any of its pixels are
+                trace_mask = crop_and_bin(np.asarray(trace_mask, dtype = 'bool'), np.any)
+            if not bad_pixel_mask is None:
+                #and bad if any of its pixels are
+                bad_pixel_mask = crop_and_bin(np.asarray(bad_pixel_mask, dtype = 'bool'), np.any)
+            if not profile is None:
+                if profile.ndim == 1:
+                    #place the column over the full frame rows of the window
+                    r0 = 0 if row_window is None else int(row_window[0])
+                    column = np.zeros((max(lr_y, r0 + len(profile)), 1), dtype = self.dtype)
+                    column[r0:r0 + len(profile), 0] = profile
+                    profile = _bin_array(column[ul_y:lr_y], 1, vbin, np.sum)
+                else:
+                    profile = crop_and_bin(profile, np.sum)
+            if not row_window is None:
+                r0, r1 = [int(r) for r in row_window]
+                row_window = (max(r0 - ul_y, 0)//vbin, -(-(r1 - ul_y)//vbin))
+        for name, A in (('trace_mask', trace_mask), ('bad_pixel_mask', bad_pixel_mask), ('profile', profile)):
+            if A is None or np.ndim(A) != 2:
+                continue
+            rows, cols = np.shape(A)
+            if rows != shape[0] or not cols in (1, shape[1]):
+                raise ValueError("the %s of shape %r does not match the frame of shape %r read out with geometry %r" % 
+                                 (name, np.shape(A), shape, geometry))
+        return (row_window, trace_mask, bad_pixel_mask, profile)
+
+    def _prepare(self, shape, geometry = None):
+        row_window, trace_mask, bad_pixel_mask, profile = self._map_to_frame(shape, geometry)
+        nrows, ncols = shape
+        r0, r1 = 0, nrows
+        if not row_window is None:
+            r0, r1 = row_window
+            r0 = max(int(r0), 0)
+            r1 = min(int(r1), nrows)
+            if r1 <= r0:
+                raise ValueError("row window %r is empty for an image of shape %r" % (self.row_window, shape))
+        rows = slice(r0, r1)
+        #mask of pixels used in the window
+        M = None
+        if not trace_mask is None:
+            M = np.asarray(trace_mask, dtype = 'bool')[rows]
+        if not bad_pixel_mask is None:
+            good = ~np.asarray(bad_pixel_mask, dtype = 'bool')[rows]
+            if M is None:
+                M = good
+            else:
+                M = M & good
+        W = None
+        if not profile is None:
+            P = np.asarray(profile, dtype = self.dtype)
+            if P.ndim == 1:
+                P = P.reshape((-1, 1))
+            elif P.shape[0] == nrows and (r1 - r0) != nrows:
+                P = P[rows]
+            P = P*np.ones((r1 - r0, ncols), dtype = self.dtype)
+            #normalize so a frame matching the profile keeps its plain sum
+            total = P.sum(axis = 0)
+            if not M is None:
+                P = P*M
+            norm = (P*P).sum(axis = 0)
+            norm = np.where(norm > 0, norm, 1.0)
+            W = P*(total/norm)
+        elif not M is None:
+            #rescale each column for its masked pixels
+            used = M.sum(axis = 0).astype(self.dtype)
+            scale = np.where(used > 0, (r1 - r0)/np.maximum(used, 1), 0.0)
+            W = M*scale
+        if not W is None:
+            W = np.ascontiguousarray(W, dtype = self.dtype)
+            self._buffer = np.empty((r1 - r0, ncols), dtype = self.dtype)
+        self._key     = (shape, geometry)
+        self._rows    = rows
+        self._weights = W
+
+    def get_weights(self):
+        "returns the weights array over the row window, None for a plain sum"
+        return self._weights
+
+    def extract(self, I, geometry = None):
+        """ returns the spectrum of the image 'I' read out with 'geometry', 
+            the (image_area, hbin, vbin) returned by 'frame_geometry'
+        """
+        if (I.shape, geometry) != self._key:
+            self._prepare(I.shape, geometry)
+        window = I[self._rows]
+        if self._weights is None:
+            return window.sum(axis = 0, dtype = self.dtype)
+        buff = self._buffer
+        np.multiply(window, self._weights, out = buff)
+        return buff.sum(axis = 0)
+
+    __call__ = extract
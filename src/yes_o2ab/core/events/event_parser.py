@@ -8,16 +8,79 @@ except ImportError:
 #Automat framework provided
 from automat.core.events.event_parser import EventParser as BaseEventParser
 #yes_o2ab framework provided
+from yes_o2ab.core.data_processing.columnar_store     import ColumnarStore
+from yes_o2ab.core.data_processing.conditions_dataset import ConditionsDataSet
+
+###############################################################################
+HANDLER_PREFIX = "handle_"
 
 ###############################################################################
 class EventParser(BaseEventParser):
+    """ Dispatches each event to the handlers subscribed to its type; the
+        'handle_<EVENT_TYPE>' methods are subscribed at construction, so
+        feeding an event costs one dictionary lookup and unknown event types
+        are skipped without any name formatting.
+    """
     def __init__(self, event_stream = None):
         self.current_solar_tracker_data      = OrderedDict()
         self.current_optics_data             = OrderedDict()
-        self.temperature_dataset             = []
+        self.temperature_store               = ColumnarStore()
+        self.temperature_metadata            = OrderedDict()
         self.curr_temperature_data           = OrderedDict()
+        self.conditions_store                = ColumnarStore()
+        self.conditions_metadata             = OrderedDict()
+        self.event_stream = event_stream
+        self._dispatch = {}
+        for attr_name in dir(self):
+            if attr_name.startswith(HANDLER_PREFIX):
+                handler = getattr(self, attr_name)
+                if callable(handler):
+                    self.subscribe(attr_name[len(HANDLER_PREFIX):], handler)
         BaseEventParser.__init__(self, event_stream = event_stream)
 
+    def subscribe(self, event_type, handler):
+        """ call 'handler(event_info)' for each event of 'event_type', the
+            handlers of a type are called in the order they subscribed
+        """
+        self._dispatch.setdefault(event_type, []).append(handler)
+
+    def unsubscribe(self, event_type, handler):
+        handlers = self._dispatch.get(event_type, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self._dispatch.pop(event_type, None)
+
+    def get_event_types(self):
+        "returns the event types that have subscribed handlers"
+        return self._dispatch.keys()
+
+    def feed(self, event):
+        """ dispatch one event, returns the last parsed object (obj_type, obj)
+            returned by its handlers or None
+        """
+        event_type, event_info = event
+        handlers = self._dispatch.get(event_type)
+        if handlers is None:
+            return None
+        parsed = None
+        for handler in handlers:
+            result = handler(event_info)
+            if not result is None:
+                parsed = result
+        return parsed
+
+    def parse_all(self, event_stream = None):
+        "feed every event of the stream, returns a list of the parsed objects"
+        if event_stream is None:
+            event_stream = self.event_stream
+        parsed_objects = []
+        for event in event_stream:
+            parsed = self.feed(event)
+            if not parsed is None:
+                parsed_objects.append(parsed)
+        return parsed_objects
+
     # solar_tracker events ----------------------------------------------- 
     def handle_SOLAR_TRACKER_STARTED(self,event_info):
         pass
@@ -33,21 +96,55 @@ class EventParser(BaseEventParser):
             
     # temperature_monitor events --------------------------------------------  
     def handle_TEMPERATURE_MONITOR_STARTED(self, event_info):
-        pass
+        self.temperature_store.reset()
+        self.temperature_metadata = OrderedDict()
+        self.temperature_metadata['start_timestamp'] = event_info.get('timestamp')
 
     def handle_TEMPERATURE_MONITOR_STOPPED(self, event_info):
-        pass
-        #self.temperature_dataset.set_metadata('end_timestamp',event_info['timestamp'])
-        #return ('TEMPERATURE_DATASET',self.temperature_dataset)
+        return self._finish_dataset('TEMPERATURE_DATASET', self.temperature_store, self.temperature_metadata, event_info)
 
     def handle_TEMPERATURE_SAMPLE(self, event_info):
-        self.curr_temperature_data.update(event_info)
-        #self.temperature_dataset.append_record(**self.curr_temperature_data)  #add another temperature record
+        self.curr_temperature_data = event_info #keep a reference, not a copy
+        #every item but the timestamp is a temperature channel
+        self.temperature_store.append(event_info.get('timestamp'), event_info, skip = ('timestamp',))
         
     def handle_TEMPERATURE_MONITOR_ABORTED(self, event_info):
-        pass
-        #self.temperature_dataset.set_metadata('end_timestamp',event_info['timestamp'])
-        #return ('TEMPERATURE_DATASET',self.temperature_dataset)
+        return self._finish_dataset('TEMPERATURE_DATASET', self.temperature_store, self.temperature_metadata, event_info)
+
+    def get_temperature_snapshot(self, start = 0):
+        """ returns (t, columns) of the temperature records from index 'start'
+            on, pass the previous length to get only the new records
+        """
+        return self.temperature_store.snapshot(start = start)
+
+    # condition_monitor events ----------------------------------------------
+    def handle_CONDITION_MONITOR_STARTED(self, event_info):
+        self.conditions_store.reset()
+        self.conditions_metadata = OrderedDict()
+        self.conditions_metadata['start_timestamp'] = event_info.get('timestamp')
+        self.conditions_metadata['interval']        = event_info.get('interval')
+
+    def handle_CONDITION_MONITOR_SAMPLE(self, event_info):
+        self.conditions_store.append(event_info.get('timestamp'), event_info['sample'])
+
+    def handle_CONDITION_MONITOR_STOPPED(self, event_info):
+        return self._finish_dataset('CONDITIONS_DATASET', self.conditions_store, self.conditions_metadata, event_info)
+
+    def handle_CONDITION_MONITOR_ABORTED(self, event_info):
+        return self._finish_dataset('CONDITIONS_DATASET', self.conditions_store, self.conditions_metadata, event_info)
+
+    def get_conditions_snapshot(self, start = 0):
+        """ returns (t, columns) of the conditions records from index 'start'
+            on, pass the previous length to get only the new records
+        """
+        return self.conditions_store.snapshot(start = start)
+
+    def _finish_dataset(self, obj_type, store, metadata, event_info):
+        "returns the parsed object (obj_type, ConditionsDataSet) and clears the store"
+        metadata['end_timestamp'] = event_info.get('timestamp')
+        dataset = ConditionsDataSet.from_columnar_store(store, metadata = metadata)
+        store.reset()
+        return (obj_type, dataset)
             
     # band_switcher events --------------------------------------------------
     def handle_BAND_SWITCHER_SELECT_BAND_STARTED(self, event_info):
@@ -63,8 +160,15 @@ class EventParser(BaseEventParser):
 # TEST CODE
 ###############################################################################
 if __name__ == "__main__":
-    from automat.filetools.pickle_file import PickleFile
+    from yes_o2ab.core.storage.event_archive import EventArchive
     import sys
-    PF = PickleFile(sys.argv[1])
-    EP = EventParser(PF)
+    EA = EventArchive(sys.argv[1])
+    #an optional event type and time range selects events through the index
+    event_type = None
+    t0 = t1 = None
+    if len(sys.argv) > 2:
+        event_type = sys.argv[2]
+    if len(sys.argv) > 4:
+        t0, t1 = float(sys.argv[3]), float(sys.argv[4])
+    EP = EventParser(EA.select(event_type = event_type, t0 = t0, t1 = t1))
     print EP.parse_all()
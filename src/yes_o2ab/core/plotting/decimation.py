@@ -0,0 +1,64 @@
+"""
+decimation.py
+
+Min/max decimation of line data for display: the points inside the visible
+x range are split into one bin per screen pixel column and only the minimum
+and maximum of each bin are kept, in their original order.  The line looks
+the same at that resolution, including narrow peaks and dips, while the
+number of points drawn follows the widget width rather than the data size.
+"""
+###############################################################################
+#3rd party
+import numpy as np
+###############################################################################
+def minmax_decimate(X, Y, xlim = None, num_bins = 1000):
+    """ returns (X, Y) reduced to at most about 2*'num_bins' points covering
+        'xlim' (all of X if None); X must be ascending.  Data that is already
+        small enough is returned as is.
+    """
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    n = len(X)
+    if n == 0:
+        return (X, Y)
+    #restrict to the visible range plus one point on either side
+    if xlim is None:
+        i0, i1 = 0, n
+    else:
+        x0, x1 = min(xlim), max(xlim)
+        i0 = max(np.searchsorted(X, x0, side = 'left') - 1, 0)
+        i1 = min(np.searchsorted(X, x1, side = 'right') + 1, n)
+    X = X[i0:i1]
+    Y = Y[i0:i1]
+    n = len(X)
+    num_bins = max(int(num_bins), 1)
+    if n <= 2*num_bins:
+        return (X, Y)
+    #equal count bins, the remainder goes to the last bin
+    k = n//num_bins
+    m = k*num_bins
+    Yb = Y[:m].reshape((num_bins, k))
+    offsets = np.arange(0, m, k)
+    imin = Yb.argmin(axis = 1) + offsets
+    imax = Yb.argmax(axis = 1) + offsets
+    if m < n:
+        tail = Y[m:]
+        imin = np.append(imin, m + tail.argmin())
+        imax = np.append(imax, m + tail.argmax())
+    #keep the pair of each bin in index order so the line is traced correctly
+    first  = np.minimum(imin, imax)
+    second = np.maximum(imin, imax)
+    index = np.empty(2*len(first), dtype = first.dtype)
+    index[0::2] = first
+    index[1::2] = second
+    return (X[index], Y[index])
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    X = np.arange(100000)
+    Y = np.sin(X/1000.0)
+    Y[54321] = 5.0
+    Xd, Yd = minmax_decimate(X, Y, xlim = (0, 99999), num_bins = 500)
+    print len(Xd), Yd.max()
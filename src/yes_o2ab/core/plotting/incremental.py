@@ -0,0 +1,189 @@
+"""
+incremental.py
+
+Incremental plotting mode for charts that are redrawn on every new sample:
+the axes and one Line2D per series are created once, later updates only
+'set_data' the lines and blit them over a cached background.  The axes are
+rescaled, with some headroom, only when the newest points fall outside the
+view, so an update costs the same however many samples came before.  With
+decimation on, the lines only get the min/max decimated points of the visible
+range, recomputed when the data or the x limits change.
+"""
+###############################################################################
+#3rd party
+import numpy as np
+#yes_o2ab framework provided
+from decimation import minmax_decimate
+###############################################################################
+# Module Constants
+RESCALE_HEADROOM = 0.2 #fraction of the data span added when the view grows
+
+###############################################################################
+class IncrementalPlotMixin(object):
+    """ Mix into a plot template class and call 'init_incremental' from its
+        constructor with the chart labels and line styles.
+    """
+    def init_incremental(self,
+                         title      = None,
+                         xlabel     = None,
+                         ylabel     = None,
+                         styles     = None,
+                         use_legend = False,
+                         headroom   = RESCALE_HEADROOM,
+                         decimate   = True,
+                        ):
+        self._inc_title      = title
+        self._inc_xlabel     = xlabel
+        self._inc_ylabel     = ylabel
+        self._inc_styles     = styles or ['-']
+        self._inc_use_legend = use_legend
+        self._inc_headroom   = float(headroom)
+        self._inc_decimate   = decimate
+        self.reset_incremental()
+
+    def reset_incremental(self):
+        "forget the artists, the next update rebuilds the figure"
+        if not getattr(self, '_inc_draw_cid', None) is None:
+            self._inc_figure.canvas.mpl_disconnect(self._inc_draw_cid)
+        self._inc_figure     = None
+        self._inc_axes       = None
+        self._inc_lines      = []
+        self._inc_labels     = None
+        self._inc_line_styles = None
+        self._inc_data       = None #the full (Xs, Ys) behind the lines
+        self._inc_auto_limits = None #the limits last set by '_rescale'
+        self._inc_background = None
+        self._inc_draw_cid   = None
+
+    def update_incremental(self, Xs, Ys, labels = None, figure = None):
+        """ show the series (Xs[i], Ys[i]) in 'figure', reusing the lines
+            when the figure and the labels are unchanged; the arrays are
+            not copied, so views of a ring buffer can be passed directly
+        """
+        if labels is None:
+            labels = [None]*len(Ys)
+        labels = list(labels)
+        if figure is not self._inc_figure or labels != self._inc_labels:
+            self._setup_incremental(figure, labels)
+        self._set_line_data(Xs, Ys)
+        if self._needs_rescale(Xs, Ys):
+            self._rescale(Xs, Ys)
+            figure.canvas.draw() #the draw event recaches the background
+        else:
+            self._blit()
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _setup_incremental(self, figure, labels, styles = None):
+        self.reset_incremental()
+        figure.clear()
+        ax = figure.add_subplot(111)
+        if self._inc_title:
+            ax.set_title(self._inc_title)
+        if self._inc_xlabel:
+            ax.set_xlabel(self._inc_xlabel)
+        if self._inc_ylabel:
+            ax.set_ylabel(self._inc_ylabel)
+        if styles is None:
+            styles = self._inc_styles
+        lines = []
+        for i, label in enumerate(labels):
+            line, = ax.plot([], [], styles[i % len(styles)], label = label, animated = True)
+            lines.append(line)
+        if self._inc_use_legend and any(labels):
+            ax.legend(loc = 'best')
+        self._inc_figure = figure
+        self._inc_axes   = ax
+        self._inc_lines  = lines
+        self._inc_labels = labels
+        self._inc_line_styles = styles
+        self._inc_auto_limits = None
+        self._inc_background = None
+        #zooming, panning or rescaling changes what needs to be decimated
+        ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        #a full draw (resize, rescale) must recache the background
+        self._inc_draw_cid = figure.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _set_line_data(self, Xs, Ys):
+        self._inc_data = (Xs, Ys)
+        self._update_line_data()
+
+    def _update_line_data(self):
+        Xs, Ys = self._inc_data
+        if self._inc_decimate:
+            ax = self._inc_axes
+            xlim = ax.get_xlim()
+            num_bins = max(int(ax.bbox.width), 1) #one bin per pixel column
+            for line, X, Y in zip(self._inc_lines, Xs, Ys):
+                line.set_data(*minmax_decimate(X, Y, xlim = xlim, num_bins = num_bins))
+        else:
+            for line, X, Y in zip(self._inc_lines, Xs, Ys):
+                line.set_data(X, Y)
+
+    def _on_xlim_changed(self, ax):
+        if not self._inc_data is None:
+            self._update_line_data()
+
+    def _on_draw(self, event):
+        canvas = self._inc_figure.canvas
+        self._inc_background = canvas.copy_from_bbox(self._inc_axes.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        ax = self._inc_axes
+        for line in self._inc_lines:
+            ax.draw_artist(line)
+
+    def _blit(self):
+        canvas = self._inc_figure.canvas
+        if self._inc_background is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self._inc_background)
+        self._draw_lines()
+        canvas.blit(self._inc_axes.bbox)
+
+    def _needs_rescale(self, Xs, Ys):
+        "only the newest point of each series and the oldest time are checked"
+        if self._inc_background is None:
+            return True
+        if self._user_navigated():
+            return False
+        x0, x1 = self._inc_axes.get_xlim()
+        y0, y1 = self._inc_axes.get_ylim()
+        for X, Y in zip(Xs, Ys):
+            if len(X) == 0:
+                continue
+            if X[0] < x0 or X[-1] > x1:
+                return True
+            y = Y[-1]
+            if not np.isnan(y) and (y < y0 or y > y1):
+                return True
+        return False
+
+    def _rescale(self, Xs, Ys):
+        xs = [(X[0], X[-1]) for X in Xs if len(X)]
+        if not xs:
+            return
+        xmin = min(x[0] for x in xs)
+        xmax = max(x[1] for x in xs)
+        ymin = np.nanmin([np.nanmin(Y) for Y in Ys if len(Y)])
+        ymax = np.nanmax([np.nanmax(Y) for Y in Ys if len(Y)])
+        h = self._inc_headroom
+        dx = (xmax - xmin) or 1.0
+        dy = (ymax - ymin) or 1.0
+        #time only grows, so the headroom goes on the right
+        self._inc_axes.set_xlim(xmin, xmax + h*dx)
+        if np.isfinite(ymin) and np.isfinite(ymax):
+            self._inc_axes.set_ylim(ymin - h*dy/2, ymax + h*dy/2)
+        self._remember_limits()
+
+    def _remember_limits(self):
+        ax = self._inc_axes
+        self._inc_auto_limits = (ax.get_xlim(), ax.get_ylim())
+
+    def _user_navigated(self):
+        "True when the view was zoomed or panned away from the automatic limits"
+        ax = self._inc_axes
+        return (not self._inc_auto_limits is None and
+                self._inc_auto_limits != (ax.get_xlim(), ax.get_ylim()))
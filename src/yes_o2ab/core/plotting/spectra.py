@@ -3,9 +3,106 @@ spectra.py
 
 """
 from matplotlib.font_manager import FontProperties
+import numpy as np
 from automat.core.plotting.plots import MultiPlot
+from incremental import IncrementalPlotMixin
 
+###############################################################################
+YLIM_HEADROOM = 0.05 #fraction of the intensity span kept free above and below
+YLIM_SHRINK   = 0.5  #rescale when the data fills less than this of the view
+
+class SpectrumUpdateMixin(IncrementalPlotMixin):
+    """ Blitted updates of spectra over the pixel axis: the lines are kept
+        between frames and only get new data, the pixel index arrays are
+        cached per length, and the legend and title are only redrawn when
+        the labels or title change.
+    """
+    def init_incremental(self, **kwargs):
+        kwargs.setdefault('headroom', YLIM_HEADROOM)
+        IncrementalPlotMixin.init_incremental(self, **kwargs)
+        self._pixel_index = {}
+
+    def get_pixel_index(self, length):
+        "returns the cached x array 0..length-1"
+        X = self._pixel_index.get(length)
+        if X is None:
+            X = np.arange(length)
+            self._pixel_index[length] = X
+        return X
+
+    def update_spectra(self, Ys, labels = None, styles = None, title = None, figure = None):
+        """ show the spectra 'Ys' in 'figure', reusing the lines when the
+            figure, number of spectra, their lengths and styles are unchanged
+        """
+        if labels is None:
+            labels = [None]*len(Ys)
+        labels = list(labels)
+        Xs = [self.get_pixel_index(len(Y)) for Y in Ys]
+        lengths = None
+        if not self._inc_data is None:
+            lengths = [len(Y) for Y in self._inc_data[1]]
+        rebuild = (figure is not self._inc_figure or
+                   lengths != [len(Y) for Y in Ys] or
+                   (not styles is None and list(styles) != self._inc_line_styles)
+                  )
+        if not title is None:
+            self._inc_title = title
+        if rebuild:
+            self._setup_incremental(figure, labels, styles = styles)
+        full_draw = rebuild
+        ax = self._inc_axes
+        if not rebuild and labels != self._inc_labels:
+            for line, label in zip(self._inc_lines, labels):
+                line.set_label(label)
+            if self._inc_use_legend:
+                ax.legend(loc = 'best')
+            self._inc_labels = labels
+            full_draw = True
+        if not rebuild and ax.get_title() != (self._inc_title or ''):
+            ax.set_title(self._inc_title)
+            full_draw = True
+        self._set_line_data(Xs, Ys)
+        if self._needs_rescale(Xs, Ys):
+            self._rescale(Xs, Ys)
+            figure.canvas.draw() #the draw event recaches the background
+        elif full_draw:
+            figure.canvas.draw()
+        else:
+            self._blit()
+
+    def _needs_rescale(self, Xs, Ys):
+        if self._inc_background is None:
+            return True
+        if self._user_navigated():
+            return False
+        y0, y1 = self._inc_axes.get_ylim()
+        ymin, ymax = self._y_range(Ys)
+        if not (np.isfinite(ymin) and np.isfinite(ymax)):
+            return False #nothing to fit the limits to
+        if ymin < y0 or ymax > y1:
+            return True
+        return (ymax - ymin) < YLIM_SHRINK*(y1 - y0)
+
+    def _rescale(self, Xs, Ys):
+        if not Ys:
+            return
+        n = max(len(X) for X in Xs)
+        ymin, ymax = self._y_range(Ys)
+        dy = (ymax - ymin) or 1.0
+        h  = self._inc_headroom
+        self._inc_axes.set_xlim(0, max(n - 1, 1))
+        if np.isfinite(ymin) and np.isfinite(ymax):
+            self._inc_axes.set_ylim(ymin - h*dy, ymax + h*dy)
+        self._remember_limits()
 
+    def _y_range(self, Ys):
+        "the range of the spectra ignoring NaN pixels, NaN if there are no values"
+        Ys = [Y for Y in Ys if len(Y)]
+        if not Ys:
+            return (np.nan, np.nan)
+        ymin = np.nanmin([np.nanmin(Y) for Y in Ys])
+        ymax = np.nanmax([np.nanmax(Y) for Y in Ys])
+        return (ymin, ymax)
 
 ###############################################################################
 TITLE  = 'Raw Spectrum'
@@ -15,8 +112,9 @@ STYLES = ['r-','g-','b-','c-','y-','m-','k-','r--','g--','b--','c--','y--','m--'
 YTICKS_POWERLIMITS = (-2,3)
 USE_LEGEND = True
 
-class RawSpectrumPlot(MultiPlot):
-    """ A chart for displaying spectra
+class RawSpectrumPlot(SpectrumUpdateMixin, MultiPlot):
+    """ A chart for displaying spectra, use 'update_spectra' for redraws
+        during continual capture
     """
     def __init__(self,
                  title      = TITLE,
@@ -36,6 +134,12 @@ class RawSpectrumPlot(MultiPlot):
                            use_legend = use_legend,
                            **kwargs
                           )
+        self.init_incremental(title      = title,
+                              xlabel     = xlabel,
+                              ylabel     = ylabel,
+                              styles     = styles,
+                              use_legend = use_legend,
+                             )
                           
 ###############################################################################
 TITLE  = "Processed Spectrum"
@@ -45,8 +149,9 @@ STYLES = ['r-','g-','b-','c-','y-','m-','k-','r--','g--','b--','c--','y--','m--'
 YTICKS_POWERLIMITS = (-2,3)
 USE_LEGEND = False
 
-class ProcessedSpectrumPlot(MultiPlot):
-    """ A chart for displaying spectra
+class ProcessedSpectrumPlot(SpectrumUpdateMixin, MultiPlot):
+    """ A chart for displaying spectra, use 'update_spectra' for redraws
+        during continual capture
     """
     def __init__(self,
                  title      = TITLE,
@@ -66,3 +171,9 @@ class ProcessedSpectrumPlot(MultiPlot):
                            use_legend = use_legend,
                            **kwargs
                           )
+        self.init_incremental(title      = title,
+                              xlabel     = xlabel,
+                              ylabel     = ylabel,
+                              styles     = styles,
+                              use_legend = use_legend,
+                             )
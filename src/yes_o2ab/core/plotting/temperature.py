@@ -1,14 +1,16 @@
 """
-spectra.py
+temperature.py
 
 """
 from matplotlib.font_manager import FontProperties
 from automat.core.plotting.plots import MultiPlot
+from incremental import IncrementalPlotMixin
 
 ###############################################################################
 USE_LEGEND = True
-class TemperaturePlot(MultiPlot):
-    """ A chart for displaying spectra
+class TemperaturePlot(IncrementalPlotMixin, MultiPlot):
+    """ A chart for displaying temperature histories, use 'update_incremental'
+        to redraw it on every sample
     """
     def __init__(self,
                  title      = 'Thermal Monitoring',
@@ -26,3 +28,9 @@ class TemperaturePlot(MultiPlot):
                            use_legend = use_legend,
                            **kwargs
                           )
+        self.init_incremental(title      = title,
+                              xlabel     = xlabel,
+                              ylabel     = ylabel,
+                              styles     = styles,
+                              use_legend = use_legend,
+                             )
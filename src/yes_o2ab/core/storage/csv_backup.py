@@ -0,0 +1,103 @@
+"""
+csv_backup.py
+
+Backup CSV file that grows by appending one row per sample, so keeping it
+up to date costs the same however long the run is.  The file is started with
+'start', which writes the header and the samples held so far to a temporary
+file, syncs it and renames it over the backup, so a crash leaves either the
+old or the new file complete.  After that rows are only ever appended, the
+file is never rewritten with fewer rows than it holds.
+
+Once 'max_rows' rows have been written the file is rotated: it is renamed
+to the backup with ROTATED_SUFFIX, replacing the one before, and a new file
+is started the same crash-safe way with the raw samples still held in
+memory.  This compacts the backup to the recent samples and bounds its size,
+and since a rotation rewrites at most the samples held it happens only
+every so many samples, the cost per sample stays constant.
+"""
+###############################################################################
+#Standard Python
+import os
+###############################################################################
+# Module Constants
+TEMP_SUFFIX    = ".tmp"
+ROTATED_SUFFIX = ".1"
+
+def _format_row(values):
+    return ",".join([repr(float(val)) for val in values]) + "\n"
+
+def _replace(src, dst):
+    if os.name == 'nt' and os.path.exists(dst): #rename will not replace on Windows
+        os.remove(dst)
+    os.rename(src, dst)
+
+###############################################################################
+class AppendingCSVWriter(object):
+    "'max_rows' of None never rotates the file"
+    def __init__(self, filename, max_rows = None):
+        self.filename = filename
+        self.max_rows = max_rows
+        self.names = None
+        self.rows_written = 0
+        self._file = None
+
+    def is_started(self):
+        return not self._file is None
+
+    def needs_rotation(self):
+        return not self.max_rows is None and self.rows_written >= self.max_rows
+
+    def append(self, t, row):
+        "append one row with time 't' and the values 'row' ordered as 'names'"
+        if self._file is None:
+            raise RuntimeError("the backup must be started before appending")
+        self._file.write(_format_row([t] + list(row)))
+        self._file.flush()
+        self.rows_written += 1
+
+    def start(self, names, t, columns):
+        """ replace the backup with the header 'names' and the rows of times
+            't' and the sequence of channel arrays 'columns', later rows are
+            appended
+        """
+        self.close()
+        self.names = list(names)
+        temp_filename = self._write_temp(t, columns)
+        _replace(temp_filename, self.filename)
+        self._open(len(t))
+
+    def rotate(self, t, columns):
+        """ keep the current file as the rotated backup and start a new one
+            with the rows of times 't' and channel arrays 'columns', which 
+            should be the raw samples still held
+        """
+        if self.names is None:
+            raise RuntimeError("the backup must be started before rotating")
+        self.close()
+        #the new file is complete on disk before the old one is moved aside
+        temp_filename = self._write_temp(t, columns)
+        if os.path.exists(self.filename):
+            _replace(self.filename, self.filename + ROTATED_SUFFIX)
+        _replace(temp_filename, self.filename)
+        self._open(len(t))
+
+    def close(self):
+        if not self._file is None:
+            self._file.close()
+            self._file = None
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _write_temp(self, t, columns):
+        temp_filename = self.filename + TEMP_SUFFIX
+        with open(temp_filename, 'w') as f:
+            f.write(",".join(['timestamp'] + self.names) + "\n")
+            for i in xrange(len(t)):
+                f.write(_format_row([t[i]] + [Y[i] for Y in columns]))
+            f.flush()
+            os.fsync(f.fileno())
+        return temp_filename
+
+    def _open(self, num_rows):
+        self._file = open(self.filename, 'a')
+        self.rows_written = num_rows
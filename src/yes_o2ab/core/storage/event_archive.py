@@ -0,0 +1,202 @@
+"""
+event_archive.py
+
+Random access to a session event log written by the CompressedEventLogWriter.
+The sidecar index holds the type, timestamp and position of every event, so a
+selection by type and time range only decompresses the chunks holding the
+matching events and only unpickles those events.  When the index is missing it
+is rebuilt by scanning the log once; index entries into a chunk that was cut
+off by a crash, going by its header and the length of the log, are dropped.
+"""
+###############################################################################
+#Standard Python
+import os
+#use the faster library if available
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+#3rd party
+import numpy as np
+#yes_o2ab framework provided
+from event_log import LOG_MAGIC, LOG_HEADER, CHUNK_HEADER, CHUNK_MAGIC,\
+                      INDEX_MAGIC, INDEX_ENTRY, get_codec, iter_chunks
+###############################################################################
+# Module Constants
+INDEX_SUFFIX = ".idx"
+INDEX_DTYPE  = np.dtype([('timestamp',    '<f8'),
+                         ('chunk_offset', '<u8'),
+                         ('offset',       '<u8'),
+                         ('length',       '<u4'),
+                         ('type',         'S64'),
+                        ])
+assert INDEX_DTYPE.itemsize == INDEX_ENTRY.size
+
+###############################################################################
+class EventArchive(object):
+    "indexed reader for the compressed event log at 'filename'"
+    def __init__(self, filename, index_filename = None):
+        self.filename = filename
+        if index_filename is None:
+            index_filename = filename + INDEX_SUFFIX
+        self.index_filename = index_filename
+        self._file = open(filename, 'rb')
+        magic, codec = LOG_HEADER.unpack(self._file.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC:
+            raise IOError("'%s' is not a compressed event log" % filename)
+        self.codec = codec.rstrip('\0')
+        _, self._decompress = get_codec(self.codec)
+        self._file.seek(0, os.SEEK_END)
+        self._size = self._file.tell()
+        self._chunk_cache = (None, None) #offset and data of the last chunk read
+        if os.path.exists(index_filename):
+            self.index = self._load_index(index_filename)
+        else:
+            self.index = self.rebuild_index()
+
+    def _load_index(self, index_filename):
+        with open(index_filename, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise IOError("'%s' is not an event log index" % index_filename)
+            data = f.read()
+        #drop a partially written last entry
+        count = len(data)//INDEX_DTYPE.itemsize
+        index = np.frombuffer(data[:count*INDEX_DTYPE.itemsize], dtype = INDEX_DTYPE)
+        #drop any entry whose chunk did not make it whole to the log, which
+        #the chunk headers tell, one read per chunk
+        keep = np.zeros(len(index), dtype = 'bool')
+        chunk_offsets, inverse = np.unique(index['chunk_offset'], return_inverse = True)
+        for i, chunk_offset in enumerate(chunk_offsets):
+            size = self._read_chunk_size(int(chunk_offset))
+            if size is None:
+                continue
+            entries = (inverse == i)
+            keep[entries] = index['offset'][entries] + index['length'][entries] <= size
+        return index[keep]
+
+    def _read_chunk_size(self, chunk_offset):
+        "the uncompressed size of the chunk at 'chunk_offset', None if it is not all in the log"
+        if chunk_offset + CHUNK_HEADER.size > self._size:
+            return None
+        self._file.seek(chunk_offset)
+        magic, size, csize = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC or chunk_offset + CHUNK_HEADER.size + csize > self._size:
+            return None
+        return size
+
+    def rebuild_index(self):
+        "scan the whole log for the event positions, unpickling every event"
+        entries = []
+        self._file.seek(0)
+        for chunk_offset, data in iter_chunks(self._file):
+            pos = 0
+            while pos < len(data):
+                #Unpickler.load stops at the STOP opcode, so the position
+                #after each load is the end of that event's pickle
+                reader = _SliceReader(data, pos)
+                event_type, info = pickle.Unpickler(reader).load()
+                end = reader.pos
+                timestamp = info.get('timestamp', np.nan)
+                if timestamp is None:
+                    timestamp = np.nan
+                entries.append((timestamp, chunk_offset, pos, end - pos, event_type))
+                pos = end
+        self._chunk_cache = (None, None)
+        return np.array(entries, dtype = INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        "yields all events in the order they were written"
+        for n in xrange(len(self.index)):
+            yield self._load(self.index[n])
+
+    def __getitem__(self, n):
+        return self._load(self.index[n])
+
+    def get_event_types(self):
+        "returns the sorted unique event types in the log"
+        return sorted(set(self.index['type']))
+
+    def get_timestamps(self, event_type = None):
+        if event_type is None:
+            return self.index['timestamp']
+        return self.index['timestamp'][self.index['type'] == event_type]
+
+    def find(self, event_type = None, t0 = None, t1 = None):
+        """ returns the index positions of events of 'event_type' (a name or a
+            sequence of names) with t0 <= timestamp <= t1, any criterion left
+            as None matches everything
+        """
+        mask = np.ones(len(self.index), dtype = bool)
+        if not event_type is None:
+            if isinstance(event_type, basestring):
+                mask &= self.index['type'] == event_type
+            else:
+                mask &= np.in1d(self.index['type'], list(event_type))
+        ts = self.index['timestamp']
+        if not t0 is None:
+            mask &= ts >= t0
+        if not t1 is None:
+            mask &= ts <= t1
+        return np.nonzero(mask)[0]
+
+    def select(self, event_type = None, t0 = None, t1 = None):
+        """ yields the events matching the criteria of 'find' in log order,
+            only their chunks are decompressed and only they are unpickled
+        """
+        for n in self.find(event_type = event_type, t0 = t0, t1 = t1):
+            yield self._load(self.index[n])
+
+    def close(self):
+        self._file.close()
+        self._chunk_cache = (None, None)
+
+    #--------------------------------------------------------------------------
+    # Helper Methods
+    def _read_chunk(self, chunk_offset):
+        cached_offset, data = self._chunk_cache
+        if cached_offset == chunk_offset:
+            return data
+        self._file.seek(chunk_offset)
+        magic, size, csize = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC:
+            raise IOError("no chunk at offset %d of '%s'" % (chunk_offset, self.filename))
+        data = self._decompress(self._file.read(csize))
+        self._chunk_cache = (chunk_offset, data)
+        return data
+
+    def _load(self, entry):
+        data = self._read_chunk(int(entry['chunk_offset']))
+        offset = int(entry['offset'])
+        return pickle.loads(data[offset:offset + int(entry['length'])])
+
+###############################################################################
+class _SliceReader(object):
+    "file-like reader over 'data' starting at 'pos', tracks the read position"
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos  = pos
+
+    def read(self, n):
+        s = self.data[self.pos:self.pos + n]
+        self.pos += len(s)
+        return s
+
+    def readline(self):
+        end = self.data.find('\n', self.pos)
+        end = len(self.data) if end < 0 else end + 1
+        s = self.data[self.pos:end]
+        self.pos = end
+        return s
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    import sys
+    EA = EventArchive(sys.argv[1])
+    print "%d events" % len(EA)
+    for event_type in EA.get_event_types():
+        print event_type, len(EA.find(event_type = event_type))
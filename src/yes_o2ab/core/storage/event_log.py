@@ -0,0 +1,435 @@
+"""
+event_log.py
+
+Asynchronous writer for pickled event logs: events are queued by the caller
+and pickled, batched and written by a background thread, with the file
+synced according to the durability mode.  The CompressedEventLogWriter 
+compresses the log as it goes in independently decompressible chunks, so a
+crash loses at most the chunk being filled.
+
+Compressed log format:
+    file header  - magic 'YESEVZ01', codec name (8 bytes)
+    chunks       - magic 'CHNK', uncompressed size, compressed size (uint64),
+                   then the compressed concatenation of pickled events
+
+Sidecar index format (optional, written alongside a compressed log):
+    file header  - magic 'YESEVI01'
+    entries      - timestamp (float64), file offset of the chunk (uint64),
+                   offset within the decompressed chunk (uint64), pickled
+                   length (uint32), event type (64 bytes)
+  an entry is written only after its chunk, so the index never points past
+  the end of the log.
+
+Durability modes:
+    'none'     - data is left to the OS, synced only on close
+    'interval' - synced when 'sync_interval' seconds or 'sync_bytes' bytes
+                 have passed since the last sync (default)
+    'batch'    - synced after every batch
+    'event'    - every event is written and synced on its own
+'before_sync' is called at the start of every sync, so files that the events
+refer to (such as a frame store) can be synced before the events are.
+"""
+###############################################################################
+#Standard Python
+import os, time, struct, threading, Queue, zlib, bz2
+from cStringIO import StringIO
+#use the faster library if available
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from collections import OrderedDict
+except ImportError:
+    from yes_o2ab.support.odict import OrderedDict
+#lzma is only in the standard library from python 3.3
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+###############################################################################
+# Module Constants
+DURABILITY_MODES   = ['none','interval','batch','event']
+MAX_QUEUE_SIZE     = 4096
+BATCH_SIZE         = 256
+SYNC_INTERVAL      = 1.0      #seconds
+SYNC_BYTES         = 2**20    #one megabyte
+PUT_TIMEOUT        = 0.5      #seconds between checks that the writer thread is alive
+PICKLE_PROTOCOL    = pickle.HIGHEST_PROTOCOL
+
+CHUNK_SIZE         = 2**18    #uncompressed bytes per compressed chunk
+COMPRESSION_LEVEL  = 6
+LOG_MAGIC          = "YESEVZ01"
+LOG_HEADER         = struct.Struct("<8s8s")   #magic, codec
+CHUNK_MAGIC        = "CHNK"
+CHUNK_HEADER       = struct.Struct("<4sQQ")   #magic, uncompressed size, compressed size
+INDEX_MAGIC        = "YESEVI01"
+INDEX_ENTRY        = struct.Struct("<dQQI64s") #timestamp, chunk offset, offset, length, type
+
+_STOP = object() #sentinel to end the writer thread
+
+###############################################################################
+# Codecs
+def _lzma_compress(data, level):
+    return lzma.compress(data, preset = level)
+
+def _lzma_decompress(data):
+    return lzma.decompress(data)
+
+#codec -> (compress(data, level), decompress(data))
+CODECS = OrderedDict([
+    ('none', (lambda data, level: data,                           lambda data: data)),
+    ('zlib', (lambda data, level: zlib.compress(data, level),     zlib.decompress)),
+    ('bz2',  (lambda data, level: bz2.compress(data, max(level,1)), bz2.decompress)),
+])
+if not lzma is None:
+    CODECS['lzma'] = (_lzma_compress, _lzma_decompress)
+
+def get_codec(name):
+    "returns the (compress, decompress) pair for the codec 'name'"
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("codec '%s' is not available, must be one of %r" % (name, CODECS.keys()))
+
+###############################################################################
+class EventLogWriter(object):
+    """ Writes events to the open binary 'stream' from a background thread.
+        'write' blocks only while the queue holds 'max_queue' events.
+        'before_sync' is an optional callable run at the start of each sync.
+    """
+    def __init__(self,
+                 stream,
+                 durability    = 'interval',
+                 max_queue     = MAX_QUEUE_SIZE,
+                 batch_size    = BATCH_SIZE,
+                 sync_interval = SYNC_INTERVAL,
+                 sync_bytes    = SYNC_BYTES,
+                 protocol      = PICKLE_PROTOCOL,
+                 before_sync   = None,
+                ):
+        if not durability in DURABILITY_MODES:
+            raise ValueError("durability '%s' is not valid, must be one of %r" % (durability, DURABILITY_MODES))
+        self.stream        = stream
+        self.durability    = durability
+        self.batch_size    = int(batch_size)
+        if durability == 'event':
+            self.batch_size = 1
+        self.sync_interval = float(sync_interval)
+        self.sync_bytes    = int(sync_bytes)
+        self.protocol      = int(protocol)
+        self.before_sync   = before_sync
+        self._queue  = Queue.Queue(maxsize = int(max_queue))
+        self._thread = None
+        self._error  = None
+        #counters
+        self._stats_lock = threading.Lock()
+        self.events_written   = 0
+        self.batches_written  = 0
+        self.bytes_written    = 0
+        self.syncs            = 0
+        self.max_queue_depth  = 0
+        self.last_latency     = 0.0
+        self.max_latency      = 0.0
+        self._total_latency   = 0.0
+        self._last_sync_time  = time.time()
+        self._unsynced_bytes  = 0
+
+    def start(self):
+        self._thread = threading.Thread(target = self._run, name = "EventLogWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, event):
+        "queue the event to be written, raises IOError if the writer thread died"
+        self._put((time.time(), event))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def close(self):
+        "write out all queued events, sync and stop the writer thread"
+        if not self._thread is None:
+            try:
+                self._put(_STOP)
+                self._thread.join()
+            except IOError:
+                pass #the thread died, what is queued can not be written
+            self._thread = None
+        self._finish()
+
+    def _put(self, item):
+        "put 'item' on the queue without blocking forever on a dead writer thread"
+        while True:
+            if not self._error is None:
+                raise IOError("event log writer failed: %s" % self._error)
+            if not self._thread is None and not self._thread.is_alive():
+                raise IOError("event log writer thread is not running")
+            try:
+                self._queue.put(item, timeout = PUT_TIMEOUT)
+                return
+            except Queue.Full:
+                pass
+
+    def _finish(self):
+        "hook for subclasses to write any trailing data, then sync"
+        self.sync()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        stats = OrderedDict()
+        with self._stats_lock:
+            stats['queue_depth']     = self._queue.qsize()
+            stats['max_queue_depth'] = self.max_queue_depth
+            stats['events_written']  = self.events_written
+            stats['batches_written'] = self.batches_written
+            stats['bytes_written']   = self.bytes_written
+            stats['syncs']           = self.syncs
+            stats['last_latency']    = self.last_latency
+            stats['max_latency']     = self.max_latency
+            mean = 0.0
+            if self.events_written:
+                mean = self._total_latency/self.events_written
+            stats['mean_latency']    = mean
+        return stats
+
+    def sync(self):
+        "sync what the events refer to, then flush and fsync the stream"
+        if not self.before_sync is None:
+            self.before_sync()
+        self._sync_stream()
+
+    def _sync_stream(self):
+        self.stream.flush()
+        try:
+            os.fsync(self.stream.fileno())
+        except (AttributeError, OSError, ValueError):
+            pass #not a real file
+        self.syncs += 1
+        self._last_sync_time = time.time()
+        self._unsynced_bytes = 0
+
+    def serialize(self, event):
+        return pickle.dumps(event, self.protocol)
+
+    def _write_data(self, data):
+        "hook for subclasses to transform the batch data, returns bytes written"
+        self.stream.write(data)
+        return len(data)
+
+    def _run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                try:
+                    item = self._queue.get(timeout = self.sync_interval)
+                except Queue.Empty:
+                    item = None
+                while not item is None:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except Queue.Empty:
+                        item = None
+                if batch:
+                    self._write_batch(batch)
+                self._apply_sync_policy(written = bool(batch))
+        except Exception, exc:
+            self._error = exc
+            raise
+
+    def _index_batch(self, batch, pieces):
+        "hook for subclasses to index the serialized events of a batch"
+        pass
+
+    def _write_batch(self, batch):
+        pieces = [self.serialize(event) for t, event in batch]
+        self._index_batch(batch, pieces)
+        data = "".join(pieces)
+        nbytes = self._write_data(data)
+        now = time.time()
+        with self._stats_lock:
+            for t, event in batch:
+                latency = now - t
+                self._total_latency += latency
+                if latency > self.max_latency:
+                    self.max_latency = latency
+            self.last_latency     = now - batch[-1][0]
+            self.events_written  += len(batch)
+            self.batches_written += 1
+            self.bytes_written   += nbytes
+        self._unsynced_bytes += len(data)
+
+    def _apply_sync_policy(self, written):
+        mode = self.durability
+        if mode == 'none':
+            return
+        if mode in ('batch','event'):
+            if written:
+                self.sync()
+        elif mode == 'interval':
+            if self._unsynced_bytes >= self.sync_bytes or \
+               (self._unsynced_bytes > 0 and time.time() - self._last_sync_time >= self.sync_interval):
+                self.sync()
+
+###############################################################################
+class CompressedEventLogWriter(EventLogWriter):
+    """ EventLogWriter that compresses the pickled events with 'codec' in 
+        chunks of about 'chunk_size' uncompressed bytes.  A chunk is also 
+        closed on every sync, so the durability mode bounds what a crash 
+        can lose.
+    """
+    def __init__(self,
+                 stream,
+                 codec             = 'zlib',
+                 compression_level = COMPRESSION_LEVEL,
+                 chunk_size        = CHUNK_SIZE,
+                 index_stream      = None,
+                 **kwargs
+                ):
+        self.codec = codec
+        self._compress, _ = get_codec(codec)
+        self.compression_level = int(compression_level)
+        self.chunk_size = int(chunk_size)
+        self.index_stream = index_stream
+        self.chunks_written = 0
+        self.raw_bytes      = 0
+        self._pending       = []
+        self._pending_size  = 0
+        self._pending_index = []
+        EventLogWriter.__init__(self, stream, **kwargs)
+        self.stream.write(LOG_HEADER.pack(LOG_MAGIC, codec))
+        self._file_offset = LOG_HEADER.size
+        if not index_stream is None:
+            index_stream.write(INDEX_MAGIC)
+
+    def _index_batch(self, batch, pieces):
+        if self.index_stream is None:
+            return
+        #the pending data goes into the chunk at the current file offset
+        offset = self._pending_size
+        for (t, event), piece in zip(batch, pieces):
+            event_type, info = event
+            timestamp = None
+            try:
+                timestamp = info.get('timestamp')
+            except AttributeError:
+                pass
+            if timestamp is None:
+                timestamp = t
+            entry = INDEX_ENTRY.pack(float(timestamp), self._file_offset, offset, len(piece), str(event_type)[:64])
+            self._pending_index.append(entry)
+            offset += len(piece)
+
+    def _write_data(self, data):
+        self._pending.append(data)
+        self._pending_size += len(data)
+        self.raw_bytes     += len(data)
+        if self._pending_size >= self.chunk_size:
+            return self._write_chunk()
+        return 0
+
+    def _write_chunk(self):
+        if not self._pending:
+            return 0
+        data = "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        cdata = self._compress(data, self.compression_level)
+        self.stream.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(data), len(cdata)))
+        self.stream.write(cdata)
+        self.chunks_written += 1
+        nbytes = CHUNK_HEADER.size + len(cdata)
+        self._file_offset += nbytes
+        if self._pending_index:
+            self.index_stream.write("".join(self._pending_index))
+            self._pending_index = []
+        return nbytes
+
+    def _sync_stream(self):
+        #only whole chunks can be read back, so close the pending one
+        nbytes = self._write_chunk()
+        with self._stats_lock:
+            self.bytes_written += nbytes
+        EventLogWriter._sync_stream(self)
+        if not self.index_stream is None:
+            #the index is rebuildable from the log, so a flush is enough
+            self.index_stream.flush()
+
+    def get_stats(self):
+        stats = EventLogWriter.get_stats(self)
+        stats['chunks_written'] = self.chunks_written
+        stats['raw_bytes']      = self.raw_bytes
+        return stats
+
+###############################################################################
+def iter_chunks(stream):
+    """ yields the (offset, decompressed data) of each chunk of a compressed
+        event log, stopping quietly at a truncated chunk
+    """
+    header = stream.read(LOG_HEADER.size)
+    magic, codec = LOG_HEADER.unpack(header)
+    if magic != LOG_MAGIC:
+        raise IOError("not a compressed event log")
+    _, decompress = get_codec(codec.rstrip('\0'))
+    offset = LOG_HEADER.size
+    while True:
+        header = stream.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            return
+        magic, size, csize = CHUNK_HEADER.unpack(header)
+        if magic != CHUNK_MAGIC:
+            return
+        cdata = stream.read(csize)
+        if len(cdata) < csize: #cut off by a crash
+            return
+        yield (offset, decompress(cdata))
+        offset += CHUNK_HEADER.size + csize
+
+def iter_pickled(data):
+    "yields the objects pickled one after another in the string 'data'"
+    buff = StringIO(data)
+    unpickler = pickle.Unpickler(buff)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+def read_event_log(filename):
+    """ yields the events of a log written by either writer, the compressed
+        format is recognized by its header
+    """
+    with open(filename, 'rb') as stream:
+        magic = stream.read(len(LOG_MAGIC))
+        stream.seek(0)
+        if magic == LOG_MAGIC:
+            for offset, data in iter_chunks(stream):
+                for event in iter_pickled(data):
+                    yield event
+        else:
+            unpickler = pickle.Unpickler(stream)
+            while True:
+                try:
+                    yield unpickler.load()
+                except EOFError:
+                    return
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    import sys
+    for event in read_event_log(sys.argv[1]):
+        print event[0]
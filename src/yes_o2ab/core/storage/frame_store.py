@@ -0,0 +1,173 @@
+"""
+frame_store.py
+
+Append-only binary storage of image frames, so that event logs only need to
+keep a small FrameRef to each image.  The data file begins with a fixed file
+header followed by one record per frame, each a fixed record header and the
+raw C-ordered pixel data padded to 8 bytes.  A companion index file holds one
+fixed size entry per frame with the offset of its pixel data; the index can
+be rebuilt by scanning the record headers if it is lost.  Readers memory map
+the data file, so frame N is available without reading anything else.
+"""
+###############################################################################
+#Standard Python
+import os, struct, mmap, time, threading
+from collections import namedtuple
+#3rd party
+import numpy as np
+###############################################################################
+# Module Constants
+FILE_MAGIC    = "YESFRM01"
+FILE_HEADER   = struct.Struct("<8sI")           #magic, version
+FILE_VERSION  = 1
+RECORD_MAGIC  = "FRM0"
+RECORD_HEADER = struct.Struct("<4sQII8sdQ")     #magic, index, rows, cols, dtype, timestamp, nbytes
+INDEX_SUFFIX  = ".idx"
+INDEX_DTYPE   = np.dtype([('offset',    '<u8'),
+                          ('nbytes',    '<u8'),
+                          ('rows',      '<u4'),
+                          ('cols',      '<u4'),
+                          ('dtype',     'S8'),
+                          ('timestamp', '<f8'),
+                         ])
+ALIGNMENT = 8
+
+#what the event log keeps in place of the image array
+FrameRef = namedtuple('FrameRef', ['index', 'offset', 'shape', 'dtype'])
+
+def _as_2d_shape(shape):
+    if len(shape) == 1:
+        return (1, shape[0])
+    if len(shape) != 2:
+        raise ValueError("frames must be 1 or 2 dimensional, got shape %r" % (shape,))
+    return tuple(shape)
+
+###############################################################################
+class FrameStoreWriter(object):
+    """ appends frames to the data file at 'filename' and its index file,
+        'sync' may be called from another thread than 'write'
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        self._file  = open(filename, 'wb')
+        self._index = open(self.index_filename, 'wb')
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+        self._offset = FILE_HEADER.size
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, I, timestamp = None):
+        "append the frame 'I', returns its FrameRef"
+        if timestamp is None:
+            timestamp = time.time()
+        I = np.ascontiguousarray(I)
+        rows, cols = _as_2d_shape(I.shape)
+        dtype  = I.dtype.str
+        nbytes = I.nbytes
+        with self._lock:
+            header = RECORD_HEADER.pack(RECORD_MAGIC, self.count, rows, cols, dtype, timestamp, nbytes)
+            data_offset = self._offset + RECORD_HEADER.size
+            pad = (-data_offset) % ALIGNMENT
+            data_offset += pad
+            self._file.write(header)
+            if pad:
+                self._file.write('\0'*pad)
+            I.tofile(self._file)
+            self._offset = data_offset + nbytes
+            entry = np.array([(data_offset, nbytes, rows, cols, dtype, timestamp)], dtype = INDEX_DTYPE)
+            entry.tofile(self._index)
+            ref = FrameRef(self.count, data_offset, I.shape, dtype)
+            self.count += 1
+        return ref
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._index.flush()
+
+    def sync(self):
+        "flush and fsync the data file, the index can be rebuilt so it is only flushed"
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._index.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                self._index.close()
+
+###############################################################################
+class FrameStoreReader(object):
+    "memory maps the frame store data file at 'filename' for random access"
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        magic, version = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise IOError("'%s' is not a frame store file" % filename)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        index_filename = filename + INDEX_SUFFIX
+        if os.path.exists(index_filename):
+            index = np.fromfile(index_filename, dtype = INDEX_DTYPE)
+            #drop any entry whose frame did not make it to the data file
+            index = index[index['offset'] + index['nbytes'] <= len(self._mmap)]
+        else:
+            index = self.rebuild_index()
+        self.index = index
+
+    def rebuild_index(self):
+        "scan the record headers for the frame offsets"
+        entries = []
+        offset = FILE_HEADER.size
+        size   = len(self._mmap)
+        while offset + RECORD_HEADER.size <= size:
+            magic, n, rows, cols, dtype, timestamp, nbytes = RECORD_HEADER.unpack_from(self._mmap, offset)
+            if magic != RECORD_MAGIC:
+                break
+            data_offset = offset + RECORD_HEADER.size
+            data_offset += (-data_offset) % ALIGNMENT
+            if data_offset + nbytes > size: #truncated frame
+                break
+            entries.append((data_offset, nbytes, rows, cols, dtype, timestamp))
+            offset = data_offset + nbytes
+        return np.array(entries, dtype = INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, n):
+        "returns frame 'n' as a read-only array backed by the memory map"
+        entry = self.index[n]
+        shape = (int(entry['rows']), int(entry['cols']))
+        return np.ndarray(shape, dtype = np.dtype(entry['dtype']), buffer = self._mmap, offset = int(entry['offset']))
+
+    def __iter__(self):
+        for n in xrange(len(self)):
+            yield self[n]
+
+    def get(self, ref):
+        "returns the frame for the FrameRef 'ref' in its original shape"
+        I = self[ref.index]
+        return I.reshape(ref.shape)
+
+    def get_timestamps(self):
+        return self.index['timestamp']
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+###############################################################################
+# Test Code:
+###############################################################################
+if __name__ == '__main__':
+    import sys
+    FS = FrameStoreReader(sys.argv[1])
+    print "%d frames" % len(FS)
+    for n, I in enumerate(FS):
+        print n, I.shape, I.dtype, I.mean()
@@ -0,0 +1,177 @@
+"""
+Controller to acquire a full set of master calibration frames using the
+image_capture controller
+
+--------------------------------------------------------------------------------
+Configuration:
+
+num_bias               - number of bias frames to stack (default 10)
+num_darks              - number of dark frames to stack for each exposure time
+                         in 'dark_exposure_times' (default 10)
+dark_exposure_times    - list of dark exposure times in milliseconds
+                         (default [500])
+num_flats              - number of flatfield frames to stack (default 10)
+flatfield_exposure_time - flatfield exposure time in milliseconds (default 500)
+num_opaque             - number of opaque frames to stack (default 10)
+opaque_exposure_time   - opaque exposure time in milliseconds (default 500)
+combine_method         - 'mean' or 'median'; the median is approximated by
+                         averaging the medians of blocks of frames (default 'mean')
+median_block_size      - number of frames buffered per median block (default 5)
+
+A stack with zero frames is skipped.  The stacks are ordered to make the
+fewest optics moves and each frame is folded into its stack as soon as it is
+read out, so only the running buffers are held in memory.  The master frame and
+per-pixel variance of each stack are sent with the
+CALIBRATION_CAPTURE_MASTER_COMPLETED event and kept in the 'masters' attribute
+keyed by (frametype, exposure_time).
+"""
+###############################################################################
+import sys, time, copy, traceback
+from automat.core.hwcontrol.controllers.controller import Controller, AbortInterrupt, NullController
+OrderedDict = None
+try:
+    from collections import OrderedDict
+except ImportError:
+    from yes_o2ab.support.odict import OrderedDict
+
+from yes_o2ab.core.data_processing.frame_stacking import make_stack
+from yes_o2ab.drivers.controllers.image_capture import plan_frame_sequence, count_optics_moves
+###############################################################################
+DEFAULT_CONFIGURATION = OrderedDict([
+    ('num_bias', 10),
+    ('num_darks', 10),
+    ('dark_exposure_times', [500]),    #milliseconds
+    ('num_flats', 10),
+    ('flatfield_exposure_time', 500),  #milliseconds
+    ('num_opaque', 10),
+    ('opaque_exposure_time', 500),     #milliseconds
+    ('combine_method', 'mean'),
+    ('median_block_size', 5),
+])
+###############################################################################
+def _as_list(value):
+    "config values may come as a single value or a comma separated string"
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+###############################################################################
+class Interface(Controller):
+    def __init__(self,**kwargs):
+        Controller.__init__(self, **kwargs)
+        self.masters = OrderedDict()
+
+    def get_plan(self):
+        """ Returns the list of (frametype, exposure_time, num_frames) stacks
+            in the order they will be acquired.
+        """
+        stacks = []
+        stacks.append(('bias', 0, int(self.configuration['num_bias'])))
+        num_darks = int(self.configuration['num_darks'])
+        for exptime in _as_list(self.configuration['dark_exposure_times']):
+            stacks.append(('dark', int(exptime), num_darks))
+        stacks.append(('flatfield', int(self.configuration['flatfield_exposure_time']),
+                                    int(self.configuration['num_flats'])))
+        stacks.append(('opaque', int(self.configuration['opaque_exposure_time']),
+                                 int(self.configuration['num_opaque'])))
+        stacks = [stack for stack in stacks if stack[2] > 0]
+        #each stack is taken in one go, so only the stack order needs planning
+        image_capture = self.controllers['image_capture']
+        sequence = plan_frame_sequence([frametype for frametype, exptime, num in stacks],
+                                       optics_state = image_capture.get_optics_state())
+        return [stacks[index] for index, frametype in sequence]
+
+    def main(self):
+        try:
+            image_capture  = self.controllers['image_capture']
+            combine_method = self.configuration['combine_method']
+            stack_kwargs = {}
+            if combine_method == 'median':
+                stack_kwargs['block_size'] = int(self.configuration['median_block_size'])
+            plan = self.get_plan()
+            self.masters = OrderedDict()
+            # START ------------------------------------------------------
+            info = OrderedDict()
+            info['timestamp']      = time.time()
+            info['plan']           = plan
+            info['combine_method'] = combine_method
+            info['optics_moves']   = count_optics_moves([frametype for frametype, exptime, num in plan],
+                                                        optics_state = image_capture.get_optics_state())
+            self._send_event("CALIBRATION_CAPTURE_STARTED", info)
+            #chain events
+            image_capture.thread_init(event_queue = self.event_queue)
+            saved_exptime = image_capture.configuration['exposure_time']
+            try:
+                for stack_index, (frametype, exptime, num_frames) in enumerate(plan):
+                    image_capture.configuration['exposure_time'] = exptime
+                    stack = make_stack(combine_method, **stack_kwargs)
+                    info = OrderedDict()
+                    info['timestamp']     = time.time()
+                    info['stack_index']   = stack_index
+                    info['frametype']     = frametype
+                    info['exposure_time'] = exptime
+                    info['num_frames']    = num_frames
+                    self._send_event("CALIBRATION_CAPTURE_STACK_STARTED", info)
+                    for i in range(num_frames):
+                        self._thread_abort_breakout_point()
+                        sequence_info = OrderedDict()
+                        sequence_info['calibration_stack_index'] = stack_index
+                        sequence_info['calibration_frame_index'] = i
+                        I = image_capture.do_exposure(frametype,
+                                                      restore_optics = False,
+                                                      sequence_info  = sequence_info,
+                                                     )
+                        stack.add(I)
+                    master   = stack.get_master()
+                    variance = stack.get_variance()
+                    self.masters[(frametype, exptime)] = (master, variance)
+                    info = OrderedDict()
+                    info['timestamp']     = time.time()
+                    info['stack_index']   = stack_index
+                    info['frametype']     = frametype
+                    info['exposure_time'] = exptime
+                    info['num_frames']    = stack.count
+                    info['combine_method'] = combine_method
+                    info['master_frame']  = master
+                    info['variance']      = variance
+                    self._send_event("CALIBRATION_CAPTURE_MASTER_COMPLETED", info)
+            finally:
+                image_capture.configuration['exposure_time'] = saved_exptime
+                #now undo the opaque_state if it was used
+                image_capture.set_opaque_filter(False)
+            # END NORMALLY -----------------------------------------------
+            info = OrderedDict()
+            info['timestamp'] = time.time()
+            info['masters']   = self.masters.keys()
+            self._send_event("CALIBRATION_CAPTURE_COMPLETED", info)
+        except (AbortInterrupt, Exception), exc:
+            # END ABNORMALLY ---------------------------------------------
+            info = OrderedDict()
+            info['timestamp'] = time.time()
+            info['exception'] = exc
+            if not isinstance(exc, AbortInterrupt):
+                info['traceback'] = traceback.format_exc()
+            self._send_event("CALIBRATION_CAPTURE_ABORTED", info)
+        finally:
+            # FINISH UP --------------------------------------------------
+            self.reset()
+
+#------------------------------------------------------------------------------
+# INTERFACE CONFIGURATOR
+def get_interface(**kwargs):
+    interface_mode = kwargs.pop('interface_mode','threaded')
+    if   interface_mode == 'threaded':
+        return Interface(**kwargs)
+    else:
+        raise ValueError("interface_mode '%s' is not valid" % interface_mode)
+
+###############################################################################
+# TEST CODE - Run the Controller, collect events, and plot
+###############################################################################
+# FIXME
+if __name__ == "__main__":
+    pass
@@ -2,8 +2,7 @@
 Controller to monitor instrument temperatures and environmental conditions
 """
 ###############################################################################
-import time, datetime, traceback
-import pylab
+import sys, time, datetime, traceback, threading
 from automat.core.hwcontrol.controllers.controller import Controller, AbortInterrupt, NullController
 try:
     from collections import OrderedDict
@@ -12,15 +11,19 @@ except ImportError:
 ###############################################################################
 DEFAULT_CONFIGURATION = OrderedDict([
     ('retry_interval',10.0), #seconds
+    ('concurrent_reads', 1), #read the groups of devices on separate buses in parallel
 ])
 
 MAX_RETRY_ATTEMPTS = 10
+FLI_GROUP = 'FLI' #camera and focuser share the FLI USB library
 
 ###############################################################################
 class Interface(Controller):
     def __init__(self,**kwargs):
         Controller.__init__(self, **kwargs)
         self.last_sample = None
+        self.last_sample_timestamps = None
+        self._read_plan = None
         
     def initialize(self, **kwargs):
         self.thread_init(**kwargs)
@@ -31,45 +34,27 @@ class Interface(Controller):
         
     def acquire_sample(self):
         retry_interval = float(self.configuration['retry_interval']) #seconds
+        concurrent = bool(int(self.configuration['concurrent_reads']))
+        if self._read_plan is None:
+            self._read_plan = self._plan_reads()
+        keys, groups = self._read_plan
         retry_attempt = 0
         while retry_attempt < MAX_RETRY_ATTEMPTS: #this loop will cycle if grabbing any mutex fails
             try:
-                sample = OrderedDict()
-                devices = self.devices.copy() #do not accidently edit in place!
-                camera           = devices.pop('camera')
-                focuser          = devices.pop('focuser')
-                sensor_SA_press  = devices.pop('sensor_SA_press')
-                sensor_SA_temp   = devices.pop('sensor_SA_temp')
-                sensor_SA_humid  = devices.pop('sensor_SA_humid')
-                sensor_windspeed = devices.pop('sensor_windspeed')
-                #read the camera with mutex to avoid inter-thread/process collisions
-                with camera._mutex:
-                    sample['CC_temp']  = camera.get_CC_temp()
-                    sample['CH_temp']  = camera.get_CH_temp()
-                    sample['CC_power'] = camera.get_CC_power()
-                with focuser._mutex:
-                    sample['FI_temp']  = focuser.get_temperature()
-                #read DAQ boards with mutex to avoid inter-thread/process collisions
-                with sensor_SA_press.daq._mutex: 
-                    sample['SA_press'] = sensor_SA_press.read()
-                with sensor_SA_temp.daq._mutex: 
-                    sample['SA_temp']  = sensor_SA_temp.read()
-                with sensor_SA_humid.daq._mutex: 
-                    sample['SA_humid'] = sensor_SA_humid.read()
-                with sensor_windspeed.freq_counter._mutex: 
-                    sample['windspeed'] = sensor_windspeed.read()
-                #remaining devices should be thermistors
-                for key,therm in sorted(devices.items()):
-                    if key.startswith('therm'): #check just in case 
-                        with therm.daq._mutex:
-                            sample[therm.name] = therm.read()
+                readings = self._read_groups(groups, concurrent = concurrent)
+                sample     = OrderedDict()
+                timestamps = OrderedDict()
+                for key in keys:
+                    sample[key], timestamps[key] = readings[key]
                 #send sample event with information
                 info = OrderedDict()
                 info['timestamp'] = time.time()
                 info['sample']    = sample 
+                info['sample_timestamps'] = timestamps
                 self._send_event("CONDITION_MONITOR_SAMPLE",info)
                 #everything read successfuly now exit
                 self.last_sample = sample
+                self.last_sample_timestamps = timestamps
                 return sample
             except RuntimeError: #caused when one of the mutex acquisition fails
                 info = OrderedDict()
@@ -82,6 +67,110 @@ class Interface(Controller):
                 retry_attempt += 1 #enters loop again
         #retry attemps maxed out
         return None
+
+    def _plan_reads(self):
+        """ returns (keys, groups): the sample keys in order and an OrderedDict
+            of group name to a list of (mutex, reads), where reads is a list
+            of (sample keys, read function) done while holding the mutex and
+            the function returns one value per key; the groups share no bus
+            or mutex so they can be read at the same time
+        """
+        devices = self.devices.copy() #do not accidently edit in place!
+        camera           = devices.pop('camera')
+        focuser          = devices.pop('focuser')
+        sensor_SA_press  = devices.pop('sensor_SA_press')
+        sensor_SA_temp   = devices.pop('sensor_SA_temp')
+        sensor_SA_humid  = devices.pop('sensor_SA_humid')
+        sensor_windspeed = devices.pop('sensor_windspeed')
+        #name the DAQ groups by the device handles used in the config, boards
+        #that are not top level devices still get a group of their own
+        bus_names = {}
+        for key, device in self.devices.items():
+            bus_names[id(device)] = key
+        def bus_name(board, kind):
+            return bus_names.get(id(board), "%s_%x" % (kind, id(board)))
+        groups = OrderedDict()
+        def add(group, mutex, reads):
+            groups.setdefault(group, []).append((mutex, reads))
+        add(FLI_GROUP, camera._mutex, [(['CC_temp'],  _single(camera.get_CC_temp)),
+                                       (['CH_temp'],  _single(camera.get_CH_temp)),
+                                       (['CC_power'], _single(camera.get_CC_power)),
+                                      ])
+        add(FLI_GROUP, focuser._mutex, [(['FI_temp'], _single(focuser.get_temperature))])
+        #the DAQ sensors in sample order, registered with their boards
+        daq_sensors = [('SA_press', sensor_SA_press),
+                       ('SA_temp',  sensor_SA_temp),
+                       ('SA_humid', sensor_SA_humid),
+                      ]
+        #remaining devices should be thermistors
+        therms = [(therm.name, therm) for key, therm in sorted(devices.items())
+                  if key.startswith('therm')] #check just in case 
+        daq_sensors += therms
+        boards = OrderedDict()
+        for key, sensor in daq_sensors:
+            boards.setdefault(id(sensor.daq), (sensor.daq, []))[1].append((key, sensor))
+        for daq, sensors in boards.values():
+            group = bus_name(daq, 'daq')
+            if hasattr(daq, 'read_all_sensors') and \
+               all([hasattr(sensor, 'read_from_raw_values') for key, sensor in sensors]):
+                #all channels of the board in one read under one mutex acquisition
+                add(group, daq._mutex, [([key for key, sensor in sensors],
+                                         _bulk_daq_read(daq, [sensor for key, sensor in sensors]))])
+            else:
+                for key, sensor in sensors:
+                    add(group, daq._mutex, [([key], _single(sensor.read))])
+        freq_counter = sensor_windspeed.freq_counter
+        add(bus_name(freq_counter, 'freq_counter'), freq_counter._mutex,
+            [(['windspeed'], _single(sensor_windspeed.read))])
+        #keep the sample keys in their usual order
+        keys = ['CC_temp', 'CH_temp', 'CC_power', 'FI_temp',
+                'SA_press', 'SA_temp', 'SA_humid', 'windspeed']
+        keys += [key for key, therm in therms]
+        return (keys, groups)
+
+    def _read_groups(self, groups, concurrent = True):
+        """ returns a dict of sample key to (value, timestamp); each group
+            after the first gets its own thread when 'concurrent', and the
+            first error is raised once all the groups have finished
+        """
+        readings = {}
+        groups = groups.values()
+        if not concurrent or len(groups) < 2:
+            for reads in groups:
+                self._read_group(reads, readings)
+            return readings
+        errors  = [None]*len(groups)
+        threads = []
+        for i in range(1, len(groups)):
+            thread = threading.Thread(target = self._read_group_catching,
+                                      args   = (groups[i], readings, errors, i),
+                                     )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        self._read_group_catching(groups[0], readings, errors, 0)
+        for thread in threads:
+            thread.join()
+        for exc_info in errors:
+            if not exc_info is None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+        return readings
+
+    def _read_group(self, reads, readings):
+        for mutex, block in reads:
+            #read with mutex to avoid inter-thread/process collisions
+            with mutex:
+                for keys, read in block:
+                    values = read()
+                    t = time.time()
+                    for key, value in zip(keys, values):
+                        readings[key] = (value, t)
+
+    def _read_group_catching(self, reads, readings, errors, index):
+        try:
+            self._read_group(reads, readings)
+        except Exception:
+            errors[index] = sys.exc_info()
         
     def main(self):
         try:
@@ -119,6 +208,21 @@ class Interface(Controller):
         finally: #Always clean up!
             self.reset()
 
+#------------------------------------------------------------------------------
+# Helper Functions
+def _single(read):
+    "wraps a single value 'read' to return a list like a bulk read"
+    return lambda: [read()]
+
+def _bulk_daq_read(daq, sensors):
+    """ returns a read function that gets the raw values of all the channels
+        of 'daq' at once and converts them for each of 'sensors'
+    """
+    def read():
+        values = daq.read_all_sensors()
+        return [sensor.read_from_raw_values(values) for sensor in sensors]
+    return read
+
 #------------------------------------------------------------------------------
 # INTERFACE CONFIGURATOR   
 def get_interface(**kwargs):
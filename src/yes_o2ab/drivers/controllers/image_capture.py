@@ -15,41 +15,139 @@ num_captures      - number of frames to acquire in sequence mode (default 1,
                     None means to continue indefinitely)
 rbi_num_flushes   - number of Residual Bulk Image (flood then flush) frames (default 0)
 rbi_exposure_time - length of the RBI exposure in milliseconds (default 500)
+image_area        - readout area (ul_x,ul_y,lr_x,lr_y) in unbinned CCD pixels
+                    (default None, the area the camera was configured with)
+hbin, vbin        - horizontal and vertical binning factors (default 1)
+rbi_hbin, rbi_vbin - binning factors for the RBI flush frames, which are read
+                    out over the camera's configured area (default 1)
 repeat_delay      - the delay between captures in sequence mode
+poll_interval     - shortest sleep in seconds while waiting on an exposure to 
+                    complete; the wait sleeps through the time left reported by
+                    the camera then polls at this rate near the end (default 0.01)
+exposure_timeout  - seconds past the expected exposure time to wait for the 
+                    camera before giving up (default 10.0)
+frame_sequence    - list of frametypes to acquire on each capture instead of 
+                    'frametype'; the list is reordered to minimize optics moves
+                    (default None)
+pipelined         - if 1, sequence captures arm the next exposure as soon as
+                    the previous image is fetched and hand the images off to a 
+                    dispatcher thread; cannot be combined with a 
+                    'frame_sequence' (default 0)
+pipeline_depth    - number of fetched images that may wait on the dispatcher
+                    before the capture loop blocks (default 2)
+pipeline_max_backlog - number of undelivered events in the event queue above 
+                    which the dispatcher holds back new images (default 16)
+frame_buffer_slots - if > 0, captured images are stored in a ring buffer of 
+                    this many preallocated frames and the exposure events carry
+                    a 'frame_handle' instead of the 'image_array' (default 0)
 """
 ###############################################################################
-import sys, time, copy, traceback
+import sys, time, copy, traceback, itertools, Queue, threading
 from automat.core.hwcontrol.controllers.controller import Controller, AbortInterrupt, NullController
 OrderedDict = None
 try:
     from collections import OrderedDict
 except ImportError:
     from yes_o2ab.support.odict import OrderedDict
+
+from yes_o2ab.core.buffers.frame_ring_buffer import FrameRingBuffer
 ###############################################################################
 DEFAULT_CONFIGURATION = OrderedDict([
     ('frametype','normal'),
+    ('frame_sequence',None),
     ('num_captures',1),
     ('delay', 0.0),
     #('bitdepth','16bit'),    
-    #('hbin',1),
-    #('vbin',1),
-    #('rbi_hbin',1),
-    #('rbi_vbin',1),
+    ('image_area',None),
+    ('hbin',1),
+    ('vbin',1),
+    ('rbi_hbin',1),
+    ('rbi_vbin',1),
     ('exposure_time',500),
     #('num_flushes',1),
     ('rbi_num_flushes',0),
     ('rbi_exposure_time',500),
     ('CCD_temp_setpoint',None),
+    ('poll_interval', 0.010),   #seconds
+    ('exposure_timeout', 10.0), #seconds
+    ('pipelined', 0),
+    ('pipeline_depth', 2),
+    ('pipeline_max_backlog', 16),
+    ('frame_buffer_slots', 0),
+])
+
+#maps frametype -> (flatfield_state, opaque_state, camera_frametype)
+FRAMETYPE_OPTICS = OrderedDict([
+    ('normal',    ('out', False, 'normal')),
+    ('dark',      ('out', False, 'dark')),
+    ('bias',      ('out', False, 'dark')),   #bias is a zero time readout
+    ('flatfield', ('in',  False, 'normal')), #require the flipper to be moved up
+    ('opaque',    ('out', True,  'normal')),
 ])
 
-SLEEP_TIME = 1.0 #seconds
+SLEEP_TIME     = 1.0 #seconds
+MAX_POLL_SLEEP = 1.0 #seconds, keeps abort checks responsive on long exposures
+PIPELINE_POLL_TIME = 0.050 #seconds
+PIPELINE_JOIN_TIMEOUT = 10.0 #seconds to wait on the dispatcher at the end of a loop
+###############################################################################
+def count_optics_moves(frametypes, optics_state = (None, False)):
+    """ Count the flatfield and filter moves needed to acquire 'frametypes' in
+        order starting from 'optics_state', a (flatfield_state, opaque_state) 
+        pair, including restoring the opaque filter at the end.
+    """
+    flatfield_state, opaque_state = optics_state
+    moves = 0
+    for frametype in frametypes:
+        ff, op, _ = FRAMETYPE_OPTICS[frametype]
+        if ff != flatfield_state:
+            moves += 1
+        if op != opaque_state:
+            moves += 1
+        flatfield_state, opaque_state = ff, op
+    if opaque_state:
+        moves += 1
+    return moves
+
+def plan_frame_sequence(frametypes, optics_state = (None, False)):
+    """ Reorder 'frametypes' so that frames sharing an optics configuration are
+        taken together and the groups are visited in the order needing the 
+        fewest flatfield and filter moves from 'optics_state'.  Frames keep 
+        their requested order within a group.  Returns a list of 
+        (requested_index, frametype) pairs in the order to be executed.
+    """
+    groups = OrderedDict()
+    for index, frametype in enumerate(frametypes):
+        if not frametype in FRAMETYPE_OPTICS:
+            raise ValueError("frametype '%s' is not valid" % frametype)
+        key = FRAMETYPE_OPTICS[frametype][:2]
+        groups.setdefault(key, []).append((index, frametype))
+    best_sequence = None
+    best_moves    = None
+    #at most a handful of optics configurations, so try every group order
+    for keys in itertools.permutations(groups.keys()):
+        sequence = []
+        for key in keys:
+            sequence.extend(groups[key])
+        moves = count_optics_moves([frametype for index, frametype in sequence], 
+                                   optics_state = optics_state)
+        if best_moves is None or moves < best_moves:
+            best_sequence = sequence
+            best_moves    = moves
+    if best_sequence is None:
+        best_sequence = []
+    return best_sequence
+
 ###############################################################################
 class Interface(Controller):
     def __init__(self,**kwargs):
         Controller.__init__(self, **kwargs)
-        self.last_image = None
+        self.last_image = None #the latest frame, never a view into the frame buffer
+        self.last_image_info = None #the exposure info of 'last_image', e.g. its readout geometry
         self.saved_filter_position = None
         self.opaque_state = False
+        self.default_image_area = None
+        self._readout_initialized = False
+        self.frame_buffer = None
 
     def initialize(self, **kwargs):
         try:
@@ -95,6 +193,12 @@ class Interface(Controller):
             if not num_captures is None:
                 num_captures = int(num_captures)
             delay = float(self.configuration['delay'])
+            frame_sequence = self.configuration['frame_sequence']
+            if isinstance(frame_sequence, basestring):
+                frame_sequence = [ft.strip() for ft in frame_sequence.split(',')]
+            pipelined = bool(int(self.configuration['pipelined']))
+            if pipelined and frame_sequence:
+                raise ValueError("'pipelined' capture does not support a 'frame_sequence'")
             temp = self.configuration['CCD_temp_setpoint']
             if not temp is None:
                 self.set_CCD_temperature_setpoint(float(temp))
@@ -105,6 +209,13 @@ class Interface(Controller):
             info['CCD_temp_setpoint'] = temp
             info['timestamp'] = time.time()
             self._send_event("IMAGE_CAPTURE_LOOP_STARTED",info)
+            if pipelined:
+                self._pipelined_loop(frametype, num_captures, delay)
+                # END NORMALLY -------------------------------------------
+                info = OrderedDict()
+                info['timestamp'] = time.time()
+                self._send_event("IMAGE_CAPTURE_LOOP_STOPPED",info)
+                return
             i = 0
             while True:
                 self._thread_abort_breakout_point()
@@ -130,7 +241,10 @@ class Interface(Controller):
                     info['time_left'] = time_left
                     self._send_event("IMAGE_CAPTURE_LOOP_SLEEPING",info)
                 # CAPTURE ------------------------------------------------
-                self.do_exposure(frametype)
+                if frame_sequence:
+                    self.run_frame_sequence(frame_sequence)
+                else:
+                    self.do_exposure(frametype)
                 i += 1
                 # REPEAT
         except (AbortInterrupt, Exception), exc:
@@ -145,6 +259,232 @@ class Interface(Controller):
             # FINISH UP --------------------------------------------------
             self.reset()
             
+    def _pipelined_loop(self, frametype, num_captures, delay):
+        """ Sequence capture where the next exposure is armed right after the
+            previous image is fetched; the images are handed to a dispatcher 
+            thread through a bounded queue, so the capture loop only blocks
+            when the downstream consumers fall behind.
+        """
+        camera = self.devices['camera']
+        depth  = int(self.configuration['pipeline_depth'])
+        frame_queue  = Queue.Queue(maxsize = depth)
+        release_flag = threading.Event() #set when images should no longer be held back
+        dispatch_errors = [] #the exc_info of a failed dispatcher
+        dispatcher   = threading.Thread(target = self._dispatch_frames,
+                                        args   = (frame_queue, release_flag, dispatch_errors),
+                                       )
+        dispatcher.daemon = True
+        dispatcher.start()
+        try:
+            #optics stay put for the whole sequence
+            self.configure_optics(frametype)
+            i = 0
+            with camera._mutex: #locks the resource
+                exptime, rbi_dead_time, t_armed = self._arm_exposure(frametype)
+            while True:
+                self._thread_abort_breakout_point()
+                with camera._mutex: #locks the resource
+                    self.wait_on_exposure(exptime)
+                    I = camera.fetch_image()
+                    #includes any time the loop was stalled after arming
+                    dead_time = self._dead_time(exptime, t_armed)
+                    i += 1
+                    more = not (self._thread_check_stop_event() or (not num_captures is None and i >= num_captures))
+                    if more and delay <= 0:
+                        #the next exposure runs while this image is dispatched
+                        next_exptime, next_rbi_dead_time, next_t_armed = self._arm_exposure(frametype)
+                info = self._exposure_info(frametype, exptime)
+                info['dead_time']      = dead_time
+                info['rbi_dead_time']  = rbi_dead_time
+                info['sequence_index'] = i - 1
+                I = self._store_frame(I, info)
+                #blocks when the dispatcher is behind, this is the back-pressure
+                while True:
+                    self._thread_abort_breakout_point()
+                    if not dispatcher.is_alive():
+                        #nothing will drain the queue, end the loop as aborted
+                        if dispatch_errors:
+                            exc_type, exc_value, exc_tb = dispatch_errors[0]
+                            raise exc_type, exc_value, exc_tb
+                        raise RuntimeError("the image dispatcher thread stopped")
+                    try:
+                        frame_queue.put((I,info), timeout = PIPELINE_POLL_TIME)
+                        break
+                    except Queue.Full:
+                        pass
+                if not more:
+                    return
+                if delay > 0:
+                    self.sleep(delay)
+                    with camera._mutex: #locks the resource
+                        next_exptime, next_rbi_dead_time, next_t_armed = self._arm_exposure(frametype)
+                exptime, rbi_dead_time, t_armed = next_exptime, next_rbi_dead_time, next_t_armed
+        finally:
+            #the capture is over, the dispatcher should send what is left
+            #without holding back and then finish up
+            release_flag.set()
+            t0 = time.time()
+            while dispatcher.is_alive() and time.time() - t0 < PIPELINE_JOIN_TIMEOUT:
+                try:
+                    frame_queue.put(None, timeout = PIPELINE_POLL_TIME)
+                    break
+                except Queue.Full:
+                    pass
+            #a stalled consumer must not hang the controller, the thread is a daemon
+            dispatcher.join(max(PIPELINE_JOIN_TIMEOUT - (time.time() - t0), 0.0))
+            #now undo the opaque_state if it was used
+            self.set_opaque_filter(False)
+
+    def _dispatch_frames(self, frame_queue, release_flag, errors):
+        """ runs in its own thread, sends the image events queued by the 
+            capture loop; on failure the exc_info is appended to 'errors' and
+            the thread ends, which the capture loop checks for
+        """
+        max_backlog = int(self.configuration['pipeline_max_backlog'])
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is None:
+                    return
+                I, info = item
+                #hold back while the event consumers are behind
+                while not release_flag.is_set():
+                    try:
+                        backlog = self.event_queue.qsize()
+                    except (AttributeError, NotImplementedError):
+                        break
+                    if backlog <= max_backlog:
+                        break
+                    time.sleep(PIPELINE_POLL_TIME)
+                info['pipeline_queue_depth'] = frame_queue.qsize()
+                self.last_image = I
+                self.last_image_info = info
+                self._send_event("IMAGE_CAPTURE_EXPOSURE_COMPLETED", info)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    def _arm_exposure(self, frametype, sequence_info = None):
+        """ Sends the exposure started event, does the RBI flushes and starts
+            the exposure for 'frametype' without waiting on it; optics must 
+            already be configured.  Returns the exposure time in milliseconds,
+            the RBI flush dead time in seconds and the time the exposure was
+            armed.  Must be called with the camera mutex held.
+        """
+        camera  = self.devices['camera']
+        exptime = int(self.configuration['exposure_time'])
+        if frametype == 'bias':
+            exptime = 0 #bias is a zero time exposure
+        info = self._exposure_info(frametype, exptime)
+        if not sequence_info is None:
+            info.update(sequence_info)
+        self._send_event("IMAGE_CAPTURE_EXPOSURE_STARTED", info)
+        rbi_dead_time = self._do_rbi_flushes()
+        #now start the image exposure
+        self.configure_readout()
+        t_armed = time.time()
+        camera.start_exposure(exptime, frametype = self.configuration['camera_frametype'])
+        return (exptime, rbi_dead_time, t_armed)
+
+    def _do_rbi_flushes(self):
+        """ Does the configured number of RBI flushes, returns their dead time
+            in seconds.  Must be called with the camera mutex held.
+        """
+        camera       = self.devices['camera']
+        rbi_exptime  = int(self.configuration['rbi_exposure_time'])
+        rbi_nflushes = int(self.configuration['rbi_num_flushes'])
+        rbi_dead_time = 0.0
+        if rbi_nflushes > 0:
+            self.configure_readout(rbi = True)
+        for i in range(rbi_nflushes):
+            info = OrderedDict()
+            info['timestamp'] = time.time()
+            info['index']     = i
+            info['exposure_time'] = rbi_exptime
+            self._send_event("IMAGE_CAPTURE_EXPOSURE_RBI_FLUSH", info)
+            #floods the CCD
+            t_armed = time.time()
+            camera.start_exposure(rbi_exptime, frametype = 'rbi_flush')
+            self.wait_on_exposure(rbi_exptime)
+            camera.fetch_image()
+            rbi_dead_time += self._dead_time(rbi_exptime, t_armed)
+            #finish flush in dark (no shutter) mode
+            t_armed = time.time()
+            camera.start_exposure(0, frametype = 'dark')
+            self.wait_on_exposure(0)
+            camera.fetch_image()
+            rbi_dead_time += self._dead_time(0, t_armed)
+        return rbi_dead_time
+
+    def _store_frame(self, I, info):
+        """ Attaches the image to the event 'info', either directly as the 
+            'image_array' or, when 'frame_buffer_slots' is set, as the 
+            'frame_handle' of a copy in the frame ring buffer.  Returns the 
+            image to be used as 'last_image', which is always a copy that the
+            ring buffer does not overwrite.
+        """
+        num_slots = int(self.configuration['frame_buffer_slots'])
+        if num_slots <= 0:
+            info['image_array'] = I
+            return I
+        ring = self.frame_buffer
+        if ring is None or ring.num_slots != num_slots or not ring.fits(I):
+            #handles to the old buffer keep it alive until they are dropped
+            ring = FrameRingBuffer(num_slots, I.shape, dtype = I.dtype)
+            self.frame_buffer = ring
+        handle = ring.write(I, timestamp = info.get('timestamp'))
+        info['frame_handle'] = handle
+        return I #the camera's array, the slot holds a separate copy
+
+    def _exposure_info(self, frametype, exptime):
+        info = OrderedDict()
+        info['timestamp'] = time.time()
+        info['frametype'] = frametype
+        info['camera_frametype']  = self.configuration['camera_frametype']
+        info['image_area']        = self.get_image_area()
+        info['hbin']              = int(self.configuration['hbin'])
+        info['vbin']              = int(self.configuration['vbin'])
+        info['exposure_time']     = exptime
+        info['rbi_hbin']          = int(self.configuration['rbi_hbin'])
+        info['rbi_vbin']          = int(self.configuration['rbi_vbin'])
+        info['rbi_exposure_time'] = int(self.configuration['rbi_exposure_time'])
+        info['rbi_num_flushes']   = int(self.configuration['rbi_num_flushes'])
+        return info
+        
+    def get_image_area(self):
+        """ returns the readout area (ul_x,ul_y,lr_x,lr_y) for the exposures,
+            None if neither the configuration nor the camera specify one
+        """
+        if not self._readout_initialized:
+            #remember the area the camera was set up with
+            camera = self.devices['camera']
+            self.default_image_area = camera.get_readout_geometry()[0]
+            self._readout_initialized = True
+        image_area = self.configuration['image_area']
+        if image_area is None:
+            return self.default_image_area
+        if isinstance(image_area, basestring):
+            image_area = image_area.split(',')
+        return tuple(map(int,image_area))
+        
+    def configure_readout(self, rbi = False):
+        """ Sets the camera image area and binning for the next exposure, if
+            'rbi' is True the RBI flush binning over the camera's configured 
+            area is used.  The camera only reprograms itself on a change. 
+            Must be called with the camera mutex held.
+        """
+        camera = self.devices['camera']
+        image_area = self.get_image_area()
+        if rbi:
+            camera.configure_readout(image_area = self.default_image_area,
+                                     hbin = int(self.configuration['rbi_hbin']),
+                                     vbin = int(self.configuration['rbi_vbin']),
+                                    )
+        else:
+            camera.configure_readout(image_area = image_area,
+                                     hbin = int(self.configuration['hbin']),
+                                     vbin = int(self.configuration['vbin']),
+                                    )
+
     def set_CCD_temperature_setpoint(self, temp):
         camera    = self.devices['camera']
         with camera._mutex: #locks the resource
@@ -156,31 +496,59 @@ class Interface(Controller):
             
     def configure_optics(self, frametype):
         #first configure the frametype
-        if   frametype == 'normal':
-            self.set_flatfield('out')
-            self.set_opaque_filter(False)
-            self.configuration['camera_frametype'] = 'normal'
-        elif frametype == 'dark':
-            self.set_flatfield('out')
-            self.set_opaque_filter(False)
-            self.configuration['camera_frametype'] = 'dark'
-        elif frametype == 'bias':
-            #bias is a zero time readout
-            self.set_flatfield('out')
-            self.set_opaque_filter(False)
-            self.configuration['camera_frametype'] = 'dark'
-        elif frametype == 'flatfield':
-            #require the flipper to be moved up
-            self.set_flatfield('in')
-            self.set_opaque_filter(False)
-            self.configuration['camera_frametype'] = 'normal'
-        elif frametype == 'opaque':
-            self.set_flatfield('out')
-            self.set_opaque_filter(True)
-            self.configuration['camera_frametype'] = 'normal'
-        else:
+        try:
+            flatfield_state, opaque_state, camera_frametype = FRAMETYPE_OPTICS[frametype]
+        except KeyError:
             raise ValueError("frametype '%s' is not valid" % frametype)
+        self.set_flatfield(flatfield_state)
+        self.set_opaque_filter(opaque_state)
+        self.configuration['camera_frametype'] = camera_frametype
         
+    def get_optics_state(self):
+        "returns the (flatfield_state, opaque_state) pair as last set"
+        flatfield_switcher = self.controllers['flatfield_switcher']
+        return (flatfield_switcher.state, self.opaque_state)
+        
+    def run_frame_sequence(self, frametypes, plan = True):
+        """ Acquire one frame of each type listed in 'frametypes'; if 'plan' 
+            is True the frames are reordered with 'plan_frame_sequence' so that
+            the fewest flatfield and filter moves are made.  The requested 
+            and executed orders are recorded in the sequence events and each
+            exposure event carries its 'sequence_index' and 'requested_index'.
+            Returns the list of images in executed order.
+        """
+        frametypes = list(frametypes)
+        if plan:
+            sequence = plan_frame_sequence(frametypes, optics_state = self.get_optics_state())
+        else:
+            sequence = list(enumerate(frametypes))
+        info = OrderedDict()
+        info['timestamp']       = time.time()
+        info['requested_order'] = frametypes
+        info['executed_order']  = [frametype for index, frametype in sequence]
+        info['optics_moves']    = count_optics_moves([frametype for index, frametype in sequence],
+                                                     optics_state = self.get_optics_state())
+        self._send_event("IMAGE_CAPTURE_SEQUENCE_STARTED", info)
+        images = []
+        try:
+            for seq_index, (req_index, frametype) in enumerate(sequence):
+                self._thread_abort_breakout_point()
+                sequence_info = OrderedDict()
+                sequence_info['sequence_index']  = seq_index
+                sequence_info['requested_index'] = req_index
+                I = self.do_exposure(frametype, 
+                                     restore_optics = False, 
+                                     sequence_info  = sequence_info,
+                                    )
+                images.append(I)
+        finally:
+            #now undo the opaque_state if it was used
+            self.set_opaque_filter(False)
+        info = OrderedDict()
+        info['timestamp']       = time.time()
+        info['executed_order']  = [frametype for index, frametype in sequence]
+        self._send_event("IMAGE_CAPTURE_SEQUENCE_COMPLETED", info)
+        return images
         
     def set_flatfield(self, state):
         flatfield_switcher = self.controllers['flatfield_switcher']
@@ -204,78 +572,62 @@ class Interface(Controller):
                 filter_switcher.set_filter_by_position(old_pos)
             self.opaque_state = False
         
-    def do_exposure(self, frametype = 'normal'):
+    def do_exposure(self, frametype = 'normal', restore_optics = True, sequence_info = None):
         camera    = self.devices['camera']
-        #hbin    = int(self.configuration['hbin'])
-        #vbin    = int(self.configuration['vbin'])
-        exptime = int(self.configuration['exposure_time'])
-        if frametype == 'bias':
-            exptime = 0 #bias is a zero time exposure
-        #rbi_hbin = int(self.configuration['rbi_hbin'])
-        #rbi_vbin = int(self.configuration['rbi_vbin'])
-        rbi_exptime = int(self.configuration['rbi_exposure_time'])
-        rbi_nflushes = int(self.configuration['rbi_num_flushes'])
         #configure the optics for the frametype
         self.configure_optics(frametype) #sets camera_frametype
-        
-        camera_frametype = self.configuration['camera_frametype']
-        info = OrderedDict()
-        info['timestamp'] = time.time()
-        info['frametype'] = frametype
-        info['camera_frametype'] = camera_frametype
-        #info['hbin'] = hbin
-        #info['vbin'] = vbin
-        info['exposure_time'] = exptime
-        #info['rbi_hbin'] = rbi_hbin
-        #info['rbi_vbin'] = rbi_vbin
-        info['rbi_exposure_time'] = rbi_exptime
-        info['rbi_num_flushes']   = rbi_nflushes
-        self._send_event("IMAGE_CAPTURE_EXPOSURE_STARTED", info)
         with camera._mutex: #locks the resource
-            #do RBI flushes
-            for i in range(rbi_nflushes):
-                info = OrderedDict()
-                info['timestamp'] = time.time()
-                info['index']     = i
-                info['exposure_time'] = rbi_exptime
-                self._send_event("IMAGE_CAPTURE_EXPOSURE_RBI_FLUSH", info)
-                #floods the CCD
-                camera.start_exposure(rbi_exptime, frametype = 'rbi_flush')
-                while camera.get_exposure_timeleft() > 0:
-                    self._thread_abort_breakout_point()
-                    self.sleep(SLEEP_TIME)
-                camera.fetch_image()
-                #finish flush in dark (no shutter) mode
-                camera.start_exposure(0, frametype = 'dark')
-                while camera.get_exposure_timeleft() > 0:
-                    self._thread_abort_breakout_point()
-                    self.sleep(SLEEP_TIME)
-                camera.fetch_image()
+            #do RBI flushes and start the exposure
+            exptime, rbi_dead_time, t_armed = self._arm_exposure(frametype, sequence_info = sequence_info)
             #now acquire the image
-            camera.start_exposure(exptime, frametype = camera_frametype)
-            while camera.get_exposure_timeleft() > 0:
-                self._thread_abort_breakout_point()
-                self.sleep(SLEEP_TIME)
+            self.wait_on_exposure(exptime)
             I = camera.fetch_image()
-            self.last_image = I
+            dead_time = self._dead_time(exptime, t_armed)
             #completed
-            info = OrderedDict()
-            info['timestamp'] = time.time()
-            info['frametype'] = frametype
-            info['camera_frametype'] = camera_frametype
-            #info['hbin'] = hbin
-            #info['vbin'] = vbin
-            info['exposure_time'] = exptime
-            #info['rbi_hbin'] = rbi_hbin
-            #info['rbi_vbin'] = rbi_vbin
-            info['rbi_exposure_time'] = rbi_exptime
-            info['rbi_num_flushes']   = rbi_nflushes
-            info['image_array'] = I
+            info = self._exposure_info(frametype, exptime)
+            info['dead_time']         = dead_time
+            info['rbi_dead_time']     = rbi_dead_time
+            if not sequence_info is None:
+                info.update(sequence_info)
+            self.last_image = self._store_frame(I, info)
+            self.last_image_info = info
             self._send_event("IMAGE_CAPTURE_EXPOSURE_COMPLETED", info)
-            #now undo the opaque_state if it was used
-            self.set_opaque_filter(False)
+            #now undo the opaque_state if it was used, sequences leave it 
+            #in place so the next frame of the same type does not move it
+            if restore_optics:
+                self.set_opaque_filter(False)
             return self.last_image
 
+    def wait_on_exposure(self, exptime):
+        """ Block until the camera reports the exposure started with 'exptime'
+            (milliseconds) as complete.  Sleeps through the time left reported
+            by the camera, then polls at 'poll_interval' near the end.  The
+            dead time is measured from arming by '_dead_time'.  Must be called
+            with the camera mutex held.
+        """
+        camera        = self.devices['camera']
+        poll_interval = float(self.configuration['poll_interval'])
+        timeout       = float(self.configuration['exposure_timeout'])
+        t0 = time.time()
+        expected = exptime/1000.0 #seconds
+        while True:
+            time_left = camera.get_exposure_timeleft()/1000.0 #seconds
+            if time_left <= 0:
+                break
+            self._thread_abort_breakout_point()
+            if time.time() - t0 > expected + timeout:
+                raise IOError("camera exposure did not complete within %0.1f seconds past the expected time" % timeout)
+            #sleep through most of the time left, then poll quickly
+            sleep_time = max(time_left - poll_interval, poll_interval)
+            self.sleep(min(sleep_time, MAX_POLL_SLEEP))
+
+    def _dead_time(self, exptime, t_armed):
+        """ returns the dead time in seconds of the exposure of 'exptime' 
+            (milliseconds) armed at 't_armed', i.e. how long it took from 
+            arming until now, with the image fetched, beyond the exposure time
+        """
+        return max(time.time() - t_armed - exptime/1000.0, 0.0)
+
     def query_metadata(self):
         camera = self.devices['camera']
         with camera._mutex: #locks the resource            
@@ -5,8 +5,6 @@
 from automat.core.hwcontrol.devices.instruments import Model
 #other in-house packages
 from FLI import USBCamera
-#3rd party hardware vendor, install from Internet
-import scipy
 #package local
 from device import FLIDevice
 ###############################################################################
@@ -17,17 +15,67 @@ class Interface(FLIDevice):
     _driver_class = USBCamera
     def __init__(self, serial_number):
         FLIDevice.__init__(self, serial_number=serial_number)
+        self.image_area = None #None means the full visible area
+        self.hbin = 1
+        self.vbin = 1
+        self._applied_geometry = None
+        self._visible_area = None
 
-#    FIXME does this FLI command even do anything?
     def set_image_area(self, ul_x, ul_y, lr_x, lr_y):
-        """ Set the image area:
+        """ Set the image area in unbinned CCD pixels:
                 ul_x - upper-left horizontal coordinate
                 ul_y - upper-left vertical coordinate
                 lr_x - lower-right horizontal coordinate
                 lr_y - lower-right vertical coordinate
         """
+        self.configure_readout(image_area = (ul_x,ul_y,lr_x,lr_y), 
+                               hbin = self.hbin, 
+                               vbin = self.vbin,
+                              )
+        
+    def set_image_binning(self, hbin = 1, vbin = 1):
+        """ Set the horizontal and vertical binning factors, the image area is
+            kept and the image shrinks accordingly
+        """
+        self.configure_readout(image_area = self.image_area, 
+                               hbin = hbin, 
+                               vbin = vbin,
+                              )
+        
+    def configure_readout(self, image_area = None, hbin = 1, vbin = 1):
+        """ Set the image area (ul_x,ul_y,lr_x,lr_y) in unbinned CCD pixels 
+            and the binning factors, an 'image_area' of None is the full 
+            visible area; the camera is only reprogrammed when the geometry
+            differs from what was last applied, so this is cheap to call 
+            before every exposure.
+        """
         self.initialize()
+        if not image_area is None:
+            image_area = tuple(map(int,image_area))
+        geometry = (image_area, int(hbin), int(vbin))
+        if geometry == self._applied_geometry:
+            return
+        #the binning must be set first, the driver sizes the area by the bins
+        self._driver.set_image_binning(int(hbin), int(vbin))
+        #always program the area, or a previous subframe would stay in effect
+        if image_area is None:
+            ul_x,ul_y,lr_x,lr_y = self.get_visible_area()
+        else:
+            ul_x,ul_y,lr_x,lr_y = image_area
         self._driver.set_image_area(ul_x,ul_y,lr_x,lr_y)
+        self.image_area, self.hbin, self.vbin = geometry
+        self._applied_geometry = geometry
+        
+    def get_readout_geometry(self):
+        "returns the (image_area, hbin, vbin) last applied"
+        return (self.image_area, self.hbin, self.vbin)
+
+    def get_visible_area(self):
+        "returns the full visible area (ul_x,ul_y,lr_x,lr_y) reported by the driver"
+        if self._visible_area is None:
+            self.initialize()
+            self._visible_area = tuple(map(int,self._driver.get_info()['visible_area']))
+        return self._visible_area
     #--------------------------------------------------------------------------
     # Implementation of the Camera Interface
     #--------------------------------------------------------------------------
@@ -88,9 +136,11 @@ class Interface(FLIDevice):
     def show_image(self):
         """ displays the last taken image with pylab.imshow
         """
+        import scipy.misc
         scipy.misc.imshow(self.last_image)
     
     def save_image(self, filename):
+        import scipy.misc
         scipy.misc.imsave(filename, self.last_image)
     #--------------------------------------------------------------------------
     # Query Functions
@@ -115,6 +165,11 @@ class Interface(FLIDevice):
     def set_CCD_temperature_setpoint(self, temp):
         "gets the Camera cooler's Cold-side (also CCD) temperature in degrees Celcius"
         self._driver.set_temperature(temp)
+        
+    def shutdown(self):
+        #the geometry must be reapplied after the device is reopened
+        self._applied_geometry = None
+        FLIDevice.shutdown(self)
     
     #--------------------------------------------------------------------------
 
@@ -123,9 +178,10 @@ class Interface(FLIDevice):
 def get_interface(serial_number, **kwargs):
     obj = Interface(serial_number=serial_number)
     image_area = kwargs.pop('image_area', None)
-    if not image_area is None:
-        ul_x,ul_y,lr_x,lr_y = map(int,image_area)
-        obj.set_image_area(ul_x,ul_y,lr_x,lr_y)
+    hbin = int(kwargs.pop('hbin', 1))
+    vbin = int(kwargs.pop('vbin', 1))
+    if not image_area is None or hbin != 1 or vbin != 1:
+        obj.configure_readout(image_area = image_area, hbin = hbin, vbin = vbin)
     return obj
     
 ###############################################################################
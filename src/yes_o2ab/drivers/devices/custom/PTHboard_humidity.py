@@ -3,7 +3,6 @@
 #standard python
 import os
 #3rd part provided
-from scipy import interpolate
 from numpy import loadtxt, linspace
 #Automat framework provided
 from automat.core.hwcontrol.devices.device import Device
@@ -42,7 +41,15 @@ class Interface(Device):
 
     def read(self):
         "reads the humidity in %RH"
-        V = self.read_raw_voltage()
+        return self._voltage_to_humid(self.read_raw_voltage())
+
+    def read_from_raw_values(self, values):
+        """ reads the humidity in %RH from 'values', the raw values of all
+            the DAQ channels as returned by 'daq.read_all_sensors'
+        """
+        return self._voltage_to_humid(self.raw_voltage_from_values(values))
+
+    def _voltage_to_humid(self, V):
         RH = (V/5.0 - self.A)/self.B
         return RH
         
@@ -52,6 +59,10 @@ class Interface(Device):
         V = SENSOR_TO_VOLTAGE*val
         return V
         
+    def raw_voltage_from_values(self, values):
+        "the uncorrected voltage from the raw values of all the DAQ channels"
+        return SENSOR_TO_VOLTAGE*values[self.daq_channel]
+
     def shutdown(self):
         pass 
 #-------------------------------------------------------------------------------
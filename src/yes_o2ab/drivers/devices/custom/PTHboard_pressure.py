@@ -3,7 +3,6 @@
 #standard python
 import os
 #3rd part provided
-from scipy import interpolate
 from numpy import loadtxt, linspace
 #Automat framework provided
 from automat.core.hwcontrol.devices.device import Device
@@ -36,6 +35,20 @@ class Interface(Device):
         "reads the pressure in inches Hg"
         Vp = self.read_raw_voltage()
         Vt = self.temp_sensor.read_raw_voltage()
+        return self._voltages_to_press(Vp, Vt)
+
+    def read_from_raw_values(self, values):
+        """ reads the pressure in inches Hg from 'values', the raw values of
+            all the DAQ channels as returned by 'daq.read_all_sensors'
+        """
+        Vp = self.raw_voltage_from_values(values)
+        if self.temp_sensor.daq is self.daq:
+            Vt = self.temp_sensor.raw_voltage_from_values(values)
+        else: #the compensating sensor is on another board
+            Vt = self.temp_sensor.read_raw_voltage()
+        return self._voltages_to_press(Vp, Vt)
+
+    def _voltages_to_press(self, Vp, Vt):
         P = self.A + self.B*(Vp + 0.4*(Vt - self.C))
         return P
         
@@ -45,6 +58,10 @@ class Interface(Device):
         V = SENSOR_TO_VOLTAGE*val
         return V
         
+    def raw_voltage_from_values(self, values):
+        "the uncorrected voltage from the raw values of all the DAQ channels"
+        return SENSOR_TO_VOLTAGE*values[self.daq_channel]
+
     def shutdown(self):
         pass 
 #-------------------------------------------------------------------------------
@@ -9,6 +9,7 @@ from Phidgets.PhidgetException import PhidgetException
 from Phidgets.Devices.InterfaceKit import InterfaceKit
 
 ATTACH_TIMEOUT = 10000 #milliseconds
+NUM_SENSORS    = 8
 
 ###############################################################################
 class Interface(Model):
@@ -45,10 +46,10 @@ class Interface(Model):
         """
         if not self._is_initialized:
             self.initialize()
-        values = []
-        for i in range(8):
-            values.append(self.read_sensor(i))
-        return values    
+        #one pass straight over the driver, hold the mutex once around this
+        #rather than reading each channel under its own acquisition
+        get_value = self._phidget.getSensorRawValue
+        return [get_value(i) for i in range(NUM_SENSORS)]
     
     def read_digital_input(self,index):
         """ reads the digital input at 'index' 
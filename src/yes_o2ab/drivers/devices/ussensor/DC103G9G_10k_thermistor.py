@@ -3,7 +3,6 @@
 #standard python
 import os
 #3rd part provided
-from scipy import interpolate
 from numpy import loadtxt, linspace
 #Automat framework provided
 from automat.core.hwcontrol.devices.device import Device
@@ -11,14 +10,23 @@ from automat.core.hwcontrol.devices.device import Device
 this_dir, _ = os.path.split(os.path.realpath(__file__))
 VOLTAGE_TEMPERATURE_FILENAME = os.path.sep.join((this_dir,"DC103G9G_volt_temp.csv"))
 SENSOR_TO_VOLTAGE = 5.0/(4095)
-#load and interpolate the data curve
-_volt_temp_data = loadtxt(VOLTAGE_TEMPERATURE_FILENAME, delimiter=',')
-_T = _volt_temp_data[:,0]
-_V = _volt_temp_data[:,1]
-_volt_temp_interp = interpolate.splrep(_V,_T,k=3)
+#load and interpolate the data curve on first use
+_volt_temp_interp = None
+
+def _get_volt_temp_interp():
+    "returns the voltage to temperature function, scipy is imported only here"
+    global _volt_temp_interp
+    if _volt_temp_interp is None:
+        from scipy import interpolate
+        volt_temp_data = loadtxt(VOLTAGE_TEMPERATURE_FILENAME, delimiter=',')
+        T = volt_temp_data[:,0]
+        V = volt_temp_data[:,1]
+        tck = interpolate.splrep(V,T,k=3)
+        _volt_temp_interp = lambda V: interpolate.splev(V,tck)
+    return _volt_temp_interp
 
 def volt_to_temp(V):
-    return interpolate.splev(V,_volt_temp_interp) 
+    return _get_volt_temp_interp()(V)
 
 ################################################################################
 #class for thermistor object
@@ -39,7 +47,15 @@ class Interface(Device):
 
     def read(self):
         "reads the thermistor temperature in degrees C"
-        V = self.read_raw_voltage()
+        return self._voltage_to_temp(self.read_raw_voltage())
+
+    def read_from_raw_values(self, values):
+        """ reads the thermistor temperature in degrees C from 'values', the raw
+            values of all the DAQ channels as returned by 'daq.read_all_sensors'
+        """
+        return self._voltage_to_temp(self.raw_voltage_from_values(values))
+
+    def _voltage_to_temp(self, V):
         V = V + self.V0 #apply voltage correction
         T = volt_to_temp(V)
         return T
@@ -50,6 +66,10 @@ class Interface(Device):
         V = SENSOR_TO_VOLTAGE*val
         return V
         
+    def raw_voltage_from_values(self, values):
+        "the uncorrected voltage from the raw values of all the DAQ channels"
+        return SENSOR_TO_VOLTAGE*values[self.daq_channel]
+
     def shutdown(self):
         pass 
 #-------------------------------------------------------------------------------
@@ -1,6 +1,7 @@
 ###############################################################################
 #Dependencies
 #standard python
+import os, time
 OrderedDict = None
 try:
     from collections import OrderedDict
@@ -11,34 +12,167 @@ from automat.core.hwcontrol.devices.instruments import Model
 #other in-house packages
 from FLI import USBCamera
 #3rd party hardware vendor, install from Internet
-import scipy
+import numpy as np
 #package local
 from device import FLIDevice
 ###############################################################################
+MAX_PIXEL_VALUE = 65535 #16bit readout
+TEMPLATE_FILENAME = "FAKE_solar_spectrumBW.gif"
 
+#simulation defaults, all can be overridden from the config file
+SIMULATION_DEFAULTS = OrderedDict([
+    ('signal_rate',      100.0),  #electrons/s per template count
+    ('dark_current',     0.5),    #electrons/s/pixel
+    ('bias_level',       1000.0), #ADU
+    ('read_noise',       10.0),   #electrons rms
+    ('gain',             1.5),    #electrons/ADU
+    ('full_well',        100000.0), #electrons
+    ('readout_overhead', 0.050),  #seconds per readout
+    ('pixel_time',       1.0e-6), #seconds per pixel read out
+    ('shot_noise',       1),      #0 turns off the Poisson noise
+    ('seed',             None),
+])
+
+_template = None
+
+def _load_template():
+    "decode the template image once, it is shared by all fake cameras"
+    global _template
+    if _template is None:
+        from scipy.misc import imread
+        this_path = os.path.dirname(__file__)
+        img_path  = os.sep.join((this_path,TEMPLATE_FILENAME))
+        img = imread(img_path).astype('float64')
+        if img.ndim == 3: #collapse color channels
+            img = img[:,:,:3].mean(axis=2)
+        _template = img
+    return _template
+
+def _bin_pixels(img, hbin = 1, vbin = 1):
+    "sum 'img' over hbin x vbin blocks, dropping any partial block at the edges"
+    if hbin == 1 and vbin == 1:
+        return img
+    rows = img.shape[0]//vbin
+    cols = img.shape[1]//hbin
+    img = img[:rows*vbin,:cols*hbin]
+    return img.reshape((rows,vbin,cols,hbin)).sum(axis=3).sum(axis=1)
 
 ###############################################################################
 class Interface(FLIDevice):
+    """ Simulated camera: frames are synthesized from a template image with
+        signal and dark current scaled by the exposure time, Poisson shot
+        noise, Gaussian read noise and a bias level.  Exposures take their
+        real duration and the readout takes 'readout_overhead' plus
+        'pixel_time' for each pixel read out.
+    """
     _driver_class = USBCamera
-    def __init__(self, serial_number):
+    def __init__(self, serial_number, **kwargs):
         FLIDevice.__init__(self, serial_number=serial_number)
+        self.image_area = None #None means the full frame
+        self.hbin = 1
+        self.vbin = 1
+        self.simulation = SIMULATION_DEFAULTS.copy()
+        self.configure_simulation(**kwargs)
+        self.last_image = None
+        self._exposure = None
+        self._readout_template = None
+
+    def configure_simulation(self, **kwargs):
+        "change the simulation parameters listed in SIMULATION_DEFAULTS"
+        for key, val in kwargs.items():
+            if not key in SIMULATION_DEFAULTS:
+                raise TypeError("invalid simulation parameter '%s'" % key)
+            if val is None or key == 'seed':
+                self.simulation[key] = val
+            else:
+                self.simulation[key] = float(val)
+        seed = self.simulation['seed']
+        if not seed is None:
+            seed = int(seed)
+        self._random = np.random.RandomState(seed)
 
     def set_image_area(self, ul_x, ul_y, lr_x, lr_y):
-        """ Set the image area:
+        """ Set the image area in unbinned CCD pixels:
                 ul_x - upper-left horizontal coordinate
                 ul_y - upper-left vertical coordinate
                 lr_x - lower-right horizontal coordinate
                 lr_y - lower-right vertical coordinate
         """
+        self.configure_readout(image_area = (ul_x,ul_y,lr_x,lr_y),
+                               hbin = self.hbin,
+                               vbin = self.vbin,
+                              )
+
+    def set_image_binning(self, hbin = 1, vbin = 1):
+        """ Set the horizontal and vertical binning factors, the image area is
+            kept and the image shrinks accordingly
+        """
+        self.configure_readout(image_area = self.image_area,
+                               hbin = hbin,
+                               vbin = vbin,
+                              )
+
+    def configure_readout(self, image_area = None, hbin = 1, vbin = 1):
+        """ Set the image area (ul_x,ul_y,lr_x,lr_y) in unbinned CCD pixels
+            and the binning factors, the fake readout crops and bins the
+            template image to match
+        """
         self.initialize()
-        ## FIXME FAKE cannot do this
-        #self._driver.set_image_area(ul_x,ul_y,lr_x,lr_y)
+        if not image_area is None:
+            image_area = tuple(map(int,image_area))
+        geometry = (image_area, int(hbin), int(vbin))
+        if geometry != self.get_readout_geometry():
+            self.image_area, self.hbin, self.vbin = geometry
+            self._readout_template = None
+
+    def get_readout_geometry(self):
+        "returns the (image_area, hbin, vbin) last applied"
+        return (self.image_area, self.hbin, self.vbin)
+
+    def _get_readout_template(self):
+        "the template cropped and binned for the current geometry, cached"
+        if self._readout_template is None:
+            img = _load_template()
+            if not self.image_area is None:
+                ul_x,ul_y,lr_x,lr_y = self.image_area
+                img = img[ul_y:lr_y,ul_x:lr_x]
+            self._readout_template = _bin_pixels(img, hbin = self.hbin, vbin = self.vbin)
+        return self._readout_template
+
+    def _synthesize_image(self, exptime, frametype):
+        sim = self.simulation
+        T = self._get_readout_template()
+        t = exptime/1000.0 #seconds
+        npix = self.hbin*self.vbin #CCD pixels summed into each image pixel
+        if   frametype == 'rbi_flush':
+            electrons = np.empty(T.shape)
+            electrons.fill(sim['full_well']*npix) #floods the CCD
+        elif frametype == 'dark':
+            electrons = np.empty(T.shape)
+            electrons.fill(sim['dark_current']*t*npix)
+        else:
+            electrons  = T*(sim['signal_rate']*t)
+            electrons += sim['dark_current']*t*npix
+        np.minimum(electrons, sim['full_well']*npix, out = electrons)
+        if sim['shot_noise']:
+            electrons = self._random.poisson(electrons).astype('float64')
+        if sim['read_noise'] > 0:
+            electrons += self._random.normal(0.0, sim['read_noise'], size = electrons.shape)
+        adu  = electrons/sim['gain']
+        adu += sim['bias_level']
+        np.clip(adu, 0, MAX_PIXEL_VALUE, out = adu)
+        return adu.astype('uint16')
+
+    def _readout_time(self):
+        sim = self.simulation
+        rows, cols = self._get_readout_template().shape
+        return sim['readout_overhead'] + sim['pixel_time']*rows*cols
     #--------------------------------------------------------------------------
     # Implementation of the Camera Interface
     #--------------------------------------------------------------------------
-    def take_photo(self, 
-                   exptime, 
-                   frametype = "normal",        
+    def take_photo(self,
+                   exptime,
+                   frametype = "normal",
                    bitdepth  = "16bit",
                   ):
         """ Acquire an image with parameters:
@@ -46,21 +180,20 @@ class Interface(FLIDevice):
                 frametype - 'normal' or 'dark', default = 'normal'
                 bitdepth  - '8bit' or '16bit', default = '16bit'
         """
-        self.initialize()
-        #self._driver.set_exposure(exptime = exptime, frametype = frametype)
-        #self._driver.set_bitdepth(bitdepth)
-        #img = self._driver.take_photo() #this call will block
+        self.start_exposure(exptime, frametype = frametype, bitdepth = bitdepth)
+        time.sleep(self.get_exposure_timeleft()/1000.0)
+        img = self.fetch_image()
         #cache the image
-        self.last_image = self.fetch_image()
+        self.last_image = img
         return img
-    
-    def start_exposure(self, 
-                   exptime, 
+
+    def start_exposure(self,
+                   exptime,
                    frametype = "normal",
                    bitdepth  = "16bit",
                   ):
         """ Start an exposure and return immediately.
-            Use the method  'get_timeleft' to check the exposure progress 
+            Use the method  'get_timeleft' to check the exposure progress
             until it returns 0, then use method 'fetch_image' to fetch the image
             data as a numpy array.
             Exposure parameters:
@@ -72,52 +205,69 @@ class Interface(FLIDevice):
                 bitdepth  - '8bit' or '16bit', default = '16bit'
         """
         self.initialize()
-#        self._driver.set_exposure(exptime = exptime, frametype = frametype)
-#        self._driver.set_bitdepth(bitdepth)
-#        self._driver.start_exposure()
-    
+        if not frametype in ('normal','dark','rbi_flush'):
+            raise ValueError("frametype '%s' is not valid" % frametype)
+        exptime = int(exptime)
+        self._exposure = (time.time(), exptime, frametype)
+
     def get_exposure_timeleft(self):
         """ Returns the time left on the exposure in milliseconds.
         """
-        return 0 #self._driver.get_exposure_timeleft()
-        
+        if self._exposure is None:
+            return 0
+        t0, exptime, frametype = self._exposure
+        time_left = exptime - 1000.0*(time.time() - t0)
+        return max(int(round(time_left)), 0)
+
     def fetch_image(self):
-        """ Fetch the image data for the last exposure.
+        """ Fetch the image data for the last exposure, blocks through the
+            rest of the exposure and the readout time.
             Returns a numpy.ndarray object.
         """
-        import os
-        from scipy.misc import imread
-        this_path = os.path.dirname(__file__)
-        img_path = os.sep.join((this_path,"FAKE_solar_spectrumBW.gif"))
-        img = imread(img_path)
+        if self._exposure is None:
+            raise RuntimeError("no exposure has been started")
+        t0, exptime, frametype = self._exposure
+        self._exposure = None
+        img = self._synthesize_image(exptime, frametype)
+        #the readout starts when the exposure ends
+        t_done = t0 + exptime/1000.0 + self._readout_time()
+        wait = t_done - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        self.last_image = img
         return img
 
     def show_image(self):
         """ displays the last taken image with pylab.imshow
         """
+        import scipy.misc
         scipy.misc.imshow(self.last_image)
-    
+
     def save_image(self, filename):
+        import scipy.misc
         scipy.misc.imsave(filename, self.last_image)
-   
+
     #--------------------------------------------------------------------------
     # Query Functions
     #--------------------------------------------------------------------------
     def get_CC_temp(self):
         "gets the Camera cooler's Cold-side (also CCD) temperature in degrees Celcius"
         return 0.0
-    
+
     def get_CH_temp(self):
         "gets the Camera cooler's Hot-side temperature in degrees Celcius"
         return 0.0
-        
+
     def get_CC_power(self):
         "gets the Camera cooler's power in watts"
         return 0.0
-    
+
     def get_info(self):
-        return OrderedDict()
-        
+        info = OrderedDict()
+        info['model'] = "FAKE camera"
+        info.update(self.simulation)
+        return info
+
     #--------------------------------------------------------------------------
     # Command Functions
     #--------------------------------------------------------------------------
@@ -125,23 +275,35 @@ class Interface(FLIDevice):
         "gets the Camera cooler's Cold-side (also CCD) temperature in degrees Celcius"
         pass
         #self._driver.set_temperature(temp)
-        
+
     def shutdown(self):
-        pass 
-      
+        pass
+
 
 #------------------------------------------------------------------------------
-# INTERFACE CONFIGURATOR         
+# INTERFACE CONFIGURATOR
 def get_interface(serial_number, **kwargs):
-    obj = Interface(serial_number=serial_number)
+    sim_kwargs = {}
+    for key in SIMULATION_DEFAULTS.keys():
+        if key in kwargs:
+            sim_kwargs[key] = kwargs.pop(key)
+    obj = Interface(serial_number=serial_number, **sim_kwargs)
     image_area = kwargs.pop('image_area', None)
-    if not image_area is None:
-        ul_x,ul_y,lr_x,lr_y = map(int,image_area)
-        obj.set_image_area(ul_x,ul_y,lr_x,lr_y)
+    hbin = int(kwargs.pop('hbin', 1))
+    vbin = int(kwargs.pop('vbin', 1))
+    if not image_area is None or hbin != 1 or vbin != 1:
+        obj.configure_readout(image_area = image_area, hbin = hbin, vbin = vbin)
     return obj
-    
+
 ###############################################################################
 # TEST CODE
 ###############################################################################
 if __name__ == "__main__":
-    pass
+    camera = get_interface(serial_number='FAKE', seed = 0)
+    for frametype in ('normal','dark'):
+        t0 = time.time()
+        camera.start_exposure(100, frametype = frametype)
+        while camera.get_exposure_timeleft() > 0:
+            time.sleep(0.01)
+        I = camera.fetch_image()
+        print frametype, I.shape, I.dtype, I.mean(), "%0.3f s" % (time.time() - t0)
@@ -9,6 +9,7 @@ from Phidgets.PhidgetException import PhidgetException
 from Phidgets.Devices.InterfaceKit import InterfaceKit
 
 ATTACH_TIMEOUT = 10000 #milliseconds
+NUM_SENSORS    = 8
 
 ###############################################################################
 class Interface(Model):
@@ -28,10 +29,7 @@ class Interface(Model):
         """ reads all the sensors raw values, indices 0-7
             returns list of 8 integers in range [0,4095]
         """
-        values = []
-        for i in range(8):
-            values.append(self.read_sensor(i))
-        return values   
+        return [self.read_sensor(i) for i in range(NUM_SENSORS)]
          
     def read_digital_input(self,index):
         """ reads the digital input at 'index' 